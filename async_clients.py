@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+from urllib.parse import quote, urlparse
+
+import aiohttp
+from google.auth.transport.requests import Request
+
+import import_google
+import metrics
+import script
+from rate_limit import backoff_delay, is_rate_limit_error, is_retryable_status
+from batch import get_credentials, get_federation_id, get_safe_name, get_user_label
+
+GOOGLE_API_URL = "https://www.googleapis.com/calendar/v3"
+CELCAT_CONCURRENCY = 4
+GOOGLE_CONCURRENCY = 10
+CONNECTION_LIMIT = 32
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=120)
+
+class GoogleApiError(Exception):
+    def __init__(self, status, content):
+        super().__init__(f"Google API returned {status}: {content[:200]}")
+        self.status = status
+        self.content = content
+
+class HostLimiter:
+    # One semaphore per host, shared by every client of a pipeline so the
+    # number of requests in flight to CELCAT or Google stays bounded no
+    # matter how many users are processed.
+    def __init__(self, limits, default=CELCAT_CONCURRENCY):
+        self.limits = limits
+        self.default = default
+        self._semaphores = {}
+
+    def get(self, url):
+        host = urlparse(url).hostname
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.limits.get(host, self.default))
+        return self._semaphores[host]
+
+def open_http_session(connector):
+    # Sessions share the connection pool but never their cookies
+    return aiohttp.ClientSession(connector=connector, connector_owner=False,
+                                 cookie_jar=aiohttp.CookieJar(), timeout=REQUEST_TIMEOUT)
+
+class AsyncCelcatClient:
+    def __init__(self, http, limiter):
+        self.http = http
+        self.limiter = limiter
+
+    async def _request(self, method, url, **kwargs):
+        async with self.limiter.get(url):
+            async with self.http.request(method, url, **kwargs) as response:
+                text = await response.text()
+                metrics.count("celcat.http_requests")
+                metrics.count("celcat.bytes_received", len(text))
+                return response.status, str(response.url), text, [(name, morsel.value) for name, morsel in response.cookies.items()]
+
+    async def login(self, username, password):
+        login_url = f"{script.scheme}://{script.domain}/LdapLogin"
+        logon_url = f"{script.scheme}://{script.domain}/LdapLogin/Logon"
+
+        status, _, page, _ = await self._request("GET", login_url, headers=script.LOGIN_HEADERS)
+        if status != 200:
+            raise Exception(f"Failed to load login page. Status code: {status}")
+
+        # HTML parsing is CPU bound, keep it off the event loop
+        token = await asyncio.to_thread(script.extract_verification_token, page)
+        if token is None:
+            raise Exception("Anti-forgery token not found on login page")
+
+        status, url, page, _ = await self._request("POST", logon_url, headers=script.LOGIN_HEADERS,
+                                                   data=script.get_login_data(username, password, token))
+        if "LdapLogin" in url:
+            error_message = await asyncio.to_thread(script.extract_login_error, page)
+            if error_message:
+                print(f"Error message found: {error_message}")
+            raise Exception("Login failed. Please check your credentials.")
+        if "CalendarViewType=Unknown" not in url:
+            raise Exception("Login process resulted in an unexpected redirect")
+
+        status, url, page, cookies = await self._request("GET", script.get_calendar_page_url(username),
+                                                         headers=script.LOGIN_HEADERS)
+        if status != 200:
+            raise Exception(f"Failed to load calendar page. Status code: {status}")
+
+        return await asyncio.to_thread(script.extract_federation_id_from_page, url, page, cookies)
+
+    async def get_data(self, start_date, end_date, federation_id):
+        if not federation_id:
+            raise ValueError("Federation ID cannot be empty")
+
+        url, headers, data = script.get_calendar_request(start_date, end_date, federation_id)
+        _, _, text, _ = await self._request("POST", url, headers=headers, data=data)
+        if not text:
+            print("Response content is empty")
+            return None
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            print(f"Failed to parse JSON: {e}")
+            return None
+
+    async def get_data_range(self, start_date, end_date, federation_id, chunk="month"):
+        chunks = script.split_date_range(start_date, end_date, chunk)
+        results = await asyncio.gather(*(self.get_data(chunk_start, chunk_end, federation_id)
+                                         for chunk_start, chunk_end in chunks))
+        if any(result is None for result in results):
+            return None
+
+        events = {}
+        for result in results:
+            for event in result:
+                events.setdefault(event['id'], event)
+        return list(events.values())
+
+class AsyncGoogleCalendarClient:
+    def __init__(self, http, credentials, limiter):
+        self.http = http
+        self.credentials = credentials
+        self.limiter = limiter
+        self._refresh_lock = asyncio.Lock()
+
+    async def _get_headers(self):
+        if not self.credentials.valid:
+            async with self._refresh_lock:
+                if not self.credentials.valid:
+                    await asyncio.to_thread(self.credentials.refresh, Request())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def _call(self, method, path, params=None, body=None):
+        url = f"{GOOGLE_API_URL}{path}"
+        rate_limiter = import_google.GOOGLE_RATE_LIMITER
+        attempt = 0
+        while True:
+            await rate_limiter.acquire_async()
+            async with self.limiter.get(url):
+                headers = await self._get_headers()
+                async with self.http.request(method, url, params=params, json=body, headers=headers) as response:
+                    status = response.status
+                    content = await response.text()
+            metrics.count("google.http_requests")
+            metrics.count("google.calls")
+            if status < 400:
+                rate_limiter.on_success()
+                return json.loads(content) if content else None
+            if not is_retryable_status(status, content) or attempt >= import_google.MAX_RETRIES:
+                raise GoogleApiError(status, content)
+            if is_rate_limit_error(status, content):
+                metrics.count("google.throttled")
+                rate_limiter.on_throttle()
+            metrics.count("google.retries")
+            # The semaphore is released while waiting, other calls go on
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def _events_path(self, calendar_id, event_id=None):
+        path = f"/calendars/{quote(calendar_id, safe='')}/events"
+        return f"{path}/{event_id}" if event_id else path
+
+    async def list_events(self, calendar_id, time_min, time_max, fields):
+        params = {
+            "timeMin": time_min,
+            "timeMax": time_max,
+            "singleEvents": "true",
+            "maxResults": str(import_google.MAX_LIST_RESULTS),
+            "fields": fields,
+        }
+        while True:
+            result = await self._call("GET", self._events_path(calendar_id), params=params)
+            for event in result.get("items", []):
+                yield event
+            if not result.get("nextPageToken"):
+                return
+            params["pageToken"] = result["nextPageToken"]
+
+    async def insert_event(self, calendar_id, body):
+        return await self._call("POST", self._events_path(calendar_id), body=body)
+
+    async def patch_event(self, calendar_id, event_id, body):
+        return await self._call("PATCH", self._events_path(calendar_id, event_id), body=body)
+
+    async def delete_event(self, calendar_id, event_id):
+        return await self._call("DELETE", self._events_path(calendar_id, event_id))
+
+    async def _run_all(self, calls, action):
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for error in errors:
+            if isinstance(error, asyncio.CancelledError):
+                raise error
+            print(f"Failed to {action} event: {error}")
+        return len(results) - len(errors), len(errors)
+
+    async def sync_events(self, calendar_id, google_events, start_date, end_date):
+        time_min, time_max = import_google.get_time_bounds(start_date, end_date)
+        existing = [event async for event in self.list_events(calendar_id, time_min, time_max,
+                                                               import_google.SYNC_LIST_FIELDS)]
+        stale, to_insert, to_patch, unchanged = import_google.plan_sync(google_events, existing, time_min)
+
+        deleted, delete_failed = await self._run_all(
+            [self.delete_event(calendar_id, event['id']) for event in stale], "delete")
+        inserted, insert_failed = await self._run_all(
+            [self.insert_event(calendar_id, event) for _, event in to_insert], "insert")
+        updated, patch_failed = await self._run_all(
+            [self.patch_event(calendar_id, event_id, event) for _, event_id, event in to_patch], "patch")
+
+        counts = {
+            'inserted': inserted,
+            'updated': updated,
+            'deleted': deleted,
+            'unchanged': unchanged,
+            'failed': delete_failed + insert_failed + patch_failed,
+        }
+        import_google.print_sync_summary(calendar_id, counts)
+        return counts
+
+    async def replace_events(self, calendar_id, google_events, start_date, end_date):
+        time_min, time_max = import_google.get_time_bounds(start_date, end_date)
+        existing = [event async for event in self.list_events(calendar_id, time_min, time_max,
+                                                               import_google.CLEAR_LIST_FIELDS)]
+        deleted, delete_failed = await self._run_all(
+            [self.delete_event(calendar_id, event['id']) for event in existing], "delete")
+        inserted, insert_failed = await self._run_all(
+            [self.insert_event(calendar_id, event) for _, event in google_events], "insert")
+
+        counts = {
+            'inserted': inserted,
+            'deleted': deleted,
+            'failed': delete_failed + insert_failed,
+        }
+        print(f"Replaced events of {calendar_id}: {deleted} deleted, {inserted} inserted, {counts['failed']} failed")
+        return counts
+
+def get_user_calendar_ids(user):
+    # A calendar_mappings column lets every user push to their own calendars
+    if user.get('calendar_mappings'):
+        return json.loads(user['calendar_mappings'])
+    return import_google.CALENDAR_IDS
+
+async def fetch_user(connector, limiter, user, viewer, start_date, end_date, chunk):
+    async with open_http_session(connector) as http:
+        client = AsyncCelcatClient(http, limiter)
+        federation_id = get_federation_id(user, await client.login(*get_credentials(user, viewer)))
+        data = await client.get_data_range(start_date, end_date, federation_id, chunk)
+    if data is None:
+        raise Exception("Failed to retrieve or parse calendar data")
+    return federation_id, script.get_module_calendars(data)
+
+async def push_user(google, user, module_calendars, start_date, end_date, sync):
+    calendar_ids = get_user_calendar_ids(user)
+    pushes = []
+    for module, events in module_calendars.items():
+        calendar_id = calendar_ids.get(module)
+        if not calendar_id:
+            continue
+        google_events = import_google.records_to_google_events(events)
+        if sync:
+            pushes.append(google.sync_events(calendar_id, google_events, start_date, end_date))
+        else:
+            pushes.append(google.replace_events(calendar_id, google_events, start_date, end_date))
+    failed = sum(counts['failed'] for counts in await asyncio.gather(*pushes))
+    if failed:
+        # Reported with the users that failed, instead of only printed
+        raise Exception(f"{failed} event(s) could not be pushed to Google Calendar")
+
+async def run_pipeline(users, viewer, start_date, end_date, chunk="month", sync=True, output_dir=None):
+    # Fetching user N+1 from CELCAT overlaps with pushing user N to Google:
+    # the queue holds at most one fetched user waiting for the consumer.
+    connector = aiohttp.TCPConnector(limit=CONNECTION_LIMIT)
+    limiter = HostLimiter({"www.googleapis.com": GOOGLE_CONCURRENCY}, CELCAT_CONCURRENCY)
+    credentials = await asyncio.to_thread(import_google.get_google_credentials)
+    queue = asyncio.Queue(maxsize=1)
+    failures = {}
+
+    async def produce():
+        for user in users:
+            label = get_user_label(user)
+            try:
+                federation_id, module_calendars = await fetch_user(connector, limiter, user, viewer,
+                                                                   start_date, end_date, chunk)
+                if output_dir:
+                    directory = os.path.join(output_dir, get_safe_name(federation_id))
+                    await asyncio.to_thread(script.write_ical_files, module_calendars, directory,
+                                            start_date, end_date)
+            except Exception as e:
+                print(f"[{label}] fetch failed: {e}")
+                failures[label] = str(e)
+                continue
+            print(f"[{label}] fetched, {sum(len(events) for events in module_calendars.values())} events")
+            await queue.put((user, module_calendars))
+        await queue.put(None)
+
+    async def consume():
+        async with open_http_session(connector) as http:
+            google = AsyncGoogleCalendarClient(http, credentials, limiter)
+            while (item := await queue.get()) is not None:
+                user, module_calendars = item
+                label = get_user_label(user)
+                try:
+                    await push_user(google, user, module_calendars, start_date, end_date, sync)
+                    print(f"[{label}] pushed to Google Calendar")
+                except Exception as e:
+                    print(f"[{label}] push failed: {e}")
+                    failures[label] = str(e)
+
+    producer = asyncio.create_task(produce())
+    consumer = asyncio.create_task(consume())
+    try:
+        await asyncio.gather(producer, consumer)
+    except BaseException:
+        # Cancellation (Ctrl+C, SIGTERM handlers, timeouts) stops both
+        # sides, the sessions are closed by their context managers.
+        producer.cancel()
+        consumer.cancel()
+        await asyncio.gather(producer, consumer, return_exceptions=True)
+        raise
+    finally:
+        await connector.close()
+
+    return failures
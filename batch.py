@@ -0,0 +1,197 @@
+import argparse
+import csv
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from event_store import EventStore
+from script import login_cached, get_data_range, get_module_calendars, write_ical_files, get_month_range, parse_date
+
+def read_users(path):
+    # CSV file with a header row and the columns username, password and
+    # federation_id. Rows without a password are fetched with the viewer
+    # account given on the command line.
+    with open(path, newline='', encoding='utf-8') as f:
+        users = []
+        for row in csv.DictReader(f):
+            user = {key: (value or '').strip() for key, value in row.items() if key}
+            if user.get('username') or user.get('federation_id'):
+                users.append(user)
+    return users
+
+def get_user_label(user):
+    return user.get('federation_id') or user.get('username')
+
+def get_safe_name(value):
+    return re.sub(r'[^\w.-]+', '_', value).strip('_') or "user"
+
+def get_credentials(user, viewer):
+    # Rows without a password log in with the viewer account
+    if user.get('password'):
+        username, password = user['username'], user['password']
+    else:
+        username, password = viewer
+
+    if not username or not password:
+        raise ValueError("No credentials for this user and no viewer account given")
+    return username, password
+
+def get_federation_id(user, federation_id):
+    # The users file wins over the ID read from the calendar page
+    federation_id = user.get('federation_id') or federation_id
+    if not federation_id:
+        raise ValueError("Unable to extract federation ID, add it to the users file")
+    return federation_id
+
+def login_user(user, viewer):
+    session, federation_id = login_cached(*get_credentials(user, viewer))
+    return session, get_federation_id(user, federation_id)
+
+def list_payload_files(paths):
+    # Directories are read for their .json files, in name order
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".json"))
+        else:
+            files.append(path)
+    return files
+
+def export_user(user, viewer, start_date, end_date, output_dir, chunk="month", fetch_workers=1, store=None, exporter=None):
+    # Runs in a worker thread or process, every call gets its own
+    # requests.Session so users never share cookies.
+    started = time.perf_counter()
+    result = {
+        'user': get_user_label(user),
+        'federation_id': None,
+        'status': 'failed',
+        'events': 0,
+        'files': [],
+        'error': None,
+    }
+    try:
+        session, federation_id = login_user(user, viewer)
+        result['federation_id'] = federation_id
+
+        data = get_data_range(session, start_date, end_date, federation_id, chunk, fetch_workers)
+        if data is None:
+            raise Exception("Failed to retrieve or parse calendar data")
+        result['events'] = len(data)
+
+        directory = os.path.join(output_dir, get_safe_name(federation_id))
+        module_calendars = get_module_calendars(data, store)
+        result['files'] = write_ical_files(module_calendars, directory, start_date, end_date)
+        if exporter is not None:
+            exporter.add(federation_id, module_calendars)
+        result['status'] = 'ok'
+    except Exception as e:
+        result['error'] = str(e)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+def run_batch(users, viewer, start_date, end_date, output_dir, workers=4, executor="thread", chunk="month", fetch_workers=1,
+              events_dir=None):
+    pool_class = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+    # Parsed events can only be shared between threads, every process of a
+    # process pool parses its own users.
+    store = EventStore() if executor == "thread" else None
+    exporter = None
+    if events_dir:
+        from event_export import EventExporter
+        exporter = EventExporter(events_dir)
+    started = time.perf_counter()
+
+    results = []
+    with pool_class(max_workers=workers) as pool:
+        futures = [pool.submit(export_user, user, viewer, start_date, end_date, output_dir, chunk, fetch_workers, store,
+                               exporter)
+                   for user in users]
+        for future in as_completed(futures):
+            result = future.result()
+            if result['status'] == 'ok':
+                print(f"[{result['user']}] exported {result['events']} events in {result['seconds']}s")
+            else:
+                print(f"[{result['user']}] failed after {result['seconds']}s: {result['error']}")
+            results.append(result)
+    manifest = exporter.close() if exporter is not None else None
+
+    failed = [result for result in results if result['status'] != 'ok']
+    return {
+        'start': start_date.strftime("%Y-%m-%d"),
+        'end': end_date.strftime("%Y-%m-%d"),
+        'workers': workers,
+        'executor': executor,
+        'users': len(results),
+        'succeeded': len(results) - len(failed),
+        'failed': len(failed),
+        'seconds': round(time.perf_counter() - started, 3),
+        'event_store': store.stats() if store is not None else None,
+        'events_export': manifest['counts'] if manifest is not None else None,
+        'results': sorted(results, key=lambda result: result['user']),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export CELCAT calendars for a list of users without prompts.")
+    parser.add_argument("users", help="CSV file with username, password and federation_id columns.")
+    parser.add_argument("--from", dest="start_date", type=parse_date,
+                        help="First day to export (YYYY-MM-DD, default: first day of the current month).")
+    parser.add_argument("--to", dest="end_date", type=parse_date,
+                        help="Last day to export (YYYY-MM-DD, default: last day of the current month).")
+    parser.add_argument("--chunk", choices=["month", "week"], default="month",
+                        help="Size of the requests the date range is split into (default: month).")
+    parser.add_argument("--workers", type=int, default=4, help="Number of users processed concurrently (default: 4).")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="Run users in a thread pool or a process pool (default: thread).")
+    parser.add_argument("--fetch-workers", type=int, default=1,
+                        help="Number of chunks fetched concurrently for each user (default: 1).")
+    parser.add_argument("--output", default="calendar_batch_export", help="Output directory (default: calendar_batch_export).")
+    parser.add_argument("--events", metavar="DIR",
+                        help="Also export the parsed events of every user to this directory as Parquet or "
+                             "compressed JSON lines (thread executor only).")
+    parser.add_argument("--summary", help="Where to write the JSON summary (default: <output>/summary.json).")
+    parser.add_argument("--username", default=os.getenv("CELCAT_USERNAME"),
+                        help="Viewer account used for rows without a password (default: $CELCAT_USERNAME).")
+    parser.add_argument("--password", default=os.getenv("CELCAT_PASSWORD"),
+                        help="Password of the viewer account (default: $CELCAT_PASSWORD).")
+    args = parser.parse_args(argv)
+    if (args.start_date is None) != (args.end_date is None):
+        parser.error("--from and --to must be used together")
+    if args.events and args.executor != "thread":
+        parser.error("--events needs the thread executor")
+    if args.events:
+        # Checked before anything is fetched, EventExporter refuses it too
+        from event_export import is_used_directory
+        if is_used_directory(args.events):
+            parser.error(f"'{args.events}' is not empty, choose a new directory for the event export")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.start_date:
+        start_date, end_date = args.start_date, args.end_date
+    else:
+        current_date = datetime.now()
+        start_date, end_date = get_month_range(current_date.year, current_date.month)
+
+    users = read_users(args.users)
+    print(f"Exporting {len(users)} user(s) from {start_date.date()} to {end_date.date()} "
+          f"with {args.workers} {args.executor} worker(s)...")
+
+    summary = run_batch(users, (args.username, args.password), start_date, end_date, args.output,
+                        args.workers, args.executor, args.chunk, args.fetch_workers, args.events)
+
+    summary_path = args.summary or os.path.join(args.output, "summary.json")
+    os.makedirs(os.path.dirname(summary_path) or ".", exist_ok=True)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+    print(f"\n{summary['succeeded']} user(s) exported, {summary['failed']} failed in {summary['seconds']}s.")
+    print(f"Summary written to {summary_path}")
+    return summary
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,592 @@
+import argparse
+import contextlib
+import hashlib
+import html
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytz
+
+import ics
+import import_google
+import script
+from event_export import EventExporter, read_export
+from event_index import EventIndex
+from fetch_cache import ResponseCache
+from tests.fakes import FakeGoogleService
+
+MODULES = ["031 Anatomie", "032 Physiologie", "033 Biochimie", "041 Pharmacologie", "061 Chimie", "062 Microbiologie"]
+CATEGORIES = ["TD", "CM", "TP", "e-learning", "Journée Thématique", "FERIE"]
+ROOMS = ["Porte 12", "Amphi A", "Amphi B", "Salle 104", "Espace Modulaire 2"]
+TEACHERS = ["DUPONT Jean", "MARTIN Léa", "LEFÈVRE Anne-Sophie", "O'BRIEN Kévin", "NGUYEN Thi Thu Hương"]
+GROUPS = ["[VET] Classe A1", "[VET] Classe A2", "[VET] Groupe TD 3", "[VET] Classe B1"]
+
+def make_payload(event_count, start_date=datetime(2026, 9, 1), seed=0, first_id=1000000):
+    # Synthetic GetCalendarData events shaped like the ones CELCAT returns
+    rng = random.Random(seed)
+    events = []
+    for index in range(event_count):
+        day = start_date + timedelta(days=index // 6)
+        start = day.replace(hour=8 + 2 * (index % 6) % 10)
+        description_lines = [rng.choice(CATEGORIES)]
+        description_lines += rng.sample(ROOMS, rng.randint(1, 2))
+        description_lines += rng.sample(TEACHERS, rng.randint(1, 3))
+        description_lines += rng.sample(GROUPS, rng.randint(1, 3))
+        events.append({
+            "id": f"-{first_id + index}",
+            "start": start.strftime("%Y-%m-%dT%H:%M:%S"),
+            "end": (start + timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%S"),
+            "allDay": False,
+            "description": "<br />".join(html.escape(line, quote=False) for line in description_lines),
+            "eventCategory": rng.choice(CATEGORIES),
+            "modules": [rng.choice(MODULES)] if rng.random() < 0.9 else [],
+            "sites": ["Nantes"],
+        })
+    return events
+
+def legacy_generate_ical(events, calendar_name):
+    # generate_ical as it was before the ics module, kept as a reference
+    ical = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:-//Oniris Nantes//CELCAT {calendar_name}//FR",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:CELCAT-EDT {calendar_name}",
+        "X-WR-TIMEZONE:Europe/Paris"
+    ]
+
+    now = datetime.now(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+
+    def clean_and_escape(text):
+        decoded = html.unescape(text)
+        return decoded.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+    for record in events:
+        description = f"{record.description}\n"
+        if record.locations:
+            description += f"Salle(s): {', '.join(record.locations)}\n"
+        if record.teachers:
+            description += f"Professeur(e)(s): {', '.join(record.teachers)}\n"
+        if record.class_groups:
+            description += f"Classe(s)/Groupe(s): {', '.join(record.class_groups)}"
+
+        ical.extend([
+            "BEGIN:VEVENT",
+            f"UID:{record.id}",
+            f"DTSTAMP:{now}",
+            f"DTSTART:{record.start.replace('-', '').replace(':', '') if record.start else ''}",
+            f"DTEND:{record.end.replace('-', '').replace(':', '') if record.end else ''}",
+            f"SUMMARY:{clean_and_escape(record.title)}",
+            f"DESCRIPTION:{clean_and_escape(description)}",
+            f"CATEGORIES:{clean_and_escape(record.category)}",
+        ])
+        ical.append("END:VEVENT")
+
+    ical.append("END:VCALENDAR")
+    return "\r\n".join(ical)
+
+def time_best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_ical_benchmark(event_count, repeat):
+    # Real calendars repeat the same courses every week, the synthetic
+    # payload gives nearly every event its own description. Both are timed
+    # from empty caches, like the first calendar of a run.
+    payload = make_payload(event_count)
+    courses = [event['description'] for event in payload[:80]]
+    rng = random.Random(1)
+    repeated = [dict(event, description=rng.choice(courses)) for event in payload]
+
+    for label, data in (("distinct descriptions", payload), ("80 repeated courses", repeated)):
+        module_calendars = script.get_module_calendars(data)
+        all_events = [item for events in module_calendars.values() for item in events]
+
+        def generate_from_empty_caches():
+            ics.clear_caches()
+            script.generate_ical(all_events, "Main")
+
+        legacy = time_best(lambda: legacy_generate_ical(all_events, "Main"), repeat)
+        current = time_best(generate_from_empty_caches, repeat)
+
+        print(f"generate_ical, {len(all_events)} events with {label}, best of {repeat}:")
+        print(f"  legacy:  {legacy * 1000:8.2f} ms  ({len(all_events) / legacy:10.0f} events/s)")
+        print(f"  current: {current * 1000:8.2f} ms  ({len(all_events) / current:10.0f} events/s)")
+        print(f"  ratio:   {legacy / current:8.2f}x")
+
+SPANS = {"week": 7, "month": 30, "year": 365}
+EVENTS_PER_DAY = 6
+# Students of the same class get the same events from CELCAT
+CLASS_COUNT = 20
+BASELINE_PATH = "benchmark_baseline.json"
+# Entry points timed by the startup check, and the packages that only the
+# runs needing them should load.
+STARTUP_MODULES = ["orchestrator", "script", "daemon", "feed_server", "batch", "import_google"]
+HEAVY_PACKAGES = ["googleapiclient", "google_auth_oauthlib", "icalendar", "bs4", "aiohttp", "asyncio"]
+
+def make_class_payloads(event_count, class_count, start_date=datetime(2026, 9, 1)):
+    return [make_payload(event_count, start_date, seed=index, first_id=1000000 * (index + 1))
+            for index in range(class_count)]
+
+def get_user_payloads(user_count, event_count, start_date=datetime(2026, 9, 1)):
+    classes = make_class_payloads(event_count, min(user_count, CLASS_COUNT), start_date)
+    return {f"user{index}": classes[index % len(classes)] for index in range(user_count)}
+
+# Round trip of one simulated Google HTTP request, for the stages that
+# measure how well imports overlap
+GOOGLE_LATENCY = 0.02
+
+def make_page(body, rows=400):
+    # About the size of the CELCAT pages: scripts and styles in the head, a
+    # long body of navigation and hidden calendar markup after the element
+    # the client looks for.
+    head = "".join(f'<link rel="stylesheet" href="/Content/style{i}.css" /><script src="/Scripts/lib{i}.js"></script>\n'
+                   for i in range(20))
+    filler = "".join(f'<div class="row" data-index="{i}"><span class="label">Ressource {i} &amp; salle</span>'
+                     f'<input type="hidden" name="Res{i}" value="{i}" /><br></div>\n' for i in range(rows))
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8" /><title>CELCAT Calendar</title>{head}</head>'
+            f'<body><div class="container body-content">{body}{filler}</div></body></html>')
+
+LOGIN_PAGE = make_page('<form action="/LdapLogin/Logon" method="post">'
+                       '<input name="__RequestVerificationToken" type="hidden" value="stub-token" />'
+                       '<input class="form-control" id="Name" name="Name" type="text" value="" />'
+                       '<span class="field-validation-valid" data-valmsg-for="WrongCredentials"></span></form>')
+
+def make_calendar_page(federation_id):
+    return make_page('<ul class="nav navbar-nav navbar-right"><li><a class="logInOrOut" href="/LdapLogin/Logout">'
+                     f'<span class="glyphicon glyphicon-log-out"></span> Log Out <span class="small">{federation_id} - {federation_id}</span>'
+                     '</a></li></ul>')
+
+class StubCelcatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+    payloads = {}
+
+    def send(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/LdapLogin":
+            self.send(200, LOGIN_PAGE.encode("utf-8"), [("Content-Type", "text/html; charset=utf-8")])
+        elif path in ("/", "/cal"):
+            query = dict(urllib.parse.parse_qsl(self.path.partition("?")[2]))
+            self.send(200, make_calendar_page(query.get("fid0", "")).encode("utf-8"),
+                      [("Content-Type", "text/html; charset=utf-8")])
+        else:
+            self.send(404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+        form = dict(urllib.parse.parse_qsl(body))
+        if self.path == "/LdapLogin/Logon":
+            self.send(302, headers=[("Location", "/?CalendarViewType=Unknown"),
+                                    ("Set-Cookie", "stub-session=1; Path=/")])
+        elif self.path == "/Home/GetCalendarData":
+            events = self.payloads.get(form.get("federationIds[]"))
+            if events is None:
+                self.send(404)
+                return
+            content = self.get_content(form["federationIds[]"], form["start"], form["end"])
+            etag = f'"{hashlib.sha1(content).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send(304, headers=[("ETag", etag)])
+            else:
+                self.send(200, content, [("Content-Type", "application/json; charset=utf-8"), ("ETag", etag)])
+        else:
+            self.send(404)
+
+    def get_content(self, federation_id, start, end):
+        # Rendered once per chunk, like a server-side cache would
+        key = (federation_id, start, end)
+        if key not in self.contents:
+            # Both days are included, like get_month_range ranges
+            events = [event for event in self.payloads[federation_id]
+                      if event['start'][:10] <= end and (event['end'] or event['start'])[:10] >= start]
+            self.contents[key] = json.dumps(events).encode("utf-8")
+        return self.contents[key]
+
+    def log_message(self, format, *args):
+        pass
+
+class StubCelcatServer:
+    # Local CELCAT look-alike: the login form, the calendar page and
+    # GetCalendarData with ETags. Every username logs in as the federation
+    # ID of the same name.
+    def __init__(self, payloads):
+        handler = type("Handler", (StubCelcatHandler,), {"payloads": payloads, "contents": {}})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self._domain, self._scheme = script.domain, script.scheme
+        script.domain = f"127.0.0.1:{self.server.server_address[1]}"
+        script.scheme = "http"
+        return self
+
+    def __exit__(self, *exc_info):
+        script.domain, script.scheme = self._domain, self._scheme
+        self.server.shutdown()
+        self.server.server_close()
+
+def unthrottle(limiter):
+    # The fake service has no quota, pacing would only measure the limiter
+    limiter.rate = limiter.max_rate = limiter.burst = limiter.tokens = float("inf")
+
+def measure(stage, func, event_count, repeat=1, setup=None, trace_memory=True):
+    # Timed without tracemalloc, which slows allocations down, then run once
+    # more under tracemalloc for the peak memory of the stage.
+    print(f"Running {stage}...", file=sys.stderr)
+    best = None
+    for _ in range(repeat):
+        state = setup() if setup else None
+        started = time.perf_counter()
+        func(state) if setup else func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = 0
+    if trace_memory:
+        state = setup() if setup else None
+        tracemalloc.start()
+        func(state) if setup else func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'stage': stage,
+        'events': event_count,
+        'seconds': round(best, 6),
+        'events_per_second': round(event_count / best) if best else 0,
+        'peak_mb': round(peak / 2 ** 20, 2),
+    }
+
+def measure_retained(payloads):
+    # Memory still held by the parsed calendars once every user's decoded
+    # payload is gone, like a batch run keeps them. Run first so no earlier
+    # stage has already interned the strings.
+    texts = [json.dumps(data) for data in payloads.values()]
+    tracemalloc.start()
+    calendars = [script.get_module_calendars(json.loads(text)) for text in texts]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del calendars
+    return round(retained / 2 ** 20, 2)
+
+def get_peak_rss_mb():
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+def parse_importtime(output):
+    # Lines of python -X importtime: "import time: self | cumulative | name",
+    # nested imports are indented under the module importing them.
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            imports.append((name.rstrip()[1:], int(cumulative)))
+    return imports
+
+def measure_startup(modules=STARTUP_MODULES, repeat=3):
+    # Each module is imported in a fresh interpreter, the best of repeat runs
+    # is kept. Disk caches are warm after the first one, like for a cron job.
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in modules:
+        best = None
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                     cwd=directory, capture_output=True, text=True)
+            if process.returncode:
+                raise Exception(f"import {module} failed: {process.stderr.strip().splitlines()[-1]}")
+            imports = parse_importtime(process.stderr)
+            total = next(cumulative for name, cumulative in reversed(imports) if name == module)
+            if best is None or total < best[0]:
+                best = (total, imports)
+        loaded = {name.strip().split(".")[0] for name, _ in best[1]}
+        results.append({'module': module, 'import_ms': round(best[0] / 1000, 1),
+                        'heavy': [package for package in HEAVY_PACKAGES if package in loaded]})
+    return results
+
+def run_suite(span="month", user_count=1, repeat=3, event_count=None, trace_memory=True, startup=True):
+    event_count = event_count or SPANS[span] * EVENTS_PER_DAY
+    start_date = datetime(2026, 9, 1)
+    end_date = start_date + timedelta(days=max(SPANS[span], event_count // EVENTS_PER_DAY + 1) - 1)
+    payloads = get_user_payloads(user_count, event_count, start_date)
+    total_events = event_count * user_count
+    module_calendars = {username: script.get_module_calendars(data) for username, data in payloads.items()}
+    records = {username: [item for events in calendars.values() for item in events]
+               for username, calendars in module_calendars.items()}
+    pushed_events = sum(len(events) for events in records.values())
+    unthrottle(import_google.GOOGLE_RATE_LIMITER)
+
+    def parse_all():
+        for data in payloads.values():
+            for event in data:
+                script.parse_event(event)
+
+    def calendars_all():
+        for data in payloads.values():
+            script.get_module_calendars(data)
+
+    def ical_all():
+        for username, events in records.items():
+            script.generate_ical(events, "Main")
+
+    def data_to_ical_all():
+        for data in payloads.values():
+            script.data_to_ical(data)
+
+    calendar_pages = {username: make_calendar_page(username) for username in payloads}
+
+    def login_pages_all():
+        # The federation ID is read from the page, as when the URL has none
+        for username, page in calendar_pages.items():
+            script.extract_verification_token(LOGIN_PAGE)
+            script.extract_federation_id_from_page("/cal", page, ())
+
+    def build_index():
+        return EventIndex.from_calendars(*module_calendars.values())
+
+    query_times = [start_date + timedelta(days=day, hours=10) for day in range(0, max(SPANS[span], 1), 3)] * 10
+    teacher = TEACHERS[0]
+
+    def query_index(index):
+        # What is busy at a moment, and when a teacher is free that week
+        for moment in query_times:
+            index.busy("locations", moment, moment + timedelta(minutes=1))
+            index.free_slots("teachers", teacher, moment, moment + timedelta(days=7))
+
+    def warm_index():
+        # Indexes of single teachers are built on first use, not timed here
+        index = build_index()
+        query_index(index)
+        return index
+
+    export_root = tempfile.TemporaryDirectory()
+
+    def new_export_dir():
+        return tempfile.mkdtemp(dir=export_root.name)
+
+    def export_all(directory):
+        exporter = EventExporter(directory)
+        for username, calendars in module_calendars.items():
+            exporter.add(username, calendars)
+        exporter.close()
+
+    def written_export():
+        directory = new_export_dir()
+        export_all(directory)
+        return directory
+
+    def load_export(directory):
+        for table in ("events", "user_events"):
+            for row in read_export(directory, table):
+                pass
+
+    def push_all(service):
+        for username, calendars in module_calendars.items():
+            for module, events in calendars.items():
+                import_google.sync_google_events(service, f"{username}/{module}",
+                                                 import_google.records_to_google_events(events),
+                                                 start_date, end_date)
+
+    def import_jobs():
+        jobs = []
+        for username, calendars in module_calendars.items():
+            for module, events in calendars.items():
+                calendar_id = f"{username}/{module}"
+
+                def push(service, calendar_id=calendar_id, events=events):
+                    import_google.sync_google_events(service, calendar_id, import_google.records_to_google_events(events),
+                                                     start_date, end_date)
+                jobs.append((calendar_id, calendar_id, push))
+        return jobs
+
+    def import_slow(workers):
+        # Every calendar against a service with Google-like round trips
+        return lambda: import_google.run_calendar_imports(import_jobs(), FakeGoogleService(GOOGLE_LATENCY), workers)
+
+    def pushed_service():
+        service = FakeGoogleService()
+        with contextlib.redirect_stdout(io.StringIO()):
+            push_all(service)
+        return service
+
+    def fetch_all(cache):
+        for username in payloads:
+            session, federation_id = script.login(username, "stub")
+            script.get_data_range(session, start_date, end_date, federation_id, "month", 4, cache)
+
+    def warm_cache():
+        cache = ResponseCache(os.devnull, 0, 1 << 20)
+        fetch_all(cache)
+        return cache
+
+    results = []
+    retained_mb = measure_retained(payloads) if trace_memory else 0
+
+    def run(stage, func, count, stage_repeat, setup=None):
+        results.append(measure(stage, func, count, stage_repeat, setup, trace_memory))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        run("parse_event", parse_all, total_events, repeat)
+        run("get_module_calendars", calendars_all, total_events, repeat)
+        run("generate_ical", ical_all, pushed_events, repeat)
+        run("data_to_ical", data_to_ical_all, total_events, repeat)
+        run("login_pages", login_pages_all, user_count, repeat)
+        run("event_index", build_index, total_events, repeat)
+        run("index_queries", query_index, 2 * len(query_times), repeat, warm_index)
+        run("event_export", export_all, pushed_events, repeat, new_export_dir)
+        run("event_export_load", load_export, pushed_events, repeat, written_export)
+        export_root.cleanup()
+        run("google_import", push_all, pushed_events, 1, FakeGoogleService)
+        run("google_resync", push_all, pushed_events, 1, pushed_service)
+        run("google_import_serial", import_slow(1), pushed_events, 1)
+        run("google_import_parallel", import_slow(import_google.GOOGLE_IMPORT_WORKERS), pushed_events, 1)
+        with StubCelcatServer(payloads):
+            run("celcat_fetch", lambda: fetch_all(None), total_events, 1)
+            run("celcat_refetch_304", fetch_all, total_events, 1, warm_cache)
+    return {'span': span, 'users': user_count, 'events_per_user': event_count, 'results': results,
+            'retained_mb': retained_mb, 'peak_rss_mb': get_peak_rss_mb(),
+            'startup': measure_startup(repeat=repeat) if startup else []}
+
+def print_results(report):
+    print(f"{report['users']} user(s), {report['events_per_user']} events each ({report['span']}):")
+    print(f"  {'stage':<22}{'events':>10}{'seconds':>12}{'events/s':>14}{'peak MB':>10}")
+    for result in report['results']:
+        print(f"  {result['stage']:<22}{result['events']:>10}{result['seconds']:>12.4f}"
+              f"{result['events_per_second']:>14}{result['peak_mb']:>10.2f}")
+    print(f"  parsed calendars of every user: {report['retained_mb']} MB, process peak RSS: {report['peak_rss_mb']} MB")
+    if report['startup']:
+        print("Startup (python -X importtime, fresh interpreter):")
+        for result in report['startup']:
+            print(f"  {result['module']:<22}{result['import_ms']:>8.1f} ms  {', '.join(result['heavy']) or '-'}")
+
+def save_baseline(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+def compare_baseline(report, path, tolerance):
+    # A stage regresses when it is slower, or takes more memory, than the
+    # baseline by more than tolerance. Returns the stages that regressed.
+    try:
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except OSError:
+        print(f"No baseline at {path}, run with --save-baseline first.")
+        return []
+    if (baseline['span'], baseline['users'], baseline['events_per_user']) != \
+            (report['span'], report['users'], report['events_per_user']):
+        print("Warning: the baseline was recorded with other --span/--users/--events values.")
+
+    previous = {result['stage']: result for result in baseline['results']}
+    regressions = []
+    print(f"Compared with {path}:")
+    for result in report['results']:
+        before = previous.get(result['stage'])
+        if before is None:
+            continue
+        speed = result['events_per_second'] / before['events_per_second'] if before['events_per_second'] else 1
+        memory = result['peak_mb'] / before['peak_mb'] if before['peak_mb'] and result['peak_mb'] else 1
+        # Peaks of a few hundred kB vary more than that from run to run
+        regressed = speed < 1 - tolerance or (memory > 1 + tolerance and result['peak_mb'] - before['peak_mb'] > 1)
+        if regressed:
+            regressions.append(result['stage'])
+        print(f"  {result['stage']:<22}{speed:>8.2f}x speed{memory:>8.2f}x memory{'  REGRESSION' if regressed else ''}")
+
+    before, after = baseline.get('retained_mb'), report['retained_mb']
+    if before and after:
+        regressed = after > before * (1 + tolerance) and after - before > 1
+        if regressed:
+            regressions.append("retained_calendars")
+        print(f"  {'retained_calendars':<22}{after / before:>8.2f}x memory{'  REGRESSION' if regressed else ''}")
+
+    previous = {result['module']: result for result in baseline.get('startup', [])}
+    for result in report['startup']:
+        before = previous.get(result['module'])
+        if before is None:
+            continue
+        # Import times move by a few ms between runs, and a package loaded
+        # by an entry point that didn't load it before is a regression too.
+        added = [package for package in result['heavy'] if package not in before['heavy']]
+        slower = result['import_ms'] > before['import_ms'] * (1 + tolerance) and result['import_ms'] - before['import_ms'] > 20
+        if slower or added:
+            regressions.append(f"import {result['module']}")
+        print(f"  {'import ' + result['module']:<22}{before['import_ms'] / result['import_ms']:>8.2f}x speed"
+              f"{'  now loads ' + ', '.join(added) if added else ''}{'  REGRESSION' if slower or added else ''}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the CELCAT export pipeline.")
+    parser.add_argument("--span", choices=list(SPANS), default="month",
+                        help="Period covered by each user's synthetic calendar (default: month).")
+    parser.add_argument("--users", type=int, default=1, help="Number of users, 1 to 500 (default: 1).")
+    parser.add_argument("--events", type=int,
+                        help="Events per user, overrides --span (with --legacy: number of events, default 5000).")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement, the best one is kept (default: 3).")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help=f"Baseline file to compare with (default: {BASELINE_PATH}).")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown or memory growth before a stage counts as a regression (default: 0.25).")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip the peak memory measurement, an extra and slower run of every stage.")
+    parser.add_argument("--no-startup", action="store_true",
+                        help="Skip the import time check of the entry points.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    parser.add_argument("--legacy", action="store_true",
+                        help="Only compare generate_ical with the implementation it replaced.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.legacy:
+        run_ical_benchmark(args.events or 5000, args.repeat)
+        return 0
+
+    report = run_suite(args.span, args.users, args.repeat, args.events, not args.no_memory, not args.no_startup)
+    print_results(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        save_baseline(report, args.baseline)
+        return 0
+    regressions = compare_baseline(report, args.baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
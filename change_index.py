@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+CHANGE_INDEX_PATH = os.getenv("CHANGE_INDEX_PATH", ".celcat_index.sqlite3")
+
+# added and modified are EventRecords, removed are CELCAT event ids
+Changes = namedtuple("Changes", ["added", "modified", "removed"])
+
+# Hashed as the dict parse_event used to return, indexes written before
+# EventRecord existed stay valid.
+DETAIL_FIELDS = ("title", "description", "locations", "teachers", "class_groups", "category", "module")
+
+def get_record_hash(record):
+    # Only what ends up in the ICS files and Google events is hashed, so
+    # CELCAT fields nobody reads don't show up as changes.
+    details = {field: getattr(record, field) for field in DETAIL_FIELDS}
+    payload = json.dumps([record.start, record.end, details], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+class ChangeIndex:
+    # What every consumer (an ICS directory, a Google calendar...) last
+    # received, per CELCAT event id. A scope is one consumer of one calendar:
+    # it records the changes once it has applied them, so a failed stage sees
+    # the same changes again on the next run.
+    def __init__(self, path=CHANGE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS events (
+                scope TEXT NOT NULL,
+                event_id TEXT NOT NULL,
+                start TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (scope, event_id)
+            )
+        """)
+        # Days (inclusive, YYYY-MM-DD) a scope was fully compared over, the
+        # events of other days may be anything
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS ranges (
+                scope TEXT NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def has_scope(self, scope):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM events WHERE scope = ? LIMIT 1", (scope,)).fetchone() is not None
+
+    def forget(self, scope):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM events WHERE scope = ?", (scope,))
+                self._db.execute("DELETE FROM ranges WHERE scope = ?", (scope,))
+
+    def get_missing_ranges(self, scope, start_date, end_date):
+        # (start, end) days of start_date to end_date never recorded with
+        # record_range, the consumer has to be compared in full over them
+        first, last = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+        with self._lock:
+            rows = self._db.execute("SELECT start, end FROM ranges WHERE scope = ? AND end >= ? AND start <= ? ORDER BY start",
+                                    (scope, first, last)).fetchall()
+        missing = []
+        cursor = datetime.strptime(first, "%Y-%m-%d")
+        end = datetime.strptime(last, "%Y-%m-%d")
+        for range_start, range_end in rows:
+            range_start = datetime.strptime(range_start, "%Y-%m-%d")
+            if range_start > cursor:
+                missing.append((cursor, range_start - timedelta(days=1)))
+            cursor = max(cursor, datetime.strptime(range_end, "%Y-%m-%d") + timedelta(days=1))
+        if cursor <= end:
+            missing.append((cursor, end))
+        return missing
+
+    def record_range(self, scope, start_date, end_date):
+        # Merged with the ranges it overlaps or touches
+        first, last = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+        before = (start_date - timedelta(days=1)).strftime("%Y-%m-%d")
+        after = (end_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        with self._lock:
+            with self._db:
+                rows = self._db.execute("SELECT start, end FROM ranges WHERE scope = ? AND end >= ? AND start <= ?",
+                                        (scope, before, after)).fetchall()
+                first = min([first] + [row[0] for row in rows])
+                last = max([last] + [row[1] for row in rows])
+                self._db.execute("DELETE FROM ranges WHERE scope = ? AND end >= ? AND start <= ?", (scope, before, after))
+                self._db.execute("INSERT INTO ranges (scope, start, end) VALUES (?, ?, ?)", (scope, first, last))
+
+    def get_scopes(self, prefix):
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT DISTINCT scope FROM events WHERE substr(scope, 1, ?) = ?", (len(prefix), prefix))]
+
+    def diff(self, scope, events, start_date, end_date):
+        # Events of the scope starting between start_date and end_date that
+        # are missing from events were removed from CELCAT.
+        range_start = start_date.strftime("%Y-%m-%d")
+        range_end = (end_date + timedelta(days=1)).strftime("%Y-%m-%d")
+        with self._lock:
+            known = dict(self._db.execute("SELECT event_id, hash FROM events WHERE scope = ?", (scope,)))
+            in_range = [row[0] for row in self._db.execute(
+                "SELECT event_id FROM events WHERE scope = ? AND start >= ? AND start < ?",
+                (scope, range_start, range_end))]
+
+        added = []
+        modified = []
+        seen = set()
+        for record in events:
+            seen.add(record.id)
+            previous = known.get(record.id)
+            if previous is None:
+                added.append(record)
+            elif previous != get_record_hash(record):
+                modified.append(record)
+        removed = [event_id for event_id in in_range if event_id not in seen]
+        return Changes(added, modified, removed)
+
+    def get_changeset(self, scope, module_calendars, start_date, end_date):
+        # Only the modules with at least one change are returned. An event
+        # moved to another module is removed from one and added to the other.
+        modules = dict(module_calendars)
+        # Modules without any event left still have removals to report
+        for known_scope in self.get_scopes(f"{scope}/"):
+            modules.setdefault(known_scope[len(scope) + 1:], [])
+
+        changeset = {}
+        for module, events in modules.items():
+            changes = self.diff(f"{scope}/{module}", events, start_date, end_date)
+            if any(changes):
+                changeset[module] = changes
+        return changeset
+
+    def record(self, scope, changes, failed=()):
+        # failed are event ids the consumer couldn't apply, they stay as they were
+        rows = [(scope, record.id, record.start or "", get_record_hash(record))
+                for record in changes.added + changes.modified if record.id not in failed]
+        removed = [(scope, event_id) for event_id in changes.removed if event_id not in failed]
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO events (scope, event_id, start, hash) VALUES (?, ?, ?, ?)", rows)
+                self._db.executemany("DELETE FROM events WHERE scope = ? AND event_id = ?", removed)
+
+    def record_changeset(self, scope, changeset):
+        for module, changes in changeset.items():
+            self.record(f"{scope}/{module}", changes)
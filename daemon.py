@@ -0,0 +1,225 @@
+import argparse
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+
+from change_index import ChangeIndex
+from event_store import EventStore
+from fetch_cache import ResponseCache
+import metrics
+from script import (login_cached, get_data_range, get_module_calendars, write_ical_files, get_month_range,
+                    get_payload_hash, FETCH_CACHE_PATH, FETCH_CACHE_MAX_ENTRIES)
+
+NEAR_INTERVAL = int(os.getenv("DAEMON_NEAR_INTERVAL", 15 * 60))
+FAR_INTERVAL = int(os.getenv("DAEMON_FAR_INTERVAL", 6 * 3600))
+
+def get_windows(today, months):
+    # The current week changes often and is refreshed every near interval,
+    # the rest of the horizon (until the end of the month `months` ahead)
+    # every far interval.
+    week_start = datetime(today.year, today.month, today.day) - timedelta(days=today.weekday())
+    week_end = week_start + timedelta(days=6)
+    year, month = divmod(today.month - 1 + months, 12)
+    horizon_end = max(get_month_range(year + today.year, month + 1)[1], week_end)
+    windows = [("near", week_start, week_end)]
+    if horizon_end > week_end:
+        windows.append(("far", week_end + timedelta(days=1), horizon_end))
+    return windows
+
+def get_window_calendars(module_calendars, start_date, end_date, keep_undated=False):
+    # Every event belongs to the window of its start day. CELCAT returns the
+    # events overlapping a range, so an event crossing into the next window
+    # is seen by both fetches but only one window pushes it (or removes it
+    # once it is gone).
+    first = start_date.strftime("%Y-%m-%d")
+    last = end_date.strftime("%Y-%m-%d")
+    window_calendars = {}
+    for module, events in module_calendars.items():
+        kept = [event for event in events
+                if (first <= event.start[:10] <= last if event.start else keep_undated)]
+        if kept:
+            window_calendars[module] = kept
+    return window_calendars
+
+def get_calendar_hashes(module_calendars):
+    return {module: get_payload_hash(events)
+            for module, events in module_calendars.items()}
+
+class Daemon:
+    def __init__(self, username, password, federation_id=None, months=3, near_interval=NEAR_INTERVAL,
+                 far_interval=FAR_INTERVAL, output_dir="calendar_daemon", sync=True, chunk="month", workers=4):
+        self.username = username
+        self.password = password
+        self.federation_id = federation_id
+        self.months = months
+        self.intervals = {"near": near_interval, "far": far_interval}
+        self.output_dir = output_dir
+        self.sync = sync
+        self.chunk = chunk
+        self.workers = workers
+        self.stop_event = threading.Event()
+        # Every refresh revalidates its chunks (ETag / body hash) instead of
+        # trusting a TTL, unchanged chunks are never decoded again.
+        self.cache = ResponseCache(FETCH_CACHE_PATH, 0, FETCH_CACHE_MAX_ENTRIES)
+        self.index = ChangeIndex()
+        self.session = None
+        self.service = None
+        self.store = None
+        self.horizon = None
+        self.windows = {}
+
+    def stop(self, signum=None, frame=None):
+        print("Stopping after the current refresh...")
+        self.stop_event.set()
+
+    def get_session(self):
+        # Kept between refreshes, only logged in again once CELCAT rejects it
+        if self.session is None:
+            self.session, federation_id = login_cached(self.username, self.password)
+            self.federation_id = self.federation_id or federation_id
+            if not self.federation_id:
+                raise ValueError("Unable to extract federation ID, pass it with --federation-id")
+        return self.session
+
+    def get_google_service(self):
+        if self.service is None:
+            # Services for parallel imports, kept between refreshes
+            from import_google import ServicePool
+            self.service = ServicePool()
+        return self.service
+
+    def roll_windows(self):
+        windows = get_windows(datetime.now(), self.months)
+        horizon = (windows[0][1], windows[-1][2])
+        if horizon != self.horizon:
+            # A new week: windows moved, start from a clean state. The event
+            # store is renewed too so it doesn't grow for ever.
+            self.horizon = horizon
+            self.store = EventStore()
+            self.windows = {name: {'start': start, 'end': end, 'calendars': {}, 'hashes': {}, 'due': 0}
+                            for name, start, end in windows}
+
+    def refresh(self, name):
+        window = self.windows[name]
+        session = self.get_session()
+        data = get_data_range(session, window['start'], window['end'], self.federation_id,
+                              self.chunk, self.workers, self.cache)
+        self.cache.save()
+        if data is None:
+            self.session = None
+            raise Exception("Failed to retrieve or parse calendar data")
+
+        # Events without a start are only kept by the near window
+        module_calendars = get_window_calendars(get_module_calendars(data, self.store), window['start'],
+                                                window['end'], keep_undated=name == "near")
+        count = sum(len(events) for events in module_calendars.values())
+        hashes = get_calendar_hashes(module_calendars)
+        changed = [module for module, payload_hash in hashes.items() if window['hashes'].get(module) != payload_hash]
+        # Calendars that disappeared from the window still need their events removed
+        changed += [module for module in window['hashes'] if module not in hashes]
+        window['calendars'] = module_calendars
+        if not changed:
+            print(f"[{name}] {count} events, no calendar changed.")
+            window['hashes'] = hashes
+            return
+
+        print(f"[{name}] {count} events, changed: {', '.join(changed)}")
+        if self.output_dir:
+            self.write_files(changed)
+
+        failures = {}
+        if self.sync:
+            from import_google import import_module_calendars
+            failures = import_module_calendars({module: module_calendars.get(module, []) for module in changed},
+                                               window['start'], window['end'], sync=True,
+                                               service=self.get_google_service(), index=self.index)
+        # Failed calendars keep their old hash and are pushed again next time
+        for module in changed:
+            if module in failures:
+                continue
+            if module in hashes:
+                window['hashes'][module] = hashes[module]
+            else:
+                window['hashes'].pop(module, None)
+
+    def write_files(self, changed):
+        # Files cover the whole horizon, so they are rebuilt from every window
+        module_calendars = {}
+        for window in self.windows.values():
+            for module, events in window['calendars'].items():
+                module_calendars.setdefault(module, []).extend(events)
+        calendar_names = ["Main"] + [module for module in changed if module in module_calendars]
+        start_date, end_date = self.horizon
+        write_ical_files(module_calendars, self.output_dir, start_date, end_date, calendar_names)
+
+    def run_once(self):
+        self.roll_windows()
+        for name in self.windows:
+            if self.stop_event.is_set():
+                break
+            window = self.windows[name]
+            if time.monotonic() < window['due']:
+                continue
+            try:
+                with metrics.span(f"daemon.refresh_{name}"):
+                    self.refresh(name)
+            except Exception as e:
+                metrics.count("daemon.failed_refreshes")
+                print(f"[{name}] refresh failed: {e}")
+            window['due'] = time.monotonic() + self.intervals[name]
+        metrics.METRICS.flush()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.run_once()
+            next_due = min(window['due'] for window in self.windows.values())
+            # Woken up at once by SIGTERM / SIGINT instead of sleeping it out
+            self.stop_event.wait(max(1, next_due - time.monotonic()))
+        print("Daemon stopped.")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Keep CELCAT calendars exported and synced to Google Calendar.")
+    parser.add_argument("--username", default=os.getenv("CELCAT_USERNAME"),
+                        help="CELCAT account (default: CELCAT_USERNAME).")
+    parser.add_argument("--password", default=os.getenv("CELCAT_PASSWORD"),
+                        help="CELCAT password (default: CELCAT_PASSWORD).")
+    parser.add_argument("--federation-id", help="Federation ID, when it can't be read from the calendar page.")
+    parser.add_argument("--months", type=int, default=3,
+                        help="Months after the current one kept up to date (default: 3).")
+    parser.add_argument("--near-interval", type=int, default=NEAR_INTERVAL,
+                        help=f"Seconds between refreshes of the current week (default: {NEAR_INTERVAL}).")
+    parser.add_argument("--far-interval", type=int, default=FAR_INTERVAL,
+                        help=f"Seconds between refreshes of the following weeks (default: {FAR_INTERVAL}).")
+    parser.add_argument("--output", default="calendar_daemon",
+                        help="Directory of the ICS files (default: calendar_daemon).")
+    parser.add_argument("--no-ics", action="store_true", help="Do not write ICS files.")
+    parser.add_argument("--no-google", action="store_true", help="Do not sync to Google Calendar.")
+    parser.add_argument("--chunk", choices=["month", "week"], default="month",
+                        help="Size of the requests a window is split into (default: month).")
+    parser.add_argument("--workers", type=int, default=4, help="Number of chunks fetched concurrently (default: 4).")
+    parser.add_argument("--once", action="store_true", help="Refresh every window once and exit.")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if not args.username or not args.password:
+        parser.error("CELCAT credentials are required (--username/--password or CELCAT_USERNAME/CELCAT_PASSWORD)")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    daemon = Daemon(args.username, args.password, args.federation_id, args.months, args.near_interval,
+                    args.far_interval, None if args.no_ics else args.output, not args.no_google,
+                    args.chunk, args.workers)
+    metrics.start(args)
+    if args.once:
+        daemon.run_once()
+    else:
+        signal.signal(signal.SIGTERM, daemon.stop)
+        signal.signal(signal.SIGINT, daemon.stop)
+        daemon.run()
+    metrics.finish(args)
+    return daemon
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+import argparse
+import gzip
+import json
+import os
+import threading
+import time
+from itertools import chain
+from operator import attrgetter
+from urllib.parse import quote
+
+# Same order as EventRecord
+EVENT_COLUMNS = ["id", "start", "end", "title", "description", "category", "module",
+                 "locations", "teachers", "class_groups"]
+USER_EVENT_COLUMNS = ["user", "id", "start", "module"]
+TABLE_COLUMNS = {"events": EVENT_COLUMNS, "user_events": USER_EVENT_COLUMNS}
+LIST_COLUMNS = {"locations", "teachers", "class_groups"}
+
+ROW_GROUP_SIZE = 50000
+MANIFEST_NAME = "manifest.json"
+
+# Partition of the events CELCAT sent without a start
+UNKNOWN_MONTH = "unknown"
+
+get_event_row = attrgetter(*EVENT_COLUMNS)
+
+def is_used_directory(directory):
+    # Anything in the directory may be the partial files of a failed run,
+    # appending to them would mix both runs and break the reader
+    return os.path.isdir(directory) and bool(os.listdir(directory))
+
+def get_default_format():
+    # Parquet when pyarrow is installed, it stays optional
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return "jsonl"
+    return "parquet"
+
+def get_partition_path(table, month, module=None):
+    # Hive-style directories, the layout pyarrow.dataset and most
+    # analytics tools read as partition columns
+    parts = [table, f"month={month}"]
+    if module is not None:
+        parts.append(f"module={quote(module, safe=' ')}")
+    return os.path.join(*parts)
+
+class JsonLinesTable:
+    # Gzipped JSON lines: a header with the columns, then one line per row
+    # group holding each column as a list. Strings are dictionary encoded,
+    # a row group lists the strings first seen in it and values refer to
+    # every string by number, 0 being None. Row groups are appended as gzip
+    # members, gzip readers see one stream.
+    extension = ".jsonl.gz"
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.lists = [column in LIST_COLUMNS for column in columns]
+        self.strings = {None: 0}
+        self.created = False
+
+    def write(self, rows):
+        strings = self.strings
+        added = []
+        columns = []
+        for values, is_list in zip(zip(*rows), self.lists):
+            # New strings are numbered once per distinct value, every value
+            # is then looked up without a Python call
+            distinct = dict.fromkeys(chain.from_iterable(values) if is_list else values)
+            for value in distinct:
+                if value not in strings:
+                    strings[value] = len(strings)
+                    added.append(value)
+            if is_list:
+                columns.append([list(map(strings.__getitem__, value)) for value in values])
+            else:
+                columns.append(list(map(strings.__getitem__, values)))
+        lines = []
+        if not self.created:
+            lines.append(json.dumps({'columns': self.columns}))
+            self.created = True
+        lines.append(json.dumps({'strings': added, 'columns': columns}, ensure_ascii=False, separators=(",", ":")))
+        with gzip.open(self.path, "ab", compresslevel=6) as f:
+            f.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    def close(self):
+        pass
+
+class ParquetTable:
+    # One Parquet file per partition, one row group per write. Parquet
+    # dictionary encodes the string columns itself.
+    extension = ".parquet"
+
+    def __init__(self, path, columns):
+        import pyarrow as pa
+
+        self.path = path
+        self.schema = pa.schema([(column, pa.list_(pa.string()) if column in LIST_COLUMNS else pa.string())
+                                 for column in columns])
+        self.writer = None
+
+    def write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        arrays = [pa.array([row[position] for row in rows], type=field.type)
+                  for position, field in enumerate(self.schema)]
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd", use_dictionary=True)
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+TABLE_FORMATS = {"jsonl": JsonLinesTable, "parquet": ParquetTable}
+
+class EventExporter:
+    # Writes the parsed events of any number of users to directory as two
+    # tables: events, every event once, partitioned by month and module, and
+    # user_events, which user has which event, partitioned by month. Rows
+    # wait in a buffer per partition and are written as row groups; once
+    # max_buffered rows wait in all, the largest buffer is written early.
+    # add() can be called from several threads.
+    def __init__(self, directory, format=None, row_group_size=ROW_GROUP_SIZE, max_buffered=None):
+        if is_used_directory(directory):
+            raise Exception(f"'{directory}' is not empty, choose a new directory for the event export")
+        self.directory = directory
+        self.format = format or get_default_format()
+        self.table_class = TABLE_FORMATS[self.format]
+        self.row_group_size = row_group_size
+        self.max_buffered = max_buffered or 4 * row_group_size
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._buffers = {}
+        self._seen = set()
+        self.buffered = 0
+        self.counts = {'events': 0, 'user_events': 0}
+
+    def add(self, user, module_calendars):
+        with self._lock:
+            for events in module_calendars.values():
+                for record in events:
+                    month = record.start[:7] if record.start else UNKNOWN_MONTH
+                    self._append(("user_events", month, None), (user, record.id, record.start, record.module))
+                    # The same course fetched for several users is written once
+                    if record.id not in self._seen:
+                        self._seen.add(record.id)
+                        self._append(("events", month, record.module), get_event_row(record))
+
+    def _append(self, partition, row):
+        buffer = self._buffers.get(partition)
+        if buffer is None:
+            buffer = self._buffers[partition] = []
+        buffer.append(row)
+        self.buffered += 1
+        self.counts[partition[0]] += 1
+        if len(buffer) >= self.row_group_size:
+            self._flush(partition)
+        elif self.buffered >= self.max_buffered:
+            self._flush(max(self._buffers, key=lambda key: len(self._buffers[key])))
+
+    def _flush(self, partition):
+        rows = self._buffers.pop(partition)
+        self.buffered -= len(rows)
+        table = self._tables.get(partition)
+        if table is None:
+            directory = os.path.join(self.directory, get_partition_path(*partition))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, "part-0" + self.table_class.extension)
+            table = self._tables[partition] = self.table_class(path, TABLE_COLUMNS[partition[0]])
+        table.write(rows)
+
+    def close(self):
+        with self._lock:
+            for partition in list(self._buffers):
+                self._flush(partition)
+            for table in self._tables.values():
+                table.close()
+            manifest = {
+                'format': self.format,
+                'columns': TABLE_COLUMNS,
+                'row_group_size': self.row_group_size,
+                'counts': self.counts,
+                'files': sorted(os.path.relpath(table.path, self.directory) for table in self._tables.values()),
+            }
+            with open(os.path.join(self.directory, MANIFEST_NAME), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2, ensure_ascii=False)
+        return manifest
+
+def read_jsonl_file(path):
+    strings = [None]
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        columns = json.loads(f.readline())['columns']
+        lists = [column in LIST_COLUMNS for column in columns]
+        for line in f:
+            group = json.loads(line)
+            strings.extend(group['strings'])
+            values = [[list(map(strings.__getitem__, value)) for value in numbers] if is_list
+                      else list(map(strings.__getitem__, numbers))
+                      for numbers, is_list in zip(group['columns'], lists)]
+            for row in zip(*values):
+                yield dict(zip(columns, row))
+
+def read_export(directory, table="events"):
+    # Rows of one table of an export as dicts, in any format
+    with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+        manifest = json.load(f)
+    prefix = table + os.sep
+    for name in manifest['files']:
+        if not name.startswith(prefix):
+            continue
+        path = os.path.join(directory, name)
+        if manifest['format'] == "parquet":
+            import pyarrow.parquet as pq
+            yield from pq.read_table(path).to_pylist()
+        else:
+            yield from read_jsonl_file(path)
+
+def export_payloads(paths, directory, format=None, row_group_size=ROW_GROUP_SIZE):
+    # Saved GetCalendarData responses, the file name is the user
+    from batch import list_payload_files
+    from event_store import EventStore
+    from script import get_module_calendars
+
+    files = list_payload_files(paths)
+    exporter = EventExporter(directory, format, row_group_size)
+    store = EventStore()
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        exporter.add(os.path.splitext(os.path.basename(path))[0], get_module_calendars(data, store))
+    return exporter.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export parsed CELCAT events for analytics, or load such an export.")
+    parser.add_argument("directory", help="Export directory.")
+    parser.add_argument("--json", action="append", metavar="PATH",
+                        help="Saved GetCalendarData response, or directory of them, to export. Can be repeated. "
+                             "batch.py --events exports while fetching instead.")
+    parser.add_argument("--format", choices=list(TABLE_FORMATS),
+                        help="Output format (default: parquet when pyarrow is installed, else jsonl).")
+    parser.add_argument("--row-group-size", type=int, default=ROW_GROUP_SIZE,
+                        help=f"Rows per row group (default: {ROW_GROUP_SIZE}).")
+    args = parser.parse_args(argv)
+    if args.json and is_used_directory(args.directory):
+        parser.error(f"'{args.directory}' is not empty, choose a new directory for the event export")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    if args.json:
+        manifest = export_payloads(args.json, args.directory, args.format, args.row_group_size)
+        print(f"Exported {manifest['counts']['events']} events and {manifest['counts']['user_events']} user events "
+              f"to {len(manifest['files'])} {manifest['format']} files in {time.perf_counter() - started:.2f}s")
+        return manifest
+
+    # Without --json the export is loaded back, as a quick check
+    counts = {}
+    for row in read_export(args.directory):
+        counts[row['module']] = counts.get(row['module'], 0) + 1
+    print(f"Loaded {sum(counts.values())} events in {time.perf_counter() - started:.2f}s")
+    for module, count in sorted(counts.items()):
+        print(f"  {module:<30}{count:>8}")
+    return counts
+
+if __name__ == "__main__":
+    main()
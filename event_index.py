@@ -0,0 +1,359 @@
+import argparse
+import json
+import os
+import time as timer
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from operator import itemgetter
+
+# Fields of EventRecord with an index of their own, by their name on the
+# command line
+FIELDS = {"room": "locations", "teacher": "teachers", "group": "class_groups", "module": "module"}
+
+def get_time_key(moment):
+    # Events are compared on their CELCAT timestamps, which sort as strings
+    return moment.strftime("%Y-%m-%dT%H:%M:%S")
+
+def get_record_keys(record):
+    start = record.start[:19]
+    return start, (record.end or record.start)[:19]
+
+def get_record_times(record):
+    start, end = get_record_keys(record)
+    return datetime.fromisoformat(start), datetime.fromisoformat(end)
+
+def get_field_values(record, field):
+    value = getattr(record, field)
+    return (value,) if isinstance(value, str) else value
+
+class IntervalIndex:
+    # Intervals sorted by start, over a tree holding the latest end below
+    # every node. A query only goes down nodes ending after the range
+    # starts, so it costs O(log n) per interval found, never a scan.
+    def __init__(self, starts, ends, records):
+        # Parallel lists, already sorted by start then end
+        self.starts = starts
+        self.records = records
+        # levels[0] holds the end of every interval, every next level the
+        # latest end of each pair of the previous one, up to a single root.
+        # "" sorts before every timestamp, padding never matches.
+        level = ends
+        self.levels = [level]
+        while len(level) > 1:
+            if len(level) % 2:
+                level.append("")
+            level = list(map(max, level[0::2], level[1::2]))
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.records)
+
+    def overlapping(self, start, end):
+        # Intervals starting before end and ending after start, by start.
+        # Events without an end last no time, they are found from their
+        # start on.
+        limit = bisect_left(self.starts, end)
+        if not limit:
+            return []
+        levels = self.levels
+        found = []
+        stack = [(len(levels) - 1, 0)]
+        while stack:
+            depth, position = stack.pop()
+            if levels[depth][position] < start or position << depth >= limit:
+                continue
+            if not depth:
+                if levels[0][position] > start or levels[0][position] == self.starts[position]:
+                    found.append(self.records[position])
+                continue
+            stack.append((depth - 1, 2 * position + 1))
+            stack.append((depth - 1, 2 * position))
+        return found
+
+class EventIndex:
+    # Parsed events of any number of calendars, indexed on time and on every
+    # room, teacher, class group and module. Built from get_module_calendars
+    # or EventStore records, then only read. The index of a room (teacher...)
+    # is built the first time it is asked for, two threads asking at once at
+    # worst both build it.
+    def __init__(self, records):
+        # The same course fetched for several users is indexed once. Events
+        # without a start can't be placed in time and are left out.
+        unique = {record.id: record for record in records if record.start}
+        intervals = sorted([(record.start[:19], (record.end or record.start)[:19], record) for record in unique.values()],
+                           key=itemgetter(0, 1))
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.records = [interval[2] for interval in intervals]
+        self.events = IntervalIndex(self.starts, self.ends[:], self.records)
+        self._positions = {}
+        self._indexes = {}
+
+    @classmethod
+    def from_calendars(cls, *module_calendars):
+        return cls(record for calendars in module_calendars
+                   for events in calendars.values() for record in events)
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_positions(self, field):
+        # Positions in the sorted lists of the events of every room
+        # (teacher...), taken in order so they are sorted too
+        positions = self._positions.get(field)
+        if positions is None:
+            positions = defaultdict(list)
+            if field == "module":
+                for position, record in enumerate(self.records):
+                    positions[record.module].append(position)
+            else:
+                for position, values in enumerate([getattr(record, field) for record in self.records]):
+                    for value in values:
+                        positions[value].append(position)
+            self._positions[field] = positions = dict(positions)
+        return positions
+
+    def get_index(self, field, value):
+        index = self._indexes.get((field, value))
+        if index is None:
+            group = self.get_positions(field).get(value)
+            if group is None:
+                return None
+            index = IntervalIndex(list(map(self.starts.__getitem__, group)), list(map(self.ends.__getitem__, group)),
+                                  list(map(self.records.__getitem__, group)))
+            self._indexes[field, value] = index
+        return index
+
+    def get_values(self, field):
+        return sorted(self.get_positions(field))
+
+    def overlapping(self, start, end, field=None, value=None):
+        # Events between start and end, of one room, teacher... when given
+        if field is None:
+            index = self.events
+        else:
+            index = self.get_index(field, value)
+            if index is None:
+                return []
+        return index.overlapping(get_time_key(start), get_time_key(end))
+
+    def at(self, moment, field=None, value=None):
+        return self.overlapping(moment, moment + timedelta(seconds=1), field, value)
+
+    def busy(self, field, start, end):
+        # {room: events} of every room (teacher...) used between start and end
+        busy = {}
+        for record in self.overlapping(start, end):
+            for value in get_field_values(record, field):
+                busy.setdefault(value, []).append(record)
+        return busy
+
+    def free_values(self, field, start, end):
+        # Known rooms (teachers...) without any event between start and end
+        busy = self.busy(field, start, end)
+        return [value for value in self.get_values(field) if value not in busy]
+
+    def free_slots(self, field, value, start, end, min_duration=timedelta(0),
+                   day_start=time(8), day_end=time(19), weekends=False):
+        # Free (start, end) slots of a room (teacher...) within opening hours
+        merged = []
+        for record in self.overlapping(start, end, field, value):
+            busy_start, busy_end = get_record_times(record)
+            if merged and busy_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], busy_end)
+            else:
+                merged.append([busy_start, busy_end])
+
+        slots = []
+
+        def add_slot(slot_start, slot_end):
+            if slot_end > slot_start and slot_end - slot_start >= min_duration:
+                slots.append((slot_start, slot_end))
+
+        position = 0
+        day = start.date()
+        while datetime.combine(day, time()) < end:
+            cursor = max(start, datetime.combine(day, day_start))
+            window_end = min(end, datetime.combine(day, day_end))
+            if day.weekday() < 5 or weekends:
+                while position < len(merged) and merged[position][1] <= cursor:
+                    position += 1
+                index = position
+                while index < len(merged) and merged[index][0] < window_end:
+                    add_slot(cursor, merged[index][0])
+                    cursor = max(cursor, merged[index][1])
+                    index += 1
+                add_slot(cursor, window_end)
+            day += timedelta(days=1)
+        return slots
+
+    def conflicts(self, field, start, end, value=None):
+        # Events sharing a room (teacher...) at the same time, as
+        # (value, first, second) pairs with first starting first
+        values = [value] if value is not None else self.get_values(field)
+        conflicts = []
+        for value in values:
+            active = []
+            for record in self.overlapping(start, end, field, value):
+                record_start, record_end = get_record_keys(record)
+                active = [(other_end, other) for other_end, other in active if other_end > record_start]
+                conflicts.extend((value, other, record) for _, other in active)
+                active.append((record_end, record))
+        return conflicts
+
+def load_payloads(paths):
+    # Saved GetCalendarData responses, one JSON list of events per file
+    from batch import list_payload_files
+    from event_store import EventStore
+
+    files = list_payload_files(paths)
+    store = EventStore()
+    records = []
+    for path in files:
+        with open(path, encoding="utf-8") as f:
+            records.extend(store.get(event) for event in json.load(f))
+    return records
+
+def fetch_records(users, viewer, start_date, end_date):
+    # Goes through the response cache, queries asked again within
+    # FETCH_CACHE_TTL don't reach CELCAT.
+    from batch import get_user_label, login_user
+    from event_store import EventStore
+    from fetch_cache import ResponseCache
+    from script import get_data_range, FETCH_CACHE_PATH, FETCH_CACHE_TTL, FETCH_CACHE_MAX_ENTRIES
+
+    cache = ResponseCache(FETCH_CACHE_PATH, FETCH_CACHE_TTL, FETCH_CACHE_MAX_ENTRIES)
+    store = EventStore()
+    records = []
+    for user in users:
+        label = get_user_label(user)
+        try:
+            session, federation_id = login_user(user, viewer)
+            data = get_data_range(session, start_date, end_date, federation_id, cache=cache)
+            if data is None:
+                raise Exception("Failed to retrieve or parse calendar data")
+            records.extend(store.get(event) for event in data)
+        except Exception as e:
+            print(f"[{label}] fetch failed: {e}")
+    cache.save()
+    return records
+
+def format_event(record):
+    start, end = get_record_times(record)
+    places = ", ".join(record.locations)
+    return f"{start:%a %d/%m %H:%M}-{end:%H:%M}  {record.title}{'  (' + places + ')' if places else ''}"
+
+def parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date: {value!r}, expected YYYY-MM-DD or YYYY-MM-DDTHH:MM")
+
+def parse_time(value):
+    try:
+        return time.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time: {value!r}, expected HH:MM")
+
+def get_query_range(args):
+    # --at is a moment, --from/--to whole days unless times are given,
+    # nothing at all is the current week
+    if getattr(args, "at", None):
+        return args.at, args.at + timedelta(seconds=1)
+    if args.start:
+        end = args.end or args.start
+        if end.time() == time():
+            end += timedelta(days=1)
+        return args.start, end
+    today = datetime.combine(datetime.now().date(), time())
+    week_start = today - timedelta(days=today.weekday())
+    return week_start, week_start + timedelta(days=7)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Query rooms, teachers and groups across CELCAT calendars.")
+    parser.add_argument("--json", action="append", metavar="PATH",
+                        help="Saved GetCalendarData response, or directory of them, to load instead of fetching CELCAT. "
+                             "Can be repeated.")
+    parser.add_argument("--users", help="CSV file of users (see batch.py), default: the viewer account only.")
+    parser.add_argument("--username", default=os.getenv("CELCAT_USERNAME"),
+                        help="Viewer account (default: CELCAT_USERNAME).")
+    parser.add_argument("--password", default=os.getenv("CELCAT_PASSWORD"),
+                        help="Viewer password (default: CELCAT_PASSWORD).")
+    parser.add_argument("--federation-id", help="Federation ID of the viewer, when it can't be read from the calendar page.")
+
+    def add_range_arguments(subparser):
+        subparser.add_argument("--from", dest="start", type=parse_datetime,
+                               help="Start of the period (YYYY-MM-DD[THH:MM], default: this week).")
+        subparser.add_argument("--to", dest="end", type=parse_datetime,
+                               help="End of the period, a date is included whole (default: --from).")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    busy = subparsers.add_parser("busy", help="Rooms (teachers...) in use at a moment or during a period.")
+    busy.add_argument("--field", choices=list(FIELDS), default="room", help="What to list (default: room).")
+    busy.add_argument("--at", type=parse_datetime, help="Moment to look at (YYYY-MM-DDTHH:MM).")
+    add_range_arguments(busy)
+    busy.add_argument("--free", action="store_true", help="List the known ones without any event instead.")
+
+    free = subparsers.add_parser("free", help="Free slots of a room (teacher...).")
+    free.add_argument("value", help="Room, teacher, group or module, as written in CELCAT.")
+    free.add_argument("--field", choices=list(FIELDS), default="teacher", help="What value is (default: teacher).")
+    add_range_arguments(free)
+    free.add_argument("--min-minutes", type=int, default=30, help="Shortest slot listed (default: 30).")
+    free.add_argument("--day-start", type=parse_time, default=time(8), help="Opening time (default: 08:00).")
+    free.add_argument("--day-end", type=parse_time, default=time(19), help="Closing time (default: 19:00).")
+    free.add_argument("--weekends", action="store_true", help="Include Saturdays and Sundays.")
+
+    conflicts = subparsers.add_parser("conflicts", help="Events sharing a room (teacher...) at the same time.")
+    conflicts.add_argument("--field", choices=list(FIELDS), default="teacher", help="What to check (default: teacher).")
+    conflicts.add_argument("--value", help="Only check this room, teacher, group or module.")
+    add_range_arguments(conflicts)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start, end = get_query_range(args)
+    field = FIELDS[args.field]
+
+    if args.json:
+        records = load_payloads(args.json)
+    else:
+        if args.users:
+            from batch import read_users
+            users = read_users(args.users)
+        else:
+            users = [{'username': args.username, 'password': args.password, 'federation_id': args.federation_id or ''}]
+        # Whole days, so chunks match the ones other commands cached
+        first_day = datetime.combine(start.date(), time())
+        last_day = datetime.combine((end - timedelta(seconds=1)).date(), time())
+        records = fetch_records(users, (args.username, args.password), first_day, last_day)
+
+    started = timer.perf_counter()
+    index = EventIndex(records)
+    print(f"Indexed {len(index)} events in {(timer.perf_counter() - started) * 1000:.0f} ms")
+
+    started = timer.perf_counter()
+    if args.command == "busy":
+        if args.free:
+            lines = index.free_values(field, start, end)
+        else:
+            lines = []
+            for value, events in sorted(index.busy(field, start, end).items()):
+                lines.append(value)
+                lines.extend(f"  {format_event(record)}" for record in events)
+    elif args.command == "free":
+        slots = index.free_slots(field, args.value, start, end, timedelta(minutes=args.min_minutes),
+                                 args.day_start, args.day_end, args.weekends)
+        lines = [f"{slot_start:%a %d/%m %H:%M}-{slot_end:%H:%M}" for slot_start, slot_end in slots]
+    else:
+        lines = []
+        for value, first, second in index.conflicts(field, start, end, args.value):
+            lines.append(f"{value}:\n  {format_event(first)}\n  {format_event(second)}")
+    elapsed = (timer.perf_counter() - started) * 1000
+
+    print("\n".join(lines) if lines else "Nothing found.")
+    print(f"({len(lines)} line(s), answered in {elapsed:.1f} ms)")
+    return lines
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import threading
+
+from script import parse_event
+
+# Only the fields parse_event reads are compared. Per-student
+# fields such as registerStatus or studentMark would otherwise make the same
+# course look different for every user.
+EVENT_FIELDS = ("id", "start", "end", "description", "eventCategory", "modules")
+
+def get_event_fingerprint(event):
+    return tuple(tuple(value) if isinstance(value, list) else value
+                 for value in (event.get(field) for field in EVENT_FIELDS))
+
+class EventStore:
+    # Shared between the users of a batch run: an event downloaded for many
+    # students of the same class is parsed once and every calendar refers to
+    # the same EventRecord.
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+
+    def get(self, event):
+        fingerprint = get_event_fingerprint(event)
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(fingerprint)
+            if entry is None:
+                entry = parse_event(event)
+                self._entries[fingerprint] = entry
+        return entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'lookups': self.lookups,
+            'unique_events': len(self._entries),
+            'overlap_factor': round(self.lookups / len(self._entries), 2) if self._entries else 0,
+        }
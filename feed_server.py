@@ -0,0 +1,255 @@
+import argparse
+import gzip
+import hashlib
+import hmac
+import os
+import secrets
+import signal
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from batch import read_users, get_user_label, get_safe_name, login_user
+from event_store import EventStore
+from fetch_cache import ResponseCache
+from script import (get_data_range, data_to_ical, get_month_range, get_payload_hash,
+                    FETCH_CACHE_PATH, FETCH_CACHE_MAX_ENTRIES)
+
+REFRESH_INTERVAL = int(os.getenv("FEED_REFRESH_INTERVAL", 15 * 60))
+FEED_SECRET_FILE = os.getenv("FEED_SECRET_FILE", ".feed_secret")
+
+# body and gzip_body are the bytes sent as is, every request only compares
+# headers and writes them.
+Feed = namedtuple("Feed", ["body", "gzip_body", "etag", "gzip_etag", "last_modified", "updated_at"])
+
+def load_feed_secret(path=FEED_SECRET_FILE):
+    # Created on the first run and kept, so subscribed URLs stay valid
+    # across restarts. Deleting the file revokes every URL.
+    secret = os.getenv("FEED_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        secret = secrets.token_hex(32).encode("ascii")
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+            f.write(secret)
+        return secret
+
+def get_feed_token(secret, user_key):
+    # The feeds have no login: whoever knows a user's token reads their
+    # calendars, and nobody can guess the token of another user.
+    return hmac.new(secret, user_key.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+def render_feed(ical, updated_at):
+    body = ical.encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    # Each encoding is its own representation and gets its own strong ETag
+    return Feed(body, gzip.compress(body, 6, mtime=0), f'"{digest}"', f'"{digest}-gz"',
+                formatdate(updated_at, usegmt=True), int(updated_at))
+
+def is_modified_since(header, updated_at):
+    try:
+        return parsedate_to_datetime(header).timestamp() < updated_at
+    except (TypeError, ValueError):
+        return True
+
+def etag_matches(header, etag):
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    # A strong comparison would be enough, but clients may send back W/ tags
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+def accepts_gzip(header):
+    if not header:
+        return False
+    for coding in header.split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+class FeedStore:
+    # Rendered calendars of every user, replaced as a whole when a refresh
+    # brings new data so readers never see a half-updated user.
+    def __init__(self):
+        self._feeds = {}
+        self._hashes = {}
+
+    def get(self, user_key, calendar_name):
+        return self._feeds.get(user_key, {}).get(calendar_name)
+
+    def update(self, user_key, data, store=None):
+        payload_hash = get_payload_hash(data)
+        if self._hashes.get(user_key) == payload_hash:
+            return False
+        updated_at = time.time()
+        feeds = {name: render_feed(ical, updated_at) for name, ical in data_to_ical(data, store).items()}
+        self._feeds[user_key] = feeds
+        self._hashes[user_key] = payload_hash
+        return True
+
+    def stats(self):
+        return {user_key: sorted(feeds) for user_key, feeds in self._feeds.items()}
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "CelcatFeed"
+    # Headers and body leave in one write, a separate small header packet
+    # would wait for the client's delayed ACK on keep-alive connections.
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+    feeds = None
+    secret = None
+    max_age = REFRESH_INTERVAL
+    quiet = True
+
+    def get_feed(self):
+        # /feeds/<federation_id>/<token>/<calendar>.ics, a wrong token is a
+        # 404 like an unknown user
+        parts = unquote(self.path.split("?", 1)[0]).strip("/").split("/")
+        if len(parts) != 4 or parts[0] != "feeds" or not parts[3].endswith(".ics"):
+            return None
+        if not hmac.compare_digest(parts[2], get_feed_token(self.secret, parts[1])):
+            return None
+        return self.feeds.get(parts[1], parts[3][:-4])
+
+    def send_body(self, include_body):
+        feed = self.get_feed()
+        if feed is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if accepts_gzip(self.headers.get("Accept-Encoding")):
+            body, etag = feed.gzip_body, feed.gzip_etag
+        else:
+            body, etag = feed.body, feed.etag
+
+        # If-Modified-Since only counts when the client sent no ETag
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            not_modified = etag_matches(if_none_match, etag)
+        else:
+            if_modified_since = self.headers.get("If-Modified-Since")
+            not_modified = if_modified_since is not None and not is_modified_since(if_modified_since, feed.updated_at)
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", feed.last_modified)
+        self.send_header("Cache-Control", f"max-age={self.max_age}")
+        self.send_header("Vary", "Accept-Encoding")
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        if body is feed.gzip_body:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.send_body(True)
+
+    def do_HEAD(self):
+        self.send_body(False)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+def get_feed_range(months):
+    today = datetime.now()
+    year, month = divmod(today.month - 1 + months, 12)
+    return get_month_range(today.year, today.month)[0], get_month_range(today.year + year, month + 1)[1]
+
+def refresh_feeds(feeds, users, viewer, months, cache, store, secret):
+    start_date, end_date = get_feed_range(months)
+    for user in users:
+        label = get_user_label(user)
+        try:
+            session, federation_id = login_user(user, viewer)
+            data = get_data_range(session, start_date, end_date, federation_id, cache=cache)
+            if data is None:
+                raise Exception("Failed to retrieve or parse calendar data")
+            user_key = get_safe_name(federation_id)
+            if feeds.update(user_key, data, store):
+                print(f"[{label}] feeds updated: /feeds/{user_key}/{get_feed_token(secret, user_key)}/<calendar>.ics")
+        except Exception as e:
+            # The previous feeds of the user keep being served
+            print(f"[{label}] refresh failed: {e}")
+    cache.save()
+
+def run_refresh_loop(feeds, users, viewer, months, interval, stop_event, secret):
+    # Clients poll the in-memory feeds, CELCAT is only asked once per interval
+    cache = ResponseCache(FETCH_CACHE_PATH, 0, FETCH_CACHE_MAX_ENTRIES)
+    while not stop_event.is_set():
+        # Users of one refresh share their parsed events. The store is
+        # renewed every time so it doesn't grow for ever, unchanged users
+        # aren't parsed again anyway.
+        refresh_feeds(feeds, users, viewer, months, cache, EventStore(), secret)
+        stop_event.wait(interval)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve CELCAT calendars as ICS feeds over HTTP.")
+    parser.add_argument("--users", help="CSV file of users (see batch.py), default: the viewer account only.")
+    parser.add_argument("--username", default=os.getenv("CELCAT_USERNAME"),
+                        help="Viewer account (default: CELCAT_USERNAME).")
+    parser.add_argument("--password", default=os.getenv("CELCAT_PASSWORD"),
+                        help="Viewer password (default: CELCAT_PASSWORD).")
+    parser.add_argument("--federation-id", help="Federation ID of the viewer, when it can't be read from the calendar page.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1).")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080).")
+    parser.add_argument("--months", type=int, default=3,
+                        help="Months after the current one included in the feeds (default: 3).")
+    parser.add_argument("--interval", type=int, default=REFRESH_INTERVAL,
+                        help=f"Seconds between CELCAT refreshes (default: {REFRESH_INTERVAL}).")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.users:
+        users = read_users(args.users)
+    else:
+        users = [{'username': args.username, 'password': args.password, 'federation_id': args.federation_id or ''}]
+    viewer = (args.username, args.password)
+
+    feeds = FeedStore()
+    secret = load_feed_secret()
+    FeedRequestHandler.feeds = feeds
+    FeedRequestHandler.secret = secret
+    FeedRequestHandler.max_age = args.interval
+    FeedRequestHandler.quiet = not args.verbose
+    server = ThreadingHTTPServer((args.host, args.port), FeedRequestHandler)
+    server.daemon_threads = True
+
+    stop_event = threading.Event()
+    refresher = threading.Thread(target=run_refresh_loop,
+                                 args=(feeds, users, viewer, args.months, args.interval, stop_event, secret), daemon=True)
+    refresher.start()
+
+    def stop(signum, frame):
+        stop_event.set()
+        # shutdown() waits for serve_forever, it can't run on the serving thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving feeds on http://{args.host}:{args.port}/feeds/<federation_id>/<token>/<calendar>.ics")
+    server.serve_forever()
+    server.server_close()
+    print("Feed server stopped.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+class ResponseCache:
+    # GetCalendarData responses keyed by (federation id, start, end, resType).
+    # Entries younger than ttl are served without any request, older ones
+    # are revalidated with the validators the server sent, if any.
+    def __init__(self, path, ttl=300, max_entries=512):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.metrics = {'hits': 0, 'not_modified': 0, 'misses': 0, 'unchanged': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                self._entries = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self._entries = OrderedDict()
+
+    def save(self):
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump(self._entries, f)
+            os.replace(temp_path, self.path)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched_at'] < self.ttl
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.metrics['evictions'] += 1
+
+    def touch(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['fetched_at'] = time.time()
+
+    def record(self, metric):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['entries'] = len(self._entries)
+        requests_saved = stats['hits'] + stats['not_modified']
+        total = requests_saved + stats['misses']
+        stats['hit_ratio'] = round(requests_saved / total, 3) if total else 0
+        return stats
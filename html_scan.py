@@ -0,0 +1,108 @@
+from html.parser import HTMLParser
+
+# Elements BeautifulSoup never expects a closing tag for
+VOID_ELEMENTS = frozenset(["area", "base", "br", "col", "embed", "hr", "img", "input", "keygen",
+                           "link", "menuitem", "meta", "param", "source", "track", "wbr"])
+
+ASCII_SPACES = " \n\t\f\r"
+
+class ElementFound(Exception):
+    pass
+
+def attribute_matches(attrs, name, value):
+    actual = attrs.get(name)
+    if actual is None:
+        return False
+    # class holds several values, like in soup.find(class_=...)
+    return actual == value or (name == "class" and value in actual.split())
+
+class ElementFinder(HTMLParser):
+    # Streams a page looking for elements nested in each other, each step
+    # being (tag, attribute, value) like soup.find(tag, {attribute: value}),
+    # and stops once the last one is closed. No tree is built, and the rest
+    # of the page is never parsed. End tags close open elements the way
+    # BeautifulSoup does: up to the latest element with that name.
+    def __init__(self, steps):
+        super().__init__()
+        self.steps = steps
+        # Every open element of the page, and the depth of every matched step
+        self.open_tags = []
+        self.matched = []
+        self.attrs = None
+        self.text = []
+        self.pending = []
+        # Void elements BeautifulSoup closed itself, their next end tag is ignored
+        self.closed_void = []
+        self.found = False
+
+    def finish(self, found):
+        self.found = found
+        raise ElementFound()
+
+    def flush_text(self):
+        # Text is split where BeautifulSoup splits it, whitespace between
+        # two tags is then kept as a single character like it does.
+        if not self.pending:
+            return
+        data = "".join(self.pending)
+        self.pending = []
+        if not data.strip(ASCII_SPACES) and "pre" not in self.open_tags and "textarea" not in self.open_tags:
+            data = "\n" if "\n" in data else " "
+        self.text.append(data)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_text()
+        if len(self.matched) < len(self.steps):
+            step_tag, name, value = self.steps[len(self.matched)]
+            attrs = dict(attrs)
+            if tag == step_tag and attribute_matches(attrs, name, value):
+                self.matched.append(len(self.open_tags))
+                if len(self.matched) == len(self.steps):
+                    # Attributes without a value are empty strings in BeautifulSoup
+                    self.attrs = {key: "" if item is None else item for key, item in attrs.items()}
+                    if tag in VOID_ELEMENTS:
+                        self.finish(True)
+                elif tag in VOID_ELEMENTS:
+                    # The next steps can't be inside an element without content
+                    self.matched.pop()
+        if tag in VOID_ELEMENTS:
+            self.closed_void.append(tag)
+        else:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void:
+            self.closed_void.remove(tag)
+            return
+        self.flush_text()
+        if tag not in self.open_tags:
+            return
+        depth = len(self.open_tags) - 1 - self.open_tags[::-1].index(tag)
+        del self.open_tags[depth:]
+        if self.matched and self.matched[-1] >= depth:
+            # A matched element closed, the last step or one around it without it
+            self.finish(len(self.matched) == len(self.steps))
+
+    def handle_data(self, data):
+        if len(self.matched) == len(self.steps):
+            self.pending.append(data)
+
+    def handle_comment(self, data):
+        self.flush_text()
+
+    handle_decl = handle_pi = unknown_decl = handle_comment
+
+def find_element(page, *steps):
+    # Returns (attributes, text) of the element of the last step, or None
+    finder = ElementFinder(steps)
+    try:
+        finder.feed(page)
+        finder.close()
+        # Elements still open at the end of the page are closed by it
+        finder.flush_text()
+        finder.found = len(finder.matched) == len(steps)
+    except ElementFound:
+        pass
+    if not finder.found:
+        return None
+    return finder.attrs, "".join(finder.text)
@@ -0,0 +1,166 @@
+import functools
+import html
+
+# RFC 5545 serialization helpers used by generate_ical and write_ical_files.
+# Every content line ends with CRLF and is folded at 75 octets.
+
+TIMEZONE = "Europe/Paris"
+
+MAX_LINE_OCTETS = 75
+
+# str.translate with multi-character replacements goes through CPython's
+# slow generic path, a few guarded str.replace calls are several times faster.
+ESCAPES = (
+    ("\\", "\\\\"),
+    (";", "\\;"),
+    (",", "\\,"),
+    ("\n", "\\n"),
+)
+
+VTIMEZONE = "\r\n".join([
+    "BEGIN:VTIMEZONE",
+    f"TZID:{TIMEZONE}",
+    f"X-LIC-LOCATION:{TIMEZONE}",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]) + "\r\n"
+
+CALENDAR_FOOTER = "END:VCALENDAR\r\n"
+
+def clean_text(text):
+    if text is None:
+        print("Warning: None value passed to clean_text")
+        return ""
+    if "&" in text:
+        text = html.unescape(text)
+    if "\r" in text:
+        text = text.replace("\r", "")
+    return text
+
+def escape_text(text):
+    text = clean_text(text)
+    for character, escaped in ESCAPES:
+        if character in text:
+            text = text.replace(character, escaped)
+    return text
+
+def fold_line(line):
+    # Lines are cut on octets, never inside a multi-byte UTF-8 sequence.
+    # Continuation lines start with a space, which counts towards their 75.
+    if line.isascii():
+        # One octet per character, the string is cut as is
+        if len(line) <= MAX_LINE_OCTETS:
+            return line + "\r\n"
+        parts = [line[:MAX_LINE_OCTETS]]
+        parts.extend(line[start:start + MAX_LINE_OCTETS - 1]
+                     for start in range(MAX_LINE_OCTETS, len(line), MAX_LINE_OCTETS - 1))
+        return "\r\n ".join(parts) + "\r\n"
+
+    encoded = line.encode("utf-8")
+    size = len(encoded)
+    if size <= MAX_LINE_OCTETS:
+        return line + "\r\n"
+    parts = []
+    start = 0
+    end = MAX_LINE_OCTETS
+    while end < size:
+        # Back off from UTF-8 continuation bytes (0b10xxxxxx)
+        while encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end])
+        start = end
+        end += MAX_LINE_OCTETS - 1
+    parts.append(encoded[start:])
+    return b"\r\n ".join(parts).decode("utf-8") + "\r\n"
+
+def format_local_datetime(value):
+    # CELCAT sends local Paris times such as 2026-09-01T08:00:00
+    return value[:19].replace("-", "").replace(":", "")
+
+def get_description_text(description, locations, teachers, class_groups):
+    description = f"{description}\n"
+    if locations:
+        description += f"Salle(s): {', '.join(locations)}\n"
+    if teachers:
+        description += f"Professeur(e)(s): {', '.join(teachers)}\n"
+    if class_groups:
+        description += f"Classe(s)/Groupe(s): {', '.join(class_groups)}"
+    return description
+
+def format_description(record):
+    return get_description_text(record.description, record.locations, record.teachers, record.class_groups)
+
+# Titles, categories, rooms, teachers and groups repeat across most events
+# of a calendar (records share their strings and tuples), so each distinct
+# value is escaped only once. Escaping works character by character, the
+# escaped parts of a description add up to the escaped description.
+escape_value = functools.lru_cache(maxsize=8192)(escape_text)
+
+@functools.lru_cache(maxsize=8192)
+def escape_values(values):
+    return "\\, ".join(map(escape_text, values))
+
+@functools.lru_cache(maxsize=8192)
+def format_text_property(name, text):
+    return fold_line(f"{name}:{escape_text(text)}")
+
+def clear_caches():
+    for cached in (escape_value, escape_values, format_text_property, format_description_property):
+        cached.cache_clear()
+
+@functools.lru_cache(maxsize=8192)
+def format_description_property(description, locations, teachers, class_groups):
+    # Same line as escape_text(get_description_text(...)), built from parts
+    line = f"DESCRIPTION:{escape_value(description)}\\n"
+    if locations:
+        line += f"Salle(s): {escape_values(locations)}\\n"
+    if teachers:
+        line += f"Professeur(e)(s): {escape_values(teachers)}\\n"
+    if class_groups:
+        line += f"Classe(s)/Groupe(s): {escape_values(class_groups)}"
+    return fold_line(line)
+
+def format_calendar_header(calendar_name):
+    return "".join([
+        "BEGIN:VCALENDAR\r\n",
+        "VERSION:2.0\r\n",
+        fold_line(f"PRODID:-//Oniris Nantes//CELCAT {calendar_name}//FR"),
+        "CALSCALE:GREGORIAN\r\n",
+        "METHOD:PUBLISH\r\n",
+        fold_line(f"X-WR-CALNAME:CELCAT-EDT {escape_text(calendar_name)}"),
+        f"X-WR-TIMEZONE:{TIMEZONE}\r\n",
+        VTIMEZONE,
+    ])
+
+def format_event(record, now):
+    uid = "UID:" + record.id
+    # Nearly every UID is a short ASCII line that needs no folding
+    uid = uid + "\r\n" if len(uid) <= MAX_LINE_OCTETS and uid.isascii() else fold_line(uid)
+    # A missing start is written empty like the calendars exported before,
+    # DTEND is left out when CELCAT sends no end
+    dtstart = f";TZID={TIMEZONE}:{format_local_datetime(record.start)}" if record.start else ":"
+    dtend = f"DTEND;TZID={TIMEZONE}:{format_local_datetime(record.end)}\r\n" if record.end else ""
+    return (
+        "BEGIN:VEVENT\r\n"
+        f"{uid}"
+        f"DTSTAMP:{now}\r\n"
+        f"DTSTART{dtstart}\r\n"
+        f"{dtend}"
+        f"{format_text_property('SUMMARY', record.title)}"
+        f"{format_description_property(record.description, record.locations, record.teachers, record.class_groups)}"
+        f"{format_text_property('CATEGORIES', record.category)}"
+        "END:VEVENT\r\n"
+    )
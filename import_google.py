@@ -1,23 +1,53 @@
 import os
 import json
 import pickle
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
 from datetime import datetime, timedelta, date
 import pytz
 from dotenv import load_dotenv
-from icalendar import Calendar
+import ics
+import metrics
+from rate_limit import AdaptiveRateLimiter, backoff_delay, is_rate_limit_error, is_retryable_status
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 
+PARIS_TZ = pytz.timezone(ics.TIMEZONE)
+
 load_dotenv()
 
 calendar_mappings = os.getenv("CALENDAR_MAPPINGS", "{}")
 CALENDAR_IDS = json.loads(calendar_mappings)
 
-def get_google_calendar_service():
+# The Calendar API accepts up to 1000 calls per batch but recommends
+# smaller batches, larger ones tend to be throttled as a whole.
+BATCH_SIZE = 50
+MAX_BATCH_SIZE = 1000
+MAX_RETRIES = 5
+
+# Shared by every Google call of the process, batched or not. The default
+# Calendar API quota is about 10 requests per second and per user.
+GOOGLE_RATE_LIMITER = AdaptiveRateLimiter(rate=float(os.getenv("GOOGLE_RATE", 10)),
+                                          max_rate=float(os.getenv("GOOGLE_MAX_RATE", 50)))
+
+# Target calendars imported at the same time, they share GOOGLE_RATE_LIMITER
+GOOGLE_IMPORT_WORKERS = int(os.getenv("GOOGLE_IMPORT_WORKERS", 4))
+
+MAX_LIST_RESULTS = 2500
+CLEAR_LIST_FIELDS = "nextPageToken,items(id,summary)"
+SYNC_LIST_FIELDS = "nextPageToken,items(id,summary,start,extendedProperties/private)"
+
+DISCOVERY_DOCUMENT_PATH = os.getenv("GOOGLE_DISCOVERY_DOCUMENT", ".calendar_discovery.json")
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest"
+
+def get_google_credentials():
+    # The OAuth libraries are only loaded by runs that talk to Google
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import Flow
+
     creds = None
     if os.path.exists('token.pickle'):
         with open('token.pickle', 'rb') as token:
@@ -41,37 +71,242 @@ def get_google_calendar_service():
         with open('token.pickle', 'wb') as token:
             pickle.dump(creds, token)
     
-    return build('calendar', 'v3', credentials=creds)
+    return creds
 
-def clear_calendar_range(service, calendar_id, start_date, end_date):
-    print(f"Clearing events from calendar {calendar_id} between {start_date} and {end_date}")
-    
+def get_discovery_document(path=DISCOVERY_DOCUMENT_PATH):
+    # A saved copy wins, then the one bundled with google-api-python-client.
+    # Only older clients without it download the document, once.
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    from googleapiclient import discovery_cache
+    document = getattr(discovery_cache, 'get_static_doc', lambda *args: None)('calendar', 'v3')
+    if document is None:
+        import requests
+        response = requests.get(DISCOVERY_URL, timeout=30)
+        response.raise_for_status()
+        document = response.text
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(document)
+    return document
+
+def get_google_calendar_service(credentials=None):
+    # Every service gets its own HTTP transport around the credentials
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(get_discovery_document(), credentials=credentials or get_google_credentials())
+
+class ServicePool:
+    # Calendar API services for parallel imports. The client's httplib2
+    # transport is not thread safe, so a service is used by one worker at a
+    # time and every one is built around the same credentials, loaded or
+    # refreshed once here. Idle services are kept for the next import. A
+    # service passed in (like the benchmark's fake) is shared as is instead.
+    def __init__(self, service=None):
+        self.service = service
+        self._lock = threading.Lock()
+        self._idle = []
+        if service is None:
+            self.credentials = get_google_credentials()
+
+    def acquire(self):
+        if self.service is not None:
+            return self.service
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return get_google_calendar_service(self.credentials)
+
+    def release(self, service):
+        if service is not self.service:
+            with self._lock:
+                self._idle.append(service)
+
+def get_time_bounds(start_date, end_date):
     # Add a day to end_date to ensure we catch all events on the last day
     end_date += timedelta(days=1)
     
-    # Ensure dates are in UTC
+    # Ensure dates are in UTC. Naive dates are days of the calendar's time
+    # zone, not of the machine running the import.
+    if start_date.tzinfo is None:
+        start_date = PARIS_TZ.localize(start_date)
+    if end_date.tzinfo is None:
+        end_date = PARIS_TZ.localize(end_date)
     start_date_utc = start_date.astimezone(pytz.UTC)
     end_date_utc = end_date.astimezone(pytz.UTC)
     
     # Format dates as RFC3339 timestamps
     time_min = start_date_utc.isoformat().replace('+00:00', 'Z')
     time_max = end_date_utc.isoformat().replace('+00:00', 'Z')
+    return time_min, time_max
+
+def get_error_details(exception):
+    content = exception.content.decode('utf-8', 'replace') if isinstance(exception.content, bytes) else str(exception.content)
+    return exception.resp.status, content
+
+def is_retryable_error(exception):
+    if not isinstance(exception, HttpError):
+        return False
+    return is_retryable_status(*get_error_details(exception))
+
+def is_throttling_error(exception):
+    return isinstance(exception, HttpError) and is_rate_limit_error(*get_error_details(exception))
+
+def execute_request(make_request, limiter=GOOGLE_RATE_LIMITER, max_retries=MAX_RETRIES):
+    attempt = 0
+    while True:
+        limiter.acquire()
+        metrics.count("google.http_requests")
+        metrics.count("google.calls")
+        try:
+            with metrics.span("google.request"):
+                response = make_request().execute()
+        except HttpError as e:
+            if not is_retryable_error(e) or attempt >= max_retries:
+                metrics.count("google.errors")
+                raise
+            if is_throttling_error(e):
+                metrics.count("google.throttled")
+                limiter.on_throttle()
+            metrics.count("google.retries")
+            delay = backoff_delay(attempt)
+            attempt += 1
+            print(f"Google API error {e.resp.status}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        limiter.on_success()
+        return response
+
+def execute_batch_chunk(service, chunk, results, errors, max_retries, limiter=GOOGLE_RATE_LIMITER):
+    attempt = 0
+    while chunk:
+        failed = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                results[request_id] = response
+            else:
+                failed[request_id] = exception
+
+        batch = service.new_batch_http_request(callback=callback)
+        for key, make_request in chunk:
+            # Requests are rebuilt on every attempt, an executed HttpRequest
+            # cannot be added to another batch.
+            batch.add(make_request(), request_id=key)
+
+        # Every call of a batch counts against the quota
+        limiter.acquire(len(chunk))
+        metrics.count("google.http_requests")
+        metrics.count("google.calls", len(chunk))
+        try:
+            with metrics.span("google.batch"):
+                batch.execute()
+        except HttpError as e:
+            # The batch request itself was refused, none of its calls ran
+            if not is_retryable_error(e):
+                raise
+            failed = {key: e for key, _ in chunk}
+
+        throttled = any(is_throttling_error(exception) for exception in failed.values())
+        if throttled:
+            metrics.count("google.throttled")
+            limiter.on_throttle()
+        succeeded = len(chunk) - len(failed)
+        if succeeded:
+            limiter.on_success(succeeded)
+
+        retry = []
+        for key, make_request in chunk:
+            if key not in failed:
+                continue
+            if is_retryable_error(failed[key]) and attempt < max_retries:
+                retry.append((key, make_request))
+            else:
+                errors[key] = failed[key]
+                metrics.count("google.errors")
+
+        if retry:
+            metrics.count("google.retries", len(retry))
+            delay = backoff_delay(attempt)
+            attempt += 1
+            print(f"Retrying {len(retry)} failed call(s) in {delay:.1f}s")
+            time.sleep(delay)
+        chunk = retry
+
+def execute_batch(service, requests, batch_size=BATCH_SIZE, max_retries=MAX_RETRIES):
+    # requests is an iterable of (key, make_request) pairs, where key is a
+    # unique string and make_request builds the HttpRequest to run.
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    results = {}
+    errors = {}
+    chunk = []
+    for item in requests:
+        chunk.append(item)
+        if len(chunk) >= batch_size:
+            execute_batch_chunk(service, chunk, results, errors, max_retries)
+            chunk = []
+    if chunk:
+        execute_batch_chunk(service, chunk, results, errors, max_retries)
+    return results, errors
+
+def report_batch_errors(errors, action):
+    for key, exception in errors.items():
+        print(f"Failed to {action} event {key}: {exception}")
+
+def delete_request(service, calendar_id, event_id):
+    return lambda: service.events().delete(calendarId=calendar_id, eventId=event_id)
+
+def insert_request(service, calendar_id, event):
+    return lambda: service.events().insert(calendarId=calendar_id, body=event)
+
+def patch_request(service, calendar_id, event_id, event):
+    return lambda: service.events().patch(calendarId=calendar_id, eventId=event_id, body=event)
+
+def find_request(service, calendar_id, uid):
+    return lambda: service.events().list(calendarId=calendar_id, privateExtendedProperty=f"celcatUid={uid}",
+                                         fields=SYNC_LIST_FIELDS)
+
+def iter_calendar_events(service, calendar_id, time_min, time_max, fields):
+    page_token = None
+    while True:
+        events_result = execute_request(lambda: service.events().list(calendarId=calendar_id,
+                                                                      timeMin=time_min,
+                                                                      timeMax=time_max,
+                                                                      singleEvents=True,
+                                                                      maxResults=MAX_LIST_RESULTS,
+                                                                      fields=fields,
+                                                                      pageToken=page_token))
+        yield from events_result.get('items', [])
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return
+
+@metrics.timed("google.clear")
+def clear_calendar_range(service, calendar_id, start_date, end_date, batch_size=BATCH_SIZE):
+    print(f"Clearing events from calendar {calendar_id} between {start_date} and {end_date}")
     
-    events_result = service.events().list(calendarId=calendar_id, 
-                                          timeMin=time_min,
-                                          timeMax=time_max,
-                                          singleEvents=True,
-                                          orderBy='startTime').execute()
-    events = events_result.get('items', [])
-
-    for event in events:
-        service.events().delete(calendarId=calendar_id, eventId=event['id']).execute()
-        print(f"Deleted event: {event.get('summary', 'No Title')}")
-
-def import_ics_to_google_calendar(service, ics_file, calendar_id):
+    time_min, time_max = get_time_bounds(start_date, end_date)
+    
+    # Every page is listed before the first deletion, deleting while
+    # paginating the same query shifts the later pages and skips events.
+    summaries = {event['id']: event.get('summary', 'No Title')
+                 for event in iter_calendar_events(service, calendar_id, time_min, time_max, CLEAR_LIST_FIELDS)}
+
+    deleted, errors = execute_batch(
+        service,
+        ((event_id, delete_request(service, calendar_id, event_id)) for event_id in summaries),
+        batch_size)
+    for event_id in deleted:
+        print(f"Deleted event: {summaries[event_id]}")
+    report_batch_errors(errors, "delete")
+
+@metrics.timed("google.read_ics")
+def ics_to_google_events(ics_file):
+    from icalendar import Calendar
+
     with open(ics_file, 'rb') as f:
         cal = Calendar.from_ical(f.read())
     
+    google_events = []
     for component in cal.walk():
         if component.name == "VEVENT":
             dtstart = component.get('dtstart')
@@ -96,30 +331,309 @@ def import_ics_to_google_calendar(service, ics_file, calendar_id):
                 end = datetime.combine(end, datetime.min.time())
             
             # Ensure timezone information
-            paris_tz = pytz.timezone('Europe/Paris')
             if start.tzinfo is None:
-                start = paris_tz.localize(start)
+                start = PARIS_TZ.localize(start)
             if end.tzinfo is None:
-                end = paris_tz.localize(end)
+                end = PARIS_TZ.localize(end)
             
-            event = {
-                'summary': str(component.get('summary', 'No Title')),
-                'location': str(component.get('location', '')),
-                'description': str(component.get('description', '')),
-                'start': {
-                    'dateTime': start.isoformat(),
-                    'timeZone': 'Europe/Paris',
-                },
-                'end': {
-                    'dateTime': end.isoformat(),
-                    'timeZone': 'Europe/Paris',
-                },
-            }
-            created_event = service.events().insert(calendarId=calendar_id, body=event).execute()
-            print(f"Created event: {created_event['summary']}")
-
-def main(ics_files):
-    service = get_google_calendar_service()
+            event = get_google_event(str(component.get('summary', 'No Title')),
+                                     str(component.get('description', '')),
+                                     start, end, str(component.get('location', '')))
+            google_events.append((str(component.get('uid', '')), event))
+
+    return google_events
+
+def get_google_event(summary, description, start, end, location=''):
+    return {
+        'summary': summary,
+        'location': location,
+        'description': description,
+        'start': {
+            'dateTime': start.isoformat(),
+            'timeZone': ics.TIMEZONE,
+        },
+        'end': {
+            'dateTime': end.isoformat(),
+            'timeZone': ics.TIMEZONE,
+        },
+    }
+
+def parse_local_datetime(value):
+    return PARIS_TZ.localize(datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S"))
+
+@metrics.timed("google.build_events")
+def records_to_google_events(events):
+    # Same payloads as ics_to_google_events would read back from the file
+    # generate_ical writes, built straight from parse_event output.
+    google_events = []
+    for record in events:
+        if not record.start:
+            continue
+        start = parse_local_datetime(record.start)
+        end = parse_local_datetime(record.end) if record.end else start + timedelta(hours=1)
+        google_events.append((record.id, get_google_event(ics.clean_text(record.title),
+                                                          ics.clean_text(ics.format_description(record)),
+                                                          start, end)))
+    return google_events
+
+@metrics.timed("google.insert")
+def insert_google_events(service, calendar_id, google_events, batch_size=BATCH_SIZE):
+    created, errors = execute_batch(
+        service,
+        ((str(index), insert_request(service, calendar_id, event)) for index, (uid, event) in enumerate(google_events)),
+        batch_size)
+    for created_event in created.values():
+        print(f"Created event: {created_event['summary']}")
+    report_batch_errors(errors, "insert")
+
+def import_ics_to_google_calendar(service, ics_file, calendar_id, batch_size=BATCH_SIZE):
+    insert_google_events(service, calendar_id, ics_to_google_events(ics_file), batch_size)
+
+def get_event_fingerprint(event):
+    payload = json.dumps(event, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def with_sync_properties(uid, event):
+    # The CELCAT UID and a hash of the payload are stored as private extended
+    # properties, so the next run can match events without comparing fields
+    # Google normalizes on its side.
+    synced_event = dict(event)
+    synced_event['extendedProperties'] = {
+        'private': {
+            'celcatUid': uid,
+            'celcatHash': get_event_fingerprint(event),
+        }
+    }
+    return synced_event
+
+def sync_ics_to_google_calendar(service, ics_file, calendar_id, start_date, end_date, batch_size=BATCH_SIZE):
+    return sync_google_events(service, calendar_id, ics_to_google_events(ics_file), start_date, end_date, batch_size)
+
+def starts_before(event, time_min):
+    start = event.get('start', {}).get('dateTime')
+    return start is not None and datetime.fromisoformat(start.replace("Z", "+00:00")) < \
+        datetime.fromisoformat(time_min.replace("Z", "+00:00"))
+
+def plan_sync(google_events, existing_events, time_min=None):
+    # Returns (stale, to_insert, to_patch, unchanged): Google events to
+    # delete, (uid, body) pairs to insert, (uid, event id, body) triples to
+    # patch and the number of events already up to date.
+    desired = {}
+    for uid, event in google_events:
+        desired[uid] = with_sync_properties(uid, event)
+
+    existing = {}
+    stale = []
+    for event in existing_events:
+        uid = event.get('extendedProperties', {}).get('private', {}).get('celcatUid')
+        # Google lists the events overlapping the range, one that started
+        # before it belongs to the days before and isn't ours to delete
+        if uid not in desired and time_min is not None and starts_before(event, time_min):
+            continue
+        # Events without a CELCAT UID come from the clear-then-insert import,
+        # duplicated UIDs from interrupted runs: both are replaced.
+        if uid not in desired or uid in existing:
+            stale.append(event)
+        else:
+            existing[uid] = event
+
+    to_insert = []
+    to_patch = []
+    unchanged = 0
+    for uid, event in desired.items():
+        current = existing.get(uid)
+        if current is None:
+            to_insert.append((uid, event))
+        elif current['extendedProperties']['private'].get('celcatHash') != event['extendedProperties']['private']['celcatHash']:
+            to_patch.append((uid, current['id'], event))
+        else:
+            unchanged += 1
+    return stale, to_insert, to_patch, unchanged
+
+def print_sync_summary(calendar_id, counts):
+    print(f"Sync summary for {calendar_id}: {counts['inserted']} inserted, {counts['updated']} updated, "
+          f"{counts['deleted']} deleted, {counts['unchanged']} unchanged, {counts['failed']} failed")
+
+@metrics.timed("google.sync")
+def sync_google_events(service, calendar_id, google_events, start_date, end_date, batch_size=BATCH_SIZE):
+    time_min, time_max = get_time_bounds(start_date, end_date)
+    stale, to_insert, to_patch, unchanged = plan_sync(
+        google_events, iter_calendar_events(service, calendar_id, time_min, time_max, SYNC_LIST_FIELDS), time_min)
+
+    deleted, delete_errors = execute_batch(
+        service,
+        ((event['id'], delete_request(service, calendar_id, event['id'])) for event in stale),
+        batch_size)
+    inserted, insert_errors = execute_batch(
+        service,
+        ((uid, insert_request(service, calendar_id, event)) for uid, event in to_insert),
+        batch_size)
+    updated, patch_errors = execute_batch(
+        service,
+        ((uid, patch_request(service, calendar_id, event_id, event)) for uid, event_id, event in to_patch),
+        batch_size)
+    report_batch_errors(delete_errors, "delete")
+    report_batch_errors(insert_errors, "insert")
+    report_batch_errors(patch_errors, "patch")
+
+    counts = {
+        'inserted': len(inserted),
+        'updated': len(updated),
+        'deleted': len(deleted),
+        'unchanged': unchanged,
+        'failed': len(delete_errors) + len(insert_errors) + len(patch_errors),
+    }
+
+    print_sync_summary(calendar_id, counts)
+    return counts
+
+@metrics.timed("google.apply_changes")
+def apply_google_changes(service, calendar_id, changes, batch_size=BATCH_SIZE):
+    # Applies a change_index.Changes with one filtered lookup per changed
+    # event instead of listing the whole calendar. Returns the counts and
+    # the CELCAT ids that could not be applied.
+    desired = {uid: with_sync_properties(uid, event)
+               for uid, event in records_to_google_events(changes.added + changes.modified)}
+    uids = list(desired) + [uid for uid in changes.removed if uid not in desired]
+
+    found, lookup_errors = execute_batch(
+        service, ((uid, find_request(service, calendar_id, uid)) for uid in uids), batch_size)
+    report_batch_errors(lookup_errors, "look up")
+
+    stale = {}
+    to_insert = []
+    to_patch = []
+    unchanged = 0
+    for uid in uids:
+        if uid in lookup_errors:
+            continue
+        matches = found[uid].get('items', [])
+        event = desired.get(uid)
+        if event is None:
+            stale.update((match['id'], uid) for match in matches)
+            continue
+        # Duplicates left by interrupted runs are removed
+        stale.update((match['id'], uid) for match in matches[1:])
+        if not matches:
+            to_insert.append((uid, event))
+        elif matches[0].get('extendedProperties', {}).get('private', {}).get('celcatHash') != \
+                event['extendedProperties']['private']['celcatHash']:
+            to_patch.append((uid, matches[0]['id'], event))
+        else:
+            unchanged += 1
+
+    deleted, delete_errors = execute_batch(
+        service, ((event_id, delete_request(service, calendar_id, event_id)) for event_id in stale), batch_size)
+    inserted, insert_errors = execute_batch(
+        service, ((uid, insert_request(service, calendar_id, event)) for uid, event in to_insert), batch_size)
+    updated, patch_errors = execute_batch(
+        service, ((uid, patch_request(service, calendar_id, event_id, event)) for uid, event_id, event in to_patch),
+        batch_size)
+    report_batch_errors(delete_errors, "delete")
+    report_batch_errors(insert_errors, "insert")
+    report_batch_errors(patch_errors, "patch")
+
+    failed = set(lookup_errors) | set(insert_errors) | set(patch_errors)
+    failed.update(stale[event_id] for event_id in delete_errors)
+    counts = {
+        'inserted': len(inserted),
+        'updated': len(updated),
+        'deleted': len(deleted),
+        'unchanged': unchanged,
+        'failed': len(failed),
+    }
+    print_sync_summary(calendar_id, counts)
+    return counts, failed
+
+def get_range_records(events, start_date, end_date):
+    # Events on the days of start_date to end_date, with the ones crossing
+    # into them so a full sync of the range doesn't take them for stale
+    first, last = start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")
+    return [record for record in events
+            if record.start and record.start[:10] <= last and (record.end or record.start)[:10] >= first]
+
+def push_google_changes(service, calendar_name, calendar_id, events, start_date, end_date, index, batch_size=BATCH_SIZE):
+    # Incremental sync driven by a change_index.ChangeIndex. Days the index
+    # never compared with Google (the first push, a new month...) get a full
+    # sync first: Google may hold events the index doesn't know about.
+    scope = f"google:{calendar_id}"
+    for range_start, range_end in index.get_missing_ranges(scope, start_date, end_date):
+        print(f"Syncing events for {calendar_name} from {range_start:%Y-%m-%d} to {range_end:%Y-%m-%d}...")
+        records = get_range_records(events, range_start, range_end)
+        counts = sync_google_events(service, calendar_id, records_to_google_events(records), range_start, range_end,
+                                    batch_size)
+        if not counts['failed']:
+            index.record(scope, index.diff(scope, records, range_start, range_end))
+            index.record_range(scope, range_start, range_end)
+
+    # What the full syncs recorded is no change anymore
+    changes = index.diff(scope, events, start_date, end_date)
+    if not any(changes):
+        print(f"No changes for {calendar_name}.")
+        return
+    print(f"Applying {len(changes.added)} added, {len(changes.modified)} modified and "
+          f"{len(changes.removed)} removed event(s) to {calendar_name}...")
+    _, failed = apply_google_changes(service, calendar_id, changes, batch_size)
+    index.record(scope, changes, failed)
+
+def push_google_events(service, calendar_name, calendar_id, google_events, start_date, end_date, sync=False, batch_size=BATCH_SIZE):
+    if sync:
+        print(f"Syncing events for {calendar_name}...")
+        sync_google_events(service, calendar_id, google_events, start_date, end_date, batch_size)
+        return
+
+    print(f"Clearing existing events for {calendar_name}...")
+    clear_calendar_range(service, calendar_id, start_date, end_date, batch_size)
+    
+    print(f"Importing events for {calendar_name}...")
+    insert_google_events(service, calendar_id, google_events, batch_size)
+
+def print_import_summary(failures):
+    if failures:
+        print(f"{len(failures)} calendar(s) could not be imported: {', '.join(failures)}")
+    else:
+        print("All calendars have been imported to Google Calendar.")
+    if GOOGLE_RATE_LIMITER.throttled:
+        print(f"Google throttled {GOOGLE_RATE_LIMITER.throttled} time(s), settled at {GOOGLE_RATE_LIMITER.rate:.1f} requests/s.")
+
+def run_calendar_imports(jobs, service=None, workers=GOOGLE_IMPORT_WORKERS):
+    # jobs are (calendar_name, calendar_id, push) tuples, push(service)
+    # importing one calendar. Target calendars are independent and imported
+    # in parallel, jobs of the same calendar ID run in order in one worker.
+    services = service if isinstance(service, ServicePool) else ServicePool(service)
+    by_calendar = {}
+    for job in jobs:
+        by_calendar.setdefault(job[1], []).append(job)
+
+    def run(calendar_jobs):
+        failures = {}
+        try:
+            service = services.acquire()
+        except Exception as e:
+            print(f"Failed to connect to Google Calendar: {e}")
+            return {calendar_name: str(e) for calendar_name, _, _ in calendar_jobs}
+        try:
+            for calendar_name, calendar_id, push in calendar_jobs:
+                try:
+                    push(service)
+                except Exception as e:
+                    # Calendars are independent, one failure shouldn't stop the others
+                    print(f"Failed to import {calendar_name}: {e}")
+                    failures[calendar_name] = str(e)
+        finally:
+            services.release(service)
+        return failures
+
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for calendar_failures in executor.map(run, by_calendar.values()):
+            failures.update(calendar_failures)
+
+    print_import_summary(failures)
+    return failures
+
+def main(ics_files, sync=False, batch_size=BATCH_SIZE, index=None, service=None, workers=GOOGLE_IMPORT_WORKERS):
+    jobs = []
 
     for calendar_name, ics_file in ics_files:
         # Skip the main calendar
@@ -141,14 +655,45 @@ def main(ics_files):
         date_range = file_name.split('_')[-2:]
         start_date = datetime.strptime(date_range[0], "%Y-%m-%d")
         end_date = datetime.strptime(date_range[1].split('.')[0], "%Y-%m-%d")
-        
-        print(f"Clearing existing events for {calendar_name}...")
-        clear_calendar_range(service, calendar_id, start_date, end_date)
-        
-        print(f"Importing events for {calendar_name}...")
-        import_ics_to_google_calendar(service, ics_file, calendar_id)
 
-    print("All calendars have been imported to Google Calendar.")
+        def push(service, calendar_name=calendar_name, calendar_id=calendar_id, ics_file=ics_file,
+                 start_date=start_date, end_date=end_date):
+            push_google_events(service, calendar_name, calendar_id, ics_to_google_events(ics_file),
+                               start_date, end_date, sync, batch_size)
+            if index is not None:
+                # The index no longer knows what this calendar holds
+                index.forget(f"google:{calendar_id}")
+
+        jobs.append((calendar_name, calendar_id, push))
+
+    return run_calendar_imports(jobs, service, workers)
+
+def import_module_calendars(module_calendars, start_date, end_date, sync=False, batch_size=BATCH_SIZE, service=None, index=None,
+                            workers=GOOGLE_IMPORT_WORKERS):
+    # In-memory counterpart of main: takes get_module_calendars output
+    # instead of reading back the ICS files. With a ChangeIndex, a sync only
+    # pushes what changed since the last one.
+    jobs = []
+
+    for module, events in module_calendars.items():
+        calendar_id = CALENDAR_IDS.get(module)
+
+        if not calendar_id:
+            print(f"Warning: No predefined calendar ID found for {module}. Skipping.")
+            continue
+
+        def push(service, module=module, calendar_id=calendar_id, events=events):
+            if sync and index is not None:
+                push_google_changes(service, module, calendar_id, events, start_date, end_date, index, batch_size)
+            else:
+                push_google_events(service, module, calendar_id, records_to_google_events(events),
+                                   start_date, end_date, sync, batch_size)
+                if index is not None:
+                    index.forget(f"google:{calendar_id}")
+
+        jobs.append((module, calendar_id, push))
+
+    return run_calendar_imports(jobs, service, workers)
 
 if __name__ == "__main__":
     # This allows the script to be run independently for testing
@@ -0,0 +1,175 @@
+import functools
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+class Metrics:
+    # Timing spans and counters of the whole process. Spans are per stage,
+    # never per event, so they cost nothing measurable. Times of stages
+    # running in several threads at once are summed.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+        self.exporters = []
+        self.started_at = time.time()
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                stats = self.spans.get(name)
+                if stats is None:
+                    self.spans[name] = stats = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+                stats['count'] += 1
+                stats['seconds'] += elapsed
+                stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'time': time.time(),
+                'uptime': round(time.time() - self.started_at, 3),
+                'spans': {name: dict(stats) for name, stats in self.spans.items()},
+                'counters': dict(self.counters),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.spans = {}
+            self.counters = {}
+            self.started_at = time.time()
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def flush(self):
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            exporter.export(snapshot)
+
+    def close(self):
+        self.flush()
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+
+METRICS = Metrics()
+
+def span(name):
+    return METRICS.span(name)
+
+def count(name, value=1):
+    METRICS.count(name, value)
+
+def timed(name):
+    # Decorator form of span for whole functions
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with METRICS.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class JsonLinesExporter:
+    # One snapshot per line, appended on every flush
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, snapshot):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+    def close(self):
+        pass
+
+def get_metric_name(name):
+    return "celcat_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def format_prometheus(snapshot):
+    lines = [
+        "# TYPE celcat_stage_seconds_total counter",
+        "# TYPE celcat_stage_calls_total counter",
+    ]
+    for name, stats in sorted(snapshot['spans'].items()):
+        lines.append(f'celcat_stage_seconds_total{{stage="{name}"}} {stats["seconds"]:.6f}')
+        lines.append(f'celcat_stage_calls_total{{stage="{name}"}} {stats["count"]}')
+    for name, value in sorted(snapshot['counters'].items()):
+        metric = get_metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
+
+class PrometheusExporter:
+    # Serves the live metrics in the Prometheus text format on /metrics
+    def __init__(self, port, host="127.0.0.1", metrics=METRICS):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = format_prometheus(metrics.snapshot()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def export(self, snapshot):
+        pass
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def format_profile(snapshot):
+    spans = sorted(snapshot['spans'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    lines = [f"Profile ({snapshot['uptime']:.2f}s run, stage times summed over threads):",
+             f"  {'stage':<28}{'calls':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}"]
+    for name, stats in spans:
+        lines.append(f"  {name:<28}{stats['count']:>8}{stats['seconds']:>10.3f}"
+                     f"{stats['seconds'] / stats['count'] * 1000:>10.2f}{stats['max_seconds'] * 1000:>10.2f}")
+    if snapshot['counters']:
+        lines.append("Counters:")
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"  {name:<28}{value:>12}")
+    return "\n".join(lines)
+
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the time spent in every stage and the HTTP, byte and event counters at the end.")
+    parser.add_argument("--metrics-file", help="Append metrics snapshots to this JSON lines file.")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port, at /metrics.")
+
+def start(args):
+    if args.metrics_file:
+        METRICS.add_exporter(JsonLinesExporter(args.metrics_file))
+    if args.metrics_port:
+        METRICS.add_exporter(PrometheusExporter(args.metrics_port))
+
+def finish(args):
+    if args.profile:
+        print()
+        print(format_profile(METRICS.snapshot()))
+    METRICS.close()
@@ -1,20 +1,79 @@
-from script import main as oniris_main
-from import_google import main as google_import
+import argparse
+import os
+
+import metrics
+
+from script import export as oniris_export, parse_args as parse_export_args
+from change_index import ChangeIndex
+
+def parse_args(argv=None):
+    # Options not listed here are the export options of script.py
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--users",
+                        help="CSV file of users (see batch.py) fetched and pushed to Google concurrently, without prompts.")
+    parser.add_argument("--replace", action="store_true",
+                        help="With --users, clear and re-import calendars instead of the incremental sync.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Run daemon.py: keep the calendars refreshed until stopped, see daemon.py --help.")
+    return parser.parse_known_args(argv)
+
+def run_users(users_file, export_args, sync):
+    # Imported here so the interactive flow works without aiohttp installed
+    import asyncio
+    from async_clients import run_pipeline
+    from batch import read_users
+
+    if not export_args.start_date:
+        print("--users needs --from and --to.")
+        return
+    users = read_users(users_file)
+    viewer = (os.getenv("CELCAT_USERNAME"), os.getenv("CELCAT_PASSWORD"))
+    output_dir = None if export_args.no_ics else "calendar_batch_export"
+    failures = asyncio.run(run_pipeline(users, viewer, export_args.start_date, export_args.end_date,
+                                        export_args.chunk, sync, output_dir))
+    print(f"\n{len(users) - len(failures)} user(s) processed, {len(failures)} failed.")
+
+def main(argv=None):
+    args, export_argv = parse_args(argv)
+    if args.watch:
+        from daemon import main as run_daemon
+        run_daemon(export_argv)
+        return
+
+    # --profile and the metrics exporters are export options
+    export_args = parse_export_args(export_argv)
+    metrics.start(export_args)
+    try:
+        run(args, export_args, export_argv)
+    finally:
+        metrics.finish(export_args)
+
+def run(args, export_args, export_argv):
+    if args.users:
+        run_users(args.users, export_args, not args.replace)
+        return
 
-def main():
     print("Fetching Oniris calendar data and generating ICS files...")
-    ics_files = oniris_main()
+    result = oniris_export(export_argv)
     
-    if ics_files:
-        print("\nICS files generated successfully.")
+    if result:
+        if result.files:
+            print("\nICS files generated successfully.")
         import_to_google = input("Do you want to import these calendars to Google Calendar? (y/n): ").lower()
         if import_to_google == 'y':
+            sync = input("Only push changes since the last import (incremental sync)? (y/n, default: y): ").lower() != 'n'
             print("\nImporting to Google Calendar...")
-            google_import(ics_files)
+            # The Google client libraries take longer to import than a cached
+            # export, runs that answer no don't load them.
+            from import_google import import_module_calendars
+            # With a sync, the index only sends Google the events changed since the last one
+            index = ChangeIndex()
+            import_module_calendars(result.module_calendars, result.start_date, result.end_date, sync=sync, index=index)
+            index.close()
         else:
             print("Skipping Google Calendar import.")
     else:
-        print("No ICS files were generated or an error occurred.")
+        print("No calendar data was retrieved or an error occurred.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
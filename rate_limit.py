@@ -0,0 +1,69 @@
+import random
+import threading
+import time
+
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+def is_rate_limit_error(status, content):
+    if status == 429:
+        return True
+    return status == 403 and any(reason in content for reason in RATE_LIMIT_REASONS)
+
+def is_retryable_status(status, content):
+    return status >= 500 or is_rate_limit_error(status, content)
+
+def backoff_delay(attempt, base=1.0, cap=64.0):
+    # Exponential backoff with full jitter, so the workers that were throttled
+    # together don't all come back at the same instant.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class AdaptiveRateLimiter:
+    # Token bucket shared by every Google call of the process. The rate is
+    # raised slowly while calls succeed and halved on each quota error
+    # (additive increase, multiplicative decrease), so runs settle near the
+    # fastest rate the quota allows.
+    def __init__(self, rate=10.0, burst=10, min_rate=0.5, max_rate=50.0, increase=1.0, decrease=0.5):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.tokens = burst
+        self.throttled = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        # Tokens can go negative: the caller waits until its share refills
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= tokens
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def acquire(self, tokens=1):
+        delay = self._reserve(tokens)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=1):
+        # Already loaded by the event loop running this, the threaded
+        # clients don't pay for importing asyncio.
+        import asyncio
+
+        delay = self._reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def on_success(self, count=1):
+        with self._lock:
+            # About +increase requests/s for every rate's worth of successes
+            self.rate = min(self.max_rate, self.rate + self.increase * count / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.tokens = min(self.tokens, 0)
+            self.throttled += 1
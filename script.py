@@ -1,5 +1,4 @@
 import requests
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import uuid
 import pytz
@@ -10,66 +9,120 @@ import json
 import html
 import os
 import json
+import argparse
+import functools
+from collections import namedtuple
+import hashlib
+import pickle
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from fetch_cache import ResponseCache
+from html_scan import find_element
+from change_index import ChangeIndex
+import ics
+import metrics
 
 load_dotenv()
 
 domain = os.getenv("DOMAIN")
+# Only changed for local test servers such as the benchmark's stub
+scheme = os.getenv("CELCAT_SCHEME", "https")
+
+SESSION_CACHE_DIR = os.getenv("SESSION_CACHE_DIR", ".celcat_sessions")
+# CELCAT drops idle sessions after a while, cached ones older than this are
+# not even tried.
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", 8 * 3600))
+
+FETCH_CACHE_PATH = os.getenv("FETCH_CACHE_PATH", ".celcat_cache.pickle")
+FETCH_CACHE_TTL = int(os.getenv("FETCH_CACHE_TTL", 300))
+FETCH_CACHE_MAX_ENTRIES = int(os.getenv("FETCH_CACHE_MAX_ENTRIES", 512))
+EXPORT_STATE_FILE = ".export_state.json"
+
+# module_calendars holds the calendars to push to Google, also when an
+# unchanged export was reused as is
+ExportResult = namedtuple("ExportResult", ["files", "module_calendars", "start_date", "end_date"])
+
+# One parsed event, with only what generate_ical and the Google import read.
+# Nothing refers back to the CELCAT JSON, which can be dropped once parsed.
+EventRecord = namedtuple("EventRecord", ["id", "start", "end", "title", "description", "category", "module",
+                                         "locations", "teachers", "class_groups"])
+
+LOGIN_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:130.0) Gecko/20100101 Firefox/130.0",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Content-Type": "application/x-www-form-urlencoded",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "same-origin",
+    "Sec-Fetch-User": "?1"
+}
+
+def extract_verification_token(page):
+    # The pages are scanned up to the element needed, never parsed whole
+    token = find_element(page, ('input', 'name', '__RequestVerificationToken'))
+    return token[0].get('value') if token is not None else None
+
+def extract_login_error(page):
+    error_message = find_element(page, ('span', 'data-valmsg-for', 'WrongCredentials'))
+    return error_message[1] if error_message else None
+
+def get_login_data(username, password, token):
+    login_data = {
+        'Name': username,
+        'Password': password,
+        '__RequestVerificationToken': token,
+        'RememberMe': 'false'
+    }
+    return urllib.parse.urlencode(login_data)
+
+def get_calendar_page_url(username):
+    return f"{scheme}://{domain}/cal?vt=month&dt={datetime.now().strftime('%Y-%m-%d')}&et=student&fid0={urllib.parse.quote(username)}"
 
+def record_response(response):
+    metrics.count("celcat.http_requests")
+    metrics.count("celcat.bytes_received", len(response.content))
+
+@metrics.timed("celcat.login")
 def login(username, password):
-    login_url = f"https://{domain}/LdapLogin"
-    logon_url = f"https://{domain}/LdapLogin/Logon"
+    login_url = f"{scheme}://{domain}/LdapLogin"
+    logon_url = f"{scheme}://{domain}/LdapLogin/Logon"
     session = requests.Session()
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:130.0) Gecko/20100101 Firefox/130.0",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Content-Type": "application/x-www-form-urlencoded",
-        "Upgrade-Insecure-Requests": "1",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "same-origin",
-        "Sec-Fetch-User": "?1"
-    }
+    headers = LOGIN_HEADERS
 
     response = session.get(login_url, headers=headers)
+    record_response(response)
     
     if response.status_code != 200:
         raise Exception(f"Failed to load login page. Status code: {response.status_code}")
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-    token = soup.find('input', {'name': '__RequestVerificationToken'})
+    token = extract_verification_token(response.text)
     if token is None:
         raise Exception("Anti-forgery token not found on login page")
     
-    token = token['value']
     print(f"Anti-forgery token found: {token[:10]}...")
 
-    login_data = {
-        'Name': username,
-        'Password': password,
-        '__RequestVerificationToken': token,
-        'RememberMe': 'false'
-    }
-
-    encoded_data = urllib.parse.urlencode(login_data)
+    encoded_data = get_login_data(username, password, token)
 
     response = session.post(logon_url, data=encoded_data, headers=headers, allow_redirects=True)
+    record_response(response)
 
     if "LdapLogin" in response.url:
-        soup = BeautifulSoup(response.text, 'html.parser')
-        error_message = soup.find('span', {'data-valmsg-for': 'WrongCredentials'})
+        error_message = extract_login_error(response.text)
         if error_message:
-            print(f"Error message found: {error_message.text}")
+            print(f"Error message found: {error_message}")
         raise Exception("Login failed. Please check your credentials.")
 
     if "CalendarViewType=Unknown" in response.url:
         print("Login successful! Redirected to calendar page.")
         
         # Navigate to the specific calendar view
-        calendar_url = f"https://{domain}/cal?vt=month&dt={datetime.now().strftime('%Y-%m-%d')}&et=student&fid0={urllib.parse.quote(username)}"
+        calendar_url = get_calendar_page_url(username)
         response = session.get(calendar_url, headers=headers)
+        record_response(response)
         
         if response.status_code != 200:
             raise Exception(f"Failed to load calendar page. Status code: {response.status_code}")
@@ -89,35 +142,35 @@ def login(username, password):
     return session, federation_id
 
 def extract_federation_id(response):
+    return extract_federation_id_from_page(response.url, response.text,
+                                           ((cookie.name, cookie.value) for cookie in response.cookies))
+
+def extract_federation_id_from_page(url, page, cookies):
     # Method 1: Try to extract from URL
-    match = re.search(r'fid0=([^&]+)', response.url)
+    match = re.search(r'fid0=([^&]+)', url)
     if match:
         return urllib.parse.unquote(match.group(1))
 
-    # Method 2: Try to extract from page content
-    soup = BeautifulSoup(response.text, 'html.parser')
-    logout_link = soup.find('a', class_='logInOrOut')
-    if logout_link:
-        small_span = logout_link.find('span', class_='small')
-        if small_span:
-            # Extract the text after the hyphen
-            federation_id = small_span.text.strip().split('-')[-1].strip()
-            if federation_id:
-                return federation_id
+    # Method 2: Try to extract from page content, the small span of the logout link
+    small_span = find_element(page, ('a', 'class', 'logInOrOut'), ('span', 'class', 'small'))
+    if small_span:
+        # Extract the text after the hyphen
+        federation_id = small_span[1].strip().split('-')[-1].strip()
+        if federation_id:
+            return federation_id
 
     # Method 3: Try to extract from cookies
-    for cookie in response.cookies:
-        if 'FederationId' in cookie.name:
-            return cookie.value
+    for name, value in cookies:
+        if 'FederationId' in name:
+            return value
 
     return None
 
-def get_data(session, start_date, end_date, federation_id):
-    if not federation_id:
-        raise ValueError("Federation ID cannot be empty")
-
-    url = f"https://{domain}/Home/GetCalendarData"
-    referrer = f"https://{domain}/cal?vt=month&dt={start_date.strftime('%Y-%m-%d')}&et=student&fid0={urllib.parse.quote(federation_id)}"
+def get_calendar_request(start_date, end_date, federation_id):
+    # Both days are included: CELCAT returns the events overlapping start to
+    # end, the month ranges end on the last day of the month
+    url = f"{scheme}://{domain}/Home/GetCalendarData"
+    referrer = f"{scheme}://{domain}/cal?vt=month&dt={start_date.strftime('%Y-%m-%d')}&et=student&fid0={urllib.parse.quote(federation_id)}"
     
     headers = {
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:130.0) Gecko/20100101 Firefox/130.0",
@@ -140,6 +193,24 @@ def get_data(session, start_date, end_date, federation_id):
         "federationIds[]": federation_id,
         "colourScheme": "6"
     }
+    return url, headers, data
+
+def get_data(session, start_date, end_date, federation_id, cache=None):
+    if not federation_id:
+        raise ValueError("Federation ID cannot be empty")
+
+    url, headers, data = get_calendar_request(start_date, end_date, federation_id)
+
+    cache_key = (federation_id, data["start"], data["end"], data["resType"])
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is not None:
+        if cache.is_fresh(cached):
+            cache.record('hits')
+            return cached['data']
+        if cached.get('etag'):
+            headers["If-None-Match"] = cached['etag']
+        if cached.get('last_modified'):
+            headers["If-Modified-Since"] = cached['last_modified']
     
     """ print(f"\n--- Request Details ---")
     print(f"URL: {url}")
@@ -155,7 +226,9 @@ def get_data(session, start_date, end_date, federation_id):
         print(f"  {cookie.name}: {cookie.value}") """
     
     try:
-        response = session.post(url, headers=headers, data=data)
+        with metrics.span("celcat.get_calendar_data"):
+            response = session.post(url, headers=headers, data=data)
+        record_response(response)
         """ print("\n--- Response Details ---")
         print(f"Status Code: {response.status_code}")
         print(f"Response Headers:")
@@ -164,10 +237,25 @@ def get_data(session, start_date, end_date, federation_id):
         
         print("\n--- Response Content ---")
         print(response.text[:1000])  # Print first 1000 characters of the response """
+
+        if cached is not None and response.status_code == 304:
+            metrics.count("celcat.not_modified")
+            cache.touch(cache_key)
+            cache.record('not_modified')
+            return cached['data']
+
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if cached is not None and cached['hash'] == content_hash:
+            # Same body without validator support: no need to decode it again
+            cache.touch(cache_key)
+            cache.record('unchanged')
+            return cached['data']
         
         if response.text:
             try:
-                json_data = response.json()
+                with metrics.span("celcat.json_decode"):
+                    json_data = response.json()
+                metrics.count("celcat.events_fetched", len(json_data))
                 """ print("\n--- Parsed JSON Data ---")
                 print(f"Number of events: {len(json_data)}")
                 if json_data:
@@ -175,6 +263,15 @@ def get_data(session, start_date, end_date, federation_id):
                     print(json.dumps(json_data[0], indent=2))
                 else:
                     print("JSON data is empty") """
+                if cache is not None:
+                    cache.record('misses')
+                    cache.put(cache_key, {
+                        'data': json_data,
+                        'hash': content_hash,
+                        'etag': response.headers.get("ETag"),
+                        'last_modified': response.headers.get("Last-Modified"),
+                        'fetched_at': time.time(),
+                    })
                 return json_data
             except json.JSONDecodeError as e:
                 print(f"Failed to parse JSON: {e}")
@@ -188,6 +285,66 @@ def get_data(session, start_date, end_date, federation_id):
         raise
 
 
+def get_session_cache_path(username):
+    key = hashlib.sha256(f"{domain}\n{username}".encode("utf-8")).hexdigest()[:32]
+    return os.path.join(SESSION_CACHE_DIR, f"{key}.pickle")
+
+def is_session_valid(session, federation_id):
+    # Cheapest authenticated call: one day of calendar data. A rejected
+    # session is redirected to the login page instead of getting JSON.
+    today = datetime.now()
+    url, headers, data = get_calendar_request(today, today, federation_id)
+    try:
+        response = session.post(url, headers=headers, data=data, allow_redirects=False, timeout=30)
+    except requests.exceptions.RequestException:
+        return False
+    record_response(response)
+    return response.status_code == 200 and "json" in response.headers.get("Content-Type", "")
+
+def load_cached_session(username, max_age=SESSION_MAX_AGE):
+    path = get_session_cache_path(username)
+    try:
+        with open(path, "rb") as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None, None
+
+    if time.time() - cached["saved_at"] > max_age or not cached["federation_id"]:
+        return None, None
+
+    session = requests.Session()
+    session.cookies.update(cached["cookies"])
+    if not is_session_valid(session, cached["federation_id"]):
+        print("Cached session was rejected, logging in again.")
+        return None, None
+
+    print(f"Reusing cached session for federation ID: {cached['federation_id']}")
+    return session, cached["federation_id"]
+
+def save_cached_session(username, session, federation_id):
+    os.makedirs(SESSION_CACHE_DIR, mode=0o700, exist_ok=True)
+    path = get_session_cache_path(username)
+    # Written next to the target and renamed so concurrent batch workers
+    # never read a partial file. Cookies are credentials, keep them private.
+    temp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump({
+            "cookies": session.cookies,
+            "federation_id": federation_id,
+            "saved_at": time.time(),
+        }, f)
+    os.replace(temp_path, path)
+
+def login_cached(username, password):
+    session, federation_id = load_cached_session(username)
+    if session is not None:
+        return session, federation_id
+
+    session, federation_id = login(username, password)
+    save_cached_session(username, session, federation_id)
+    return session, federation_id
+
 def get_category_color(category):
     colors = {
         "TD": "#ff8080",
@@ -197,35 +354,66 @@ def get_category_color(category):
     }
     return colors.get(category, "#ffc4c4")
 
+def compile_keywords(keywords):
+    return re.compile("|".join(re.escape(keyword) for keyword in keywords))
+
+LOCATION_KEYWORDS = compile_keywords(["porte", "amphi", "espace modulaire", "salle"])
+CLASS_GROUP_KEYWORDS = compile_keywords(["vet", "classe", "group"])
+NOT_TEACHER_KEYWORDS = compile_keywords(["td", "cm", "e-learning", "journée thématique", "porte", "amphi", "conférences", "congrès", "[", "]", "03", "auto-évaluation en ligne", "travail", "tp", "tp/td","contrôle", "forum"])
+
+@functools.lru_cache(maxsize=8192)
+def classify_description_line(raw_line):
+    # The same room, group and teacher lines come back for most events, so
+    # each distinct line is unescaped and matched only once.
+    line = html.unescape(raw_line.strip())
+    lowered = line.lower()
+
+    if LOCATION_KEYWORDS.search(lowered):
+        return "locations", line
+    if '[' in line and ']' in line and CLASS_GROUP_KEYWORDS.search(lowered):
+        return "class_groups", line
+    if line and not NOT_TEACHER_KEYWORDS.search(lowered):
+        return "teachers", line
+    return None, line
+
+# Room, teacher and group tuples repeat across most events of a calendar,
+# records share one tuple per distinct value.
+SHARED_VALUES_MAX = 65536
+shared_values = {}
+
+def intern_text(value):
+    return sys.intern(value) if value else value
+
+def share_value(value):
+    if len(shared_values) >= SHARED_VALUES_MAX:
+        shared_values.clear()
+    return shared_values.setdefault(value, value)
+
 def parse_event(event):
     description_lines = event['description'].split('<br />')
     
-    title = f"{event['eventCategory']} - {event['modules'][0]}" if event['modules'] else f"{event['eventCategory']} - Other"
-    description = description_lines[0].strip()
+    category = event['eventCategory']
+    module = event['modules'][0] if event['modules'] else "Other"
     
-    locations = []
-    teachers = []
-    class_groups = []
+    fields = {"locations": [], "teachers": [], "class_groups": []}
     
-    for line in description_lines[1:]:
-        line = html.unescape(line.strip())
-        
-        if any(keyword in line.lower() for keyword in ["porte", "amphi", "espace modulaire", "salle"]):
-            locations.append(line)
-        elif '[' in line and ']' in line and any(class_keyword in line.lower() for class_keyword in ["vet", "classe", "group"]):
-            class_groups.append(line)
-        elif line and not any(keyword in line.lower() for keyword in ["td", "cm", "e-learning", "journée thématique", "porte", "amphi", "conférences", "congrès", "[", "]", "03", "auto-évaluation en ligne", "travail", "tp", "tp/td","contrôle", "forum"]):
-            teachers.append(line)
+    for raw_line in description_lines[1:]:
+        kind, line = classify_description_line(raw_line)
+        if kind is not None:
+            fields[kind].append(line)
     
-    return {
-        "title": title,
-        "description": description,
-        "locations": locations,
-        "teachers": teachers,
-        "class_groups": class_groups,
-        "category": event['eventCategory'],
-        "module": event['modules'][0] if event['modules'] else "Other"
-    }
+    return EventRecord(
+        event['id'],
+        intern_text(event['start']),
+        intern_text(event['end']),
+        intern_text(f"{category} - {module}"),
+        intern_text(description_lines[0].strip()),
+        intern_text(category),
+        intern_text(module),
+        share_value(tuple(fields["locations"])),
+        share_value(tuple(fields["teachers"])),
+        share_value(tuple(fields["class_groups"])),
+    )
 
 def get_module_color(module):
     color_scheme = {
@@ -264,14 +452,16 @@ def get_module_color(module):
     module_number = module.split()[0] if module != "Other" else "Other"
     return color_scheme.get(module_number, color_scheme["Other"])
 
-def get_module_calendars(data):
+@metrics.timed("parse.module_calendars")
+def get_module_calendars(data, store=None):
+    metrics.count("events.parsed", len(data))
     calendars = {}
     for event in data:
         if event['eventCategory'] in ["CONGES", "FERIE", "PONT", "Stage", "Férié"] or event['eventCategory'] is None:
             continue
         
-        details = parse_event(event)
-        module = details['module'].split()[0] if details['module'] != "Other" else "Other"
+        record = store.get(event) if store is not None else parse_event(event)
+        module = record.module.split()[0] if record.module != "Other" else "Other"
         
         if not module or module == "Other":
                 module = "Other"
@@ -279,7 +469,7 @@ def get_module_calendars(data):
         if module not in calendars:
             calendars[module] = []
         
-        calendars[module].append((event, details))
+        calendars[module].append(record)
     
     if "Other" not in calendars:
         calendars["Other"] = []
@@ -287,71 +477,82 @@ def get_module_calendars(data):
     return calendars
 
 
+def get_ical_timestamp():
+    return datetime.now(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+
+@metrics.timed("ics.generate")
 def generate_ical(events, calendar_name):
-    ical = [
-        "BEGIN:VCALENDAR",
-        "VERSION:2.0",
-        f"PRODID:-//Oniris Nantes//CELCAT {calendar_name}//FR",
-        "CALSCALE:GREGORIAN",
-        "METHOD:PUBLISH",
-        f"X-WR-CALNAME:CELCAT-EDT {calendar_name}",
-        "X-WR-TIMEZONE:Europe/Paris"
-    ]
-
-    now = datetime.now(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
-
-    def clean_and_escape(text):
-        decoded = html.unescape(text)
-        
-        if text is None:
-            print("Warning: None value passed to clean_and_escape")
-            return ""
-        
-        return decoded.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
-
-    for event, details in events:
-        description = f"{details['description']}\n"
-        if details['locations']:
-            description += f"Salle(s): {', '.join(details['locations'])}\n"
-        if details['teachers']:
-            description += f"Professeur(e)(s): {', '.join(details['teachers'])}\n"
-        if details['class_groups']:
-            description += f"Classe(s)/Groupe(s): {', '.join(details['class_groups'])}"
-        
-        # Clean and escape all text fields
-        cleaned_description = clean_and_escape(description)
-        cleaned_title = clean_and_escape(details['title'])
-        cleaned_category = clean_and_escape(details['category'])
-        
-        ical.extend([
-            "BEGIN:VEVENT",
-            f"UID:{event['id']}",
-            f"DTSTAMP:{now}",
-            f"DTSTART:{event['start'].replace('-', '').replace(':', '') if event['start'] else ''}",
-            f"DTEND:{event['end'].replace('-', '').replace(':', '') if event['end'] else ''}",
-            f"SUMMARY:{cleaned_title}",
-            f"DESCRIPTION:{cleaned_description}",
-            f"CATEGORIES:{cleaned_category}",
-        ])
-        ical.append("END:VEVENT")
-
-    ical.append("END:VCALENDAR")
-    return "\r\n".join(ical)
-
-
-def data_to_ical(data):
-    module_calendars = get_module_calendars(data)
-    ical_calendars = {}
-
-    # Generate main calendar
-    all_events = [item for sublist in module_calendars.values() for item in sublist]
-    ical_calendars["Main"] = generate_ical(all_events, "Main")
-    # Generate individual module calendars
+    now = get_ical_timestamp()
+    ical = [ics.format_calendar_header(calendar_name)]
+    for record in events:
+        ical.append(ics.format_event(record, now))
+    ical.append(ics.CALENDAR_FOOTER)
+    return "".join(ical)
+
+
+@metrics.timed("ics.data_to_ical")
+def data_to_ical(data, store=None):
+    module_calendars = get_module_calendars(data, store)
+    now = get_ical_timestamp()
+    # Each event is formatted once for its module calendar and for Main,
+    # without building a flattened list of every event first.
+    main = [ics.format_calendar_header("Main")]
+    ical_calendars = {"Main": None}
     for module, events in module_calendars.items():
-        ical_calendars[module] = generate_ical(events, module)
+        vevents = [ics.format_event(record, now) for record in events]
+        main.extend(vevents)
+        ical_calendars[module] = ics.format_calendar_header(module) + "".join(vevents) + ics.CALENDAR_FOOTER
+    main.append(ics.CALENDAR_FOOTER)
+    ical_calendars["Main"] = "".join(main)
 
     return ical_calendars
 
+def get_calendar_filename(directory, calendar_name, start_date, end_date):
+    return f"{directory}/calendar_{calendar_name}_{start_date.date()}_{end_date.date()}.ics"
+
+@metrics.timed("ics.write_files")
+def write_ical_files(module_calendars, directory, start_date, end_date, calendar_names=None):
+    # Each event is formatted once and written to the Main calendar and to
+    # its module calendar, no calendar is ever held in memory as a whole.
+    os.makedirs(directory, exist_ok=True)
+    calendar_names = calendar_names or ["Main"] + list(module_calendars)
+
+    files = {}
+    generated_files = []
+    try:
+        for calendar_name in calendar_names:
+            filename = get_calendar_filename(directory, calendar_name, start_date, end_date)
+            files[calendar_name] = open(filename, "w", encoding="utf-8", newline="", buffering=1 << 16)
+            files[calendar_name].write(ics.format_calendar_header(calendar_name))
+            generated_files.append((calendar_name, filename))
+
+        now = get_ical_timestamp()
+        main_file = files.get("Main")
+        for module, events in module_calendars.items():
+            module_file = files.get(module)
+            if main_file is None and module_file is None:
+                continue
+            for record in events:
+                vevent = ics.format_event(record, now)
+                if main_file is not None:
+                    main_file.write(vevent)
+                if module_file is not None:
+                    module_file.write(vevent)
+
+        for f in files.values():
+            f.write(ics.CALENDAR_FOOTER)
+        metrics.count("ics.files_written", len(files))
+    finally:
+        for f in files.values():
+            f.close()
+
+    # tell() of a text file is an opaque cookie, not a byte count
+    metrics.count("ics.bytes_written", sum(os.path.getsize(filename) for _, filename in generated_files))
+
+    for calendar_name, filename in generated_files:
+        print(f"Calendar data for {calendar_name} has been exported to {filename}")
+    return generated_files
+
 def get_month_range(year, month):
     start_date = datetime(year, month, 1)
     if month == 12:
@@ -360,95 +561,251 @@ def get_month_range(year, month):
         end_date = datetime(year, month + 1, 1)
     return start_date, end_date - timedelta(days=1)
 
-def main():
+def get_payload_hash(data):
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_export_state(directory, payload_hash):
+    # Files of a previous full export of exactly the same payload
+    try:
+        with open(os.path.join(directory, EXPORT_STATE_FILE), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("hash") != payload_hash:
+        return None
+    generated_files = [tuple(item) for item in state.get("files", [])]
+    if not all(os.path.exists(filename) for _, filename in generated_files):
+        return None
+    return generated_files
+
+def save_export_state(directory, payload_hash, generated_files):
+    with open(os.path.join(directory, EXPORT_STATE_FILE), "w", encoding="utf-8") as f:
+        json.dump({"hash": payload_hash, "files": generated_files}, f)
+
+def get_changed_calendars(changeset, calendar_names, directory, start_date, end_date):
+    # Main holds every module, it changes as soon as one of them does.
+    # Files that went missing are written again whatever the index says.
+    changed = [name for name in changeset if name not in calendar_names] + [
+        name for name in calendar_names
+        if name in changeset or not os.path.exists(get_calendar_filename(directory, name, start_date, end_date))]
+    if changeset and "Main" not in changed:
+        changed.insert(0, "Main")
+    return changed
+
+def write_changed_ical_files(module_calendars, directory, start_date, end_date, index):
+    # Only the calendars with added, modified or removed events since the
+    # last export to this directory are rewritten.
+    scope = f"ics:{os.path.abspath(directory)}"
+    calendar_names = ["Main"] + list(module_calendars)
+    changeset = index.get_changeset(scope, module_calendars, start_date, end_date)
+    changed = get_changed_calendars(changeset, calendar_names, directory, start_date, end_date)
+    if changed:
+        write_ical_files(module_calendars, directory, start_date, end_date, changed)
+    index.record_changeset(scope, changeset)
+
+    for module, changes in changeset.items():
+        print(f"{module}: {len(changes.added)} added, {len(changes.modified)} modified, {len(changes.removed)} removed")
+    print(f"{len(calendar_names) - len(set(calendar_names) & set(changed))} calendar file(s) unchanged.")
+    return [(name, get_calendar_filename(directory, name, start_date, end_date))
+            for name in calendar_names + [name for name in changed if name not in calendar_names]]
+
+def split_date_range(start_date, end_date, chunk="month"):
+    # Chunks are inclusive on both ends, like get_month_range
+    chunks = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        if chunk == "week":
+            chunk_end = chunk_start + timedelta(days=6 - chunk_start.weekday())
+        else:
+            chunk_end = get_month_range(chunk_start.year, chunk_start.month)[1]
+        chunk_end = min(chunk_end, end_date)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+@metrics.timed("celcat.get_data_range")
+def get_data_range(session, start_date, end_date, federation_id, chunk="month", workers=4, cache=None):
+    chunks = split_date_range(start_date, end_date, chunk)
+    print(f"Fetching {len(chunks)} {chunk} chunk(s) with {workers} worker(s)...")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda dates: get_data(session, dates[0], dates[1], federation_id, cache), chunks))
+
+    if any(result is None for result in results):
+        return None
+
+    # Events spanning a chunk boundary are returned by both chunks
+    events = {}
+    for result in results:
+        for event in result:
+            events.setdefault(event['id'], event)
+    return list(events.values())
+
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export a CELCAT calendar to ICS files.")
+    parser.add_argument("--from", dest="start_date", type=parse_date,
+                        help="First day to export (YYYY-MM-DD). Prompts for a single month when omitted.")
+    parser.add_argument("--to", dest="end_date", type=parse_date,
+                        help="Last day to export (YYYY-MM-DD), inclusive.")
+    parser.add_argument("--chunk", choices=["month", "week"], default="month",
+                        help="Size of the requests the date range is split into (default: month).")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Number of chunks fetched concurrently (default: 4).")
+    parser.add_argument("--cache-ttl", type=int, default=FETCH_CACHE_TTL,
+                        help=f"Seconds during which cached calendar data is used without asking CELCAT (default: {FETCH_CACHE_TTL}).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always download calendar data and rewrite the ICS files.")
+    parser.add_argument("--no-ics", action="store_true",
+                        help="Do not write ICS files, only hand the parsed events to the Google import.")
+    parser.add_argument("--events", metavar="DIR",
+                        help="Also export every parsed event to this directory as Parquet or compressed JSON lines.")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if (args.start_date is None) != (args.end_date is None):
+        parser.error("--from and --to must be used together")
+    if args.start_date and args.start_date > args.end_date:
+        parser.error("--from must not be after --to")
+    if args.events:
+        # Checked before anything is fetched, EventExporter refuses it too
+        from event_export import is_used_directory
+        if is_used_directory(args.events):
+            parser.error(f"'{args.events}' is not empty, choose a new directory for the event export")
+    return args
+
+def export(argv=None):
+    args = parse_args(argv)
+
     username = input("Enter your username: ")
-    password = input("Enter your password: ")
 
     try:
-        session, federation_id = login(username, password)
-        print("Login successful!")
+        session, federation_id = load_cached_session(username)
+        if session is None:
+            password = input("Enter your password: ")
+            session, federation_id = login(username, password)
+            print("Login successful!")
+
+            if not federation_id:
+                federation_id = input("Enter your Federation ID manually (generally it's Lastname Firstname): ")
 
-        if not federation_id:
-            federation_id = input("Enter your Federation ID manually (generally it's Lastname Firstname): ")
+            save_cached_session(username, session, federation_id)
 
-        time.sleep(1)
+        cache = None if args.no_cache else ResponseCache(FETCH_CACHE_PATH, args.cache_ttl, FETCH_CACHE_MAX_ENTRIES)
 
-        # Get current year and month
-        current_date = datetime.now()
-        current_year = current_date.year
-        current_month = current_date.month
+        if args.start_date:
+            start_date, end_date = args.start_date, args.end_date
+            print(f"Fetching calendar data from {start_date.date()} to {end_date.date()}...")
+            data = get_data_range(session, start_date, end_date, federation_id, args.chunk, args.workers, cache)
+        else:
+            # Get current year and month
+            current_date = datetime.now()
+            current_year = current_date.year
+            current_month = current_date.month
 
-        # Ask user for year and month
-        year = int(input(f"Enter year (default: {current_year}): ") or current_year)
-        month = int(input(f"Enter month (1-12, default: {current_month}): ") or current_month)
+            # Ask user for year and month
+            year = int(input(f"Enter year (default: {current_year}): ") or current_year)
+            month = int(input(f"Enter month (1-12, default: {current_month}): ") or current_month)
 
-        # Validate month input
-        if month < 1 or month > 12:
-            print("Invalid month. Using current month.")
-            month = current_month
+            # Validate month input
+            if month < 1 or month > 12:
+                print("Invalid month. Using current month.")
+                month = current_month
 
-        start_date, end_date = get_month_range(year, month)
+            start_date, end_date = get_month_range(year, month)
 
-        print(f"Fetching calendar data from {start_date.date()} to {end_date.date()}...")
-        data = get_data(session, start_date, end_date, federation_id)
-        print("Successfully retrieved and parsed JSON data.")
-        print(f"Number of events: {len(data)}")
+            print(f"Fetching calendar data from {start_date.date()} to {end_date.date()}...")
+            data = get_data(session, start_date, end_date, federation_id, cache)
+
+        if cache is not None:
+            cache.save()
+            print(f"Fetch cache: {cache.stats()}")
         
         if data is None:
             print("Failed to retrieve or parse calendar data.")
-            return []
+            return None
         elif not data:
             print("No events found in the specified date range.")
-            return []
+            return None
         else:
             print(f"Successfully retrieved {len(data)} events.")
 
-        ical_calendars = data_to_ical(data)
-
-        import_all = input("Do you want to import all sub-calendars? (yes/no, default: yes): ").lower() != 'no'
-
         # Create a directory for the calendar files
-        import os
         directory = f"calendar_export_{start_date.date()}_{end_date.date()}"
-        os.makedirs(directory, exist_ok=True)
 
-        generated_files = []
+        payload_hash = get_payload_hash(data)
+        if not args.no_cache and not args.no_ics and not args.events:
+            generated_files = load_export_state(directory, payload_hash)
+            if generated_files:
+                print(f"Calendar data has not changed since the last export to the '{directory}' directory.")
+                # Parsing is cheap next to reading the files back, and lets
+                # the Google import stay incremental
+                return ExportResult(generated_files, get_module_calendars(data), start_date, end_date)
+
+        module_calendars = get_module_calendars(data)
+        calendar_names = ["Main"] + list(module_calendars)
+
+        if args.events:
+            from event_export import EventExporter
+            exporter = EventExporter(args.events)
+            exporter.add(federation_id, module_calendars)
+            manifest = exporter.close()
+            print(f"{manifest['counts']['events']} events exported to the '{args.events}' directory.")
+
+        import_all = input("Do you want to import all sub-calendars? (yes/no, default: yes): ").lower() != 'no'
+
         if import_all:
-            for calendar_name, ical_data in ical_calendars.items():
-                filename = f"{directory}/calendar_{calendar_name}_{start_date.date()}_{end_date.date()}.ics"
-                with open(filename, "w", encoding="utf-8") as f:
-                    f.write(ical_data)
-                print(f"Calendar data for {calendar_name} has been exported to {filename}")
-                generated_files.append((calendar_name, filename))
+            selected_names = calendar_names
         else:
             print("Available sub-calendars:")
-            for i, calendar_name in enumerate(ical_calendars.keys(), 1):
+            for i, calendar_name in enumerate(calendar_names, 1):
                 print(f"{i}. {calendar_name}")
             
             while True:
                 choice = input("Enter the number of the sub-calendar you want to import: ")
                 try:
                     index = int(choice) - 1
-                    if 0 <= index < len(ical_calendars):
-                        calendar_name = list(ical_calendars.keys())[index]
-                        ical_data = ical_calendars[calendar_name]
-                        filename = f"{directory}/calendar_{calendar_name}_{start_date.date()}_{end_date.date()}.ics"
-                        with open(filename, "w", encoding="utf-8") as f:
-                            f.write(ical_data)
-                        print(f"Calendar data for {calendar_name} has been exported to {filename}")
-                        generated_files.append((calendar_name, filename))
+                    if 0 <= index < len(calendar_names):
+                        selected_names = [calendar_names[index]]
                         break
                     else:
                         print("Invalid choice. Please try again.")
                 except ValueError:
                     print("Invalid input. Please enter a number.")
-        
-        print(f"\nAll calendar files have been exported to the '{directory}' directory.")
-        return generated_files
+
+        if "Main" not in selected_names:
+            module_calendars = {name: module_calendars[name] for name in selected_names}
+
+        generated_files = []
+        if not args.no_ics:
+            if import_all and not args.no_cache:
+                index = ChangeIndex()
+                generated_files = write_changed_ical_files(module_calendars, directory, start_date, end_date, index)
+                index.close()
+            else:
+                generated_files = write_ical_files(module_calendars, directory, start_date, end_date, selected_names)
+            if import_all:
+                save_export_state(directory, payload_hash, generated_files)
+            print(f"\nAll calendar files have been exported to the '{directory}' directory.")
+
+        # Main is built from every module but never pushed to Google, like
+        # the ICS import skips its file
+        if "Main" in selected_names and not import_all:
+            module_calendars = {}
+        return ExportResult(generated_files, module_calendars, start_date, end_date)
 
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-        return []
+        return None
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics.start(args)
+    result = export(argv)
+    metrics.finish(args)
+    return result.files if result else []
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def unthrottled(monkeypatch):
+    # The fake Google service has no quota, tests shouldn't wait for pacing
+    import import_google
+    limiter = import_google.GOOGLE_RATE_LIMITER
+    for name in ("rate", "max_rate", "burst", "tokens"):
+        monkeypatch.setattr(limiter, name, float("inf"))
+    return limiter
@@ -0,0 +1,158 @@
+import collections
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+# Recorded GetCalendarData responses and CELCAT pages
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CALENDAR_DATA = ["calendar_data_class_a.json", "calendar_data_class_b.json", "calendar_data_edge_cases.json"]
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+def get_event_time(event, key):
+    return parse_time(event[key]['dateTime'])
+
+def make_http_error(status, reason):
+    content = json.dumps({'error': {'code': status, 'errors': [{'reason': reason}]}})
+    return HttpError(httplib2.Response({'status': status}), content.encode())
+
+class FakeRequest:
+    def __init__(self, run, latency=0, service=None):
+        self.run = run
+        self.latency = latency
+        self.service = service
+
+    def execute(self):
+        time.sleep(self.latency)
+        error = self.service.next_error() if self.service else None
+        if error:
+            raise error
+        return self.run()
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self):
+        # One round trip for the whole batch
+        time.sleep(self.service.latency)
+        self.service.batch_sizes.append(len(self.requests))
+        for request_id, request, callback in self.requests:
+            error = self.service.next_error()
+            if error:
+                callback(request_id, None, error)
+            else:
+                callback(request_id, request.run(), None)
+
+class FakeEvents:
+    def __init__(self, service):
+        self.service = service
+        self.calendars = service.calendars
+        self.ids = service.ids
+
+    def list(self, calendarId, pageToken=None, maxResults=250, privateExtendedProperty=None, timeMin=None,
+             timeMax=None, **kwargs):
+        def run():
+            events = list(self.calendars.get(calendarId, {}).values())
+            # Like Google, the events overlapping the range
+            if timeMin is not None:
+                events = [event for event in events if get_event_time(event, 'end') > parse_time(timeMin)]
+            if timeMax is not None:
+                events = [event for event in events if get_event_time(event, 'start') < parse_time(timeMax)]
+            if privateExtendedProperty is not None:
+                key, _, value = privateExtendedProperty.partition("=")
+                events = [event for event in events
+                          if event.get('extendedProperties', {}).get('private', {}).get(key) == value]
+            offset = int(pageToken or 0)
+            page = events[offset:offset + maxResults]
+            result = {'items': page}
+            if offset + maxResults < len(events):
+                result['nextPageToken'] = str(offset + maxResults)
+            return result
+        return FakeRequest(run, self.service.latency, self.service)
+
+    def insert(self, calendarId, body):
+        def run():
+            event = dict(body, id=str(next(self.ids)))
+            self.calendars.setdefault(calendarId, {})[event['id']] = event
+            return event
+        return FakeRequest(run)
+
+    def patch(self, calendarId, eventId, body):
+        def run():
+            event = self.calendars[calendarId][eventId]
+            event.update(body)
+            return event
+        return FakeRequest(run)
+
+    def delete(self, calendarId, eventId):
+        def run():
+            del self.calendars[calendarId][eventId]
+            return ""
+        return FakeRequest(run)
+
+class FakeGoogleService:
+    # In-memory stand-in for the googleapiclient Calendar service, enough
+    # for the batch, list, insert, patch and delete calls of import_google.
+    # Every HTTP request (a list call or a whole batch) takes latency seconds.
+    # batch_sizes records the number of calls of every executed batch.
+    # errors are (status, reason) pairs, the next calls fail with them in
+    # order, e.g. (429, "rateLimitExceeded"). A None lets one call through.
+    def __init__(self, latency=0, errors=()):
+        self.calendars = {}
+        self.ids = itertools.count(1)
+        self.latency = latency
+        self.batch_sizes = []
+        self.errors = collections.deque(errors)
+
+    def next_error(self):
+        error = self.errors.popleft() if self.errors else None
+        return make_http_error(*error) if error else None
+
+    def events(self):
+        return FakeEvents(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+def get_events_between(events, start, end):
+    # What GetCalendarData returns: the events overlapping start to end,
+    # both days included
+    return [event for event in events
+            if event['start'][:10] <= end and (event['end'] or event['start'])[:10] >= start]
+
+class FakeCelcatResponse:
+    def __init__(self, body):
+        self.status_code = 200
+        self.content = body.encode("utf-8")
+        self.text = body
+        self.headers = {}
+        self.url = ""
+
+    def json(self):
+        return json.loads(self.text)
+
+class FakeCelcatSession:
+    # Answers GetCalendarData posts from a list of recorded events
+    def __init__(self, events):
+        self.events = events
+        self.requests = []
+
+    def post(self, url, headers=None, data=None):
+        self.requests.append((data['start'], data['end']))
+        return FakeCelcatResponse(json.dumps(get_events_between(self.events, data['start'], data['end'])))
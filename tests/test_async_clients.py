@@ -0,0 +1,51 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import async_clients
+from async_clients import AsyncGoogleCalendarClient, GoogleApiError
+
+START = datetime(2026, 9, 1)
+END = datetime(2026, 9, 30)
+
+class FakeClient(AsyncGoogleCalendarClient):
+    # Answers from memory, inserts of the ids in failing raise like a 403
+    def __init__(self, existing, failing=()):
+        self.existing = existing
+        self.failing = set(failing)
+        self.inserted = []
+
+    async def list_events(self, calendar_id, time_min, time_max, fields):
+        for event in self.existing:
+            yield event
+
+    async def delete_event(self, calendar_id, event_id):
+        return None
+
+    async def insert_event(self, calendar_id, body):
+        if body['id'] in self.failing:
+            raise GoogleApiError(403, '{"error": {"errors": [{"reason": "forbidden"}]}}')
+        self.inserted.append(body['id'])
+        return body
+
+def get_google_events(count):
+    return [(f"uid{i}", {'id': f"uid{i}"}) for i in range(count)]
+
+def test_replace_events_returns_failures():
+    google = FakeClient([{'id': "old1"}, {'id': "old2"}], failing={"uid3"})
+
+    counts = asyncio.run(google.replace_events("calendar", get_google_events(5), START, END))
+
+    assert counts == {'inserted': 4, 'deleted': 2, 'failed': 1}
+
+def test_push_user_reports_replace_failures(monkeypatch):
+    google = FakeClient([], failing={"uid0"})
+    monkeypatch.setattr(async_clients.import_google, "records_to_google_events", lambda events: events)
+    user = {'calendar_mappings': '{"031": "calendar"}'}
+
+    with pytest.raises(Exception, match="1 event"):
+        asyncio.run(async_clients.push_user(google, user, {"031": get_google_events(3)}, START, END, sync=False))
+    assert google.inserted == ["uid1", "uid2"]
@@ -0,0 +1,36 @@
+import pytest
+
+import batch
+
+@pytest.fixture
+def logins(monkeypatch):
+    calls = []
+    def login_cached(username, password):
+        calls.append((username, password))
+        return "session", "page-id"
+    monkeypatch.setattr(batch, "login_cached", login_cached)
+    return calls
+
+def test_rows_without_password_use_the_viewer(logins):
+    assert batch.login_user({'username': "student"}, ("viewer", "secret")) == ("session", "page-id")
+    assert batch.login_user({'username': "student", 'password': "pw", 'federation_id': "123"},
+                            ("viewer", "secret")) == ("session", "123")
+    assert logins == [("viewer", "secret"), ("student", "pw")]
+
+def test_no_credentials_never_logs_in(logins):
+    with pytest.raises(ValueError, match="No credentials"):
+        batch.login_user({'federation_id': "123"}, (None, None))
+    assert logins == []
+
+def test_missing_federation_id(monkeypatch):
+    monkeypatch.setattr(batch, "login_cached", lambda username, password: ("session", None))
+    with pytest.raises(ValueError, match="Unable to extract federation ID"):
+        batch.login_user({'username': "student", 'password': "pw"}, (None, None))
+
+def test_list_payload_files(tmp_path):
+    for name in ("b.json", "a.json", "notes.txt"):
+        (tmp_path / name).write_text("[]")
+    single = str(tmp_path / "notes.txt")
+
+    assert batch.list_payload_files([str(tmp_path), single]) == [
+        str(tmp_path / "a.json"), str(tmp_path / "b.json"), single]
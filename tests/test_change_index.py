@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import pytest
+
+from change_index import ChangeIndex
+from script import EventRecord
+
+@pytest.fixture
+def index(tmp_path):
+    index = ChangeIndex(str(tmp_path / "index.sqlite3"))
+    yield index
+    index.close()
+
+def test_missing_ranges(index):
+    assert index.get_missing_ranges("s", datetime(2026, 9, 1), datetime(2026, 9, 30)) == \
+        [(datetime(2026, 9, 1), datetime(2026, 9, 30))]
+
+    index.record_range("s", datetime(2026, 9, 10), datetime(2026, 9, 15))
+    index.record_range("s", datetime(2026, 9, 20), datetime(2026, 10, 5))
+
+    assert index.get_missing_ranges("s", datetime(2026, 9, 1), datetime(2026, 9, 30)) == [
+        (datetime(2026, 9, 1), datetime(2026, 9, 9)),
+        (datetime(2026, 9, 16), datetime(2026, 9, 19)),
+    ]
+    assert index.get_missing_ranges("s", datetime(2026, 9, 12), datetime(2026, 9, 14)) == []
+    assert index.get_missing_ranges("other", datetime(2026, 9, 12), datetime(2026, 9, 14)) == \
+        [(datetime(2026, 9, 12), datetime(2026, 9, 14))]
+
+def test_touching_ranges_are_merged(index):
+    index.record_range("s", datetime(2026, 9, 1), datetime(2026, 9, 10))
+    index.record_range("s", datetime(2026, 9, 11), datetime(2026, 9, 20))
+    index.record_range("s", datetime(2026, 9, 5), datetime(2026, 9, 12))
+
+    assert index._db.execute("SELECT start, end FROM ranges").fetchall() == [("2026-09-01", "2026-09-20")]
+
+def test_forget_drops_ranges(index):
+    index.record_range("s", datetime(2026, 9, 1), datetime(2026, 9, 30))
+    index.forget("s")
+
+    assert index.get_missing_ranges("s", datetime(2026, 9, 1), datetime(2026, 9, 2)) == \
+        [(datetime(2026, 9, 1), datetime(2026, 9, 2))]
+
+def make_record(event_id, start, title="CM - Course"):
+    return EventRecord(event_id, start, None, title, "CM", "CM", "031 Anatomie", (), (), ())
+
+SEPTEMBER = (datetime(2026, 9, 1), datetime(2026, 9, 30))
+
+def test_diff(index):
+    records = [make_record("1", "2026-09-02T08:00:00"), make_record("2", "2026-09-03T08:00:00"),
+               make_record("3", "2026-09-30T08:00:00")]
+    assert index.diff("s", records, *SEPTEMBER) == (records, [], [])
+    index.record("s", index.diff("s", records, *SEPTEMBER))
+
+    changed = [records[0], make_record("2", "2026-09-03T08:00:00", "CM - Moved"), make_record("4", "2026-09-04T08:00:00")]
+    changes = index.diff("s", changed, *SEPTEMBER)
+
+    assert changes.added == [changed[2]]
+    assert changes.modified == [changed[1]]
+    # Removed on the last day of the range too
+    assert changes.removed == ["3"]
+    assert index.diff("s", records, *SEPTEMBER) == ([], [], [])
+
+def test_removals_are_limited_to_the_range(index):
+    records = [make_record("aug", "2026-08-31T08:00:00"), make_record("sep", "2026-09-15T08:00:00"),
+               make_record("oct", "2026-10-01T08:00:00")]
+    index.record("s", index.diff("s", records, datetime(2026, 8, 1), datetime(2026, 10, 31)))
+
+    assert index.diff("s", [], *SEPTEMBER).removed == ["sep"]
+
+def test_failed_ids_are_not_recorded(index):
+    records = [make_record("1", "2026-09-02T08:00:00"), make_record("2", "2026-09-03T08:00:00")]
+    index.record("s", index.diff("s", records, *SEPTEMBER), failed={"2"})
+
+    assert index.diff("s", records, *SEPTEMBER).added == [records[1]]
+
+    # A removal that failed is reported again
+    index.record("s", index.diff("s", records, *SEPTEMBER))
+    index.record("s", index.diff("s", [], *SEPTEMBER), failed={"1"})
+    assert index.diff("s", [], *SEPTEMBER).removed == ["1"]
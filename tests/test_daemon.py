@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import os
+import re
+
+import daemon
+import import_google
+from fakes import FakeCelcatSession, FakeGoogleService, load_fixture
+from import_google import ServicePool
+
+def get_celcat_data():
+    data = load_fixture("calendar_data_class_a.json")
+    # A Sunday course, on the last day of the near window, and an evening
+    # that runs into the far window
+    data.append(dict(data[0], id="sunday", start="2026-09-13T10:00:00", end="2026-09-13T12:00:00"))
+    data.append(dict(data[0], id="night", start="2026-09-13T22:00:00", end="2026-09-14T01:00:00"))
+    return data
+
+def make_daemon(monkeypatch, tmp_path, data, output_dir=None):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(import_google, "CALENDAR_IDS", {"031": "c31", "032": "c32", "033": "c33", "Other": "cother"})
+
+    instance = daemon.Daemon("user", "password", federation_id="FID", months=1, output_dir=output_dir, chunk="week")
+    instance.session = FakeCelcatSession(data)
+    instance.service = ServicePool(FakeGoogleService())
+    return instance
+
+def roll_to(instance, monkeypatch, today):
+    monkeypatch.setattr(daemon, "datetime", type("FixedDatetime", (datetime,), {"now": staticmethod(lambda: today)}))
+    instance.roll_windows()
+    for name in instance.windows:
+        instance.refresh(name)
+
+def get_pushed(instance):
+    return {event['extendedProperties']['private']['celcatUid']: event_id
+            for events in instance.service.service.calendars.values() for event_id, event in events.items()}
+
+def test_window_calendars_keep_events_of_their_days():
+    module_calendars = daemon.get_module_calendars(get_celcat_data())
+    near, far = daemon.get_windows(datetime(2026, 9, 9), 1)
+
+    near_calendars = daemon.get_window_calendars(module_calendars, near[1], near[2])
+    far_calendars = daemon.get_window_calendars(module_calendars, far[1], far[2])
+
+    near_ids = {event.id for events in near_calendars.values() for event in events}
+    far_ids = {event.id for events in far_calendars.values() for event in events}
+    assert {"sunday", "night"} <= near_ids
+    assert not near_ids & far_ids
+    assert all("2026-09-07" <= event.start[:10] <= "2026-09-13" for events in near_calendars.values() for event in events)
+
+def test_boundary_events_are_pushed_once(unthrottled, monkeypatch, tmp_path):
+    data = get_celcat_data()
+    instance = make_daemon(monkeypatch, tmp_path, data)
+    expected = {event.id for module, events in daemon.get_module_calendars(data).items()
+                if module in import_google.CALENDAR_IDS for event in events if event.start >= "2026-09-07"}
+
+    roll_to(instance, monkeypatch, datetime(2026, 9, 9))
+    pushed = get_pushed(instance)
+    assert {"sunday", "night"} <= set(pushed)
+    assert set(pushed) == expected
+
+    # The next week, the first far week becomes the near window: nothing
+    # is deleted and inserted again
+    roll_to(instance, monkeypatch, datetime(2026, 9, 16))
+    assert get_pushed(instance) == pushed
+
+def test_files_hold_boundary_events_once(unthrottled, monkeypatch, tmp_path):
+    instance = make_daemon(monkeypatch, tmp_path, get_celcat_data(), output_dir="out")
+
+    roll_to(instance, monkeypatch, datetime(2026, 9, 9))
+
+    # Both windows fetched the evening running past midnight
+    assert ("2026-09-07", "2026-09-13") in instance.session.requests
+    assert ("2026-09-14", "2026-09-20") in instance.session.requests
+    main_file = next(name for name in os.listdir("out") if name.startswith("calendar_Main_"))
+    with open(os.path.join("out", main_file), encoding="utf-8") as f:
+        uids = re.findall(r"^UID:(.*)\r?$", f.read(), re.MULTILINE)
+    assert len(uids) == len(set(uids))
+    assert sum("night" in uid for uid in uids) == 1
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import event_export
+import script
+from event_export import EventExporter, export_payloads, read_export
+from fakes import CALENDAR_DATA, FIXTURES, load_fixture
+
+def get_users():
+    return {name.split(".")[0]: script.get_module_calendars(load_fixture(name)) for name in CALENDAR_DATA}
+
+def as_row(record):
+    row = dict(zip(event_export.EVENT_COLUMNS, record))
+    return {column: list(value) if column in event_export.LIST_COLUMNS else value for column, value in row.items()}
+
+def export_users(directory, format="jsonl", row_group_size=40):
+    # Small row groups and buffers, so partitions are written in several parts
+    exporter = EventExporter(str(directory), format, row_group_size, max_buffered=100)
+    for user, module_calendars in get_users().items():
+        exporter.add(user, module_calendars)
+    return exporter.close()
+
+def check_round_trip(directory):
+    users = get_users()
+    records = {record.id: record for calendars in users.values() for events in calendars.values() for record in events}
+
+    events = list(read_export(str(directory), "events"))
+    assert sorted(events, key=lambda row: row['id']) == sorted(map(as_row, records.values()), key=lambda row: row['id'])
+
+    user_events = sorted((row['user'], row['id'], row['start'], row['module'])
+                         for row in read_export(str(directory), "user_events"))
+    assert user_events == sorted((user, record.id, record.start, record.module) for user, calendars in users.items()
+                                 for events in calendars.values() for record in events)
+
+def test_jsonl_round_trip(tmp_path):
+    manifest = export_users(tmp_path / "export")
+
+    assert manifest['counts']['events'] == len(list(read_export(str(tmp_path / "export"))))
+    check_round_trip(tmp_path / "export")
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    export_users(tmp_path / "export", "parquet")
+
+    check_round_trip(tmp_path / "export")
+
+def test_events_without_start_are_exported(tmp_path):
+    export_users(tmp_path / "export")
+
+    rows = {row['id']: row for row in read_export(str(tmp_path / "export"))}
+    assert rows["edge-12"]['start'] is None
+    assert (tmp_path / "export" / "events" / f"month={event_export.UNKNOWN_MONTH}").is_dir()
+
+def test_used_directory_is_refused(tmp_path):
+    # What a run that failed before close() leaves behind: partitions without a manifest
+    (tmp_path / "export" / "events").mkdir(parents=True)
+
+    with pytest.raises(Exception, match="not empty"):
+        EventExporter(str(tmp_path / "export"))
+    with pytest.raises(SystemExit):
+        event_export.parse_args([str(tmp_path / "export"), "--json", str(FIXTURES)])
+
+def test_export_payloads(tmp_path):
+    manifest = export_payloads([str(FIXTURES)], str(tmp_path / "export"), "jsonl")
+
+    with open(tmp_path / "export" / event_export.MANIFEST_NAME, encoding="utf-8") as f:
+        assert json.load(f) == manifest
+    check_round_trip(tmp_path / "export")
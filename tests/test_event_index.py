@@ -0,0 +1,58 @@
+import random
+from datetime import datetime, timedelta
+
+from event_index import EventIndex, get_time_key
+from script import EventRecord
+
+ROOMS = ["Amphi A", "Amphi B", "Salle 104"]
+DAY = datetime(2026, 9, 7)
+
+def make_records(count, seed=0):
+    rng = random.Random(seed)
+    records = []
+    for index in range(count):
+        start = DAY + timedelta(minutes=15 * rng.randrange(4 * 24 * 5))
+        # Some events have no end, as CELCAT sometimes sends them
+        end = None if rng.random() < 0.1 else start + timedelta(minutes=15 * rng.randrange(1, 16))
+        records.append(EventRecord(str(index), get_time_key(start), end and get_time_key(end), f"Course {index}", "",
+                                   "CM", "031", tuple(rng.sample(ROOMS, rng.randint(0, 2))), (), ()))
+    return records
+
+def brute_force_overlapping(records, start, end, room=None):
+    start, end = get_time_key(start), get_time_key(end)
+    found = []
+    for record in records:
+        if room is not None and room not in record.locations:
+            continue
+        record_end = record.end or record.start
+        if record.start < end and (record_end > start or record_end == record.start >= start):
+            found.append(record.id)
+    return sorted(found)
+
+def test_overlapping_matches_brute_force():
+    rng = random.Random(1)
+    records = make_records(2000)
+    index = EventIndex(records)
+
+    for _ in range(500):
+        start = DAY + timedelta(minutes=5 * rng.randrange(12 * 24 * 5))
+        end = start + timedelta(minutes=5 * rng.randrange(0, 12 * 24))
+        room = rng.choice([None] + ROOMS)
+        found = index.overlapping(start, end, "locations" if room else None, room)
+
+        assert sorted(record.id for record in found) == brute_force_overlapping(records, start, end, room)
+
+def test_at_finds_events_without_end():
+    start = DAY + timedelta(hours=10)
+    record = EventRecord("1", get_time_key(start), None, "Course", "", "CM", "031", ("Amphi A",), (), ())
+    index = EventIndex([record])
+
+    assert index.at(start) == [record]
+    assert index.at(start, "locations", "Amphi A") == [record]
+    assert index.at(start - timedelta(seconds=1)) == []
+    assert index.at(start + timedelta(seconds=1)) == []
+
+def test_events_without_start_are_left_out():
+    record = EventRecord("1", None, None, "Course", "", "CM", "031", (), (), ())
+
+    assert len(EventIndex([record])) == 0
@@ -0,0 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from event_store import EventStore
+
+def make_event(index):
+    return {
+        'id': f"ev{index}",
+        'start': "2026-09-01T10:00:00",
+        'end': "2026-09-01T12:00:00",
+        'description': "Cours<br />031 Anatomie<br />A101",
+        'eventCategory': "CM",
+        'modules': ["031 Anatomie"],
+        'studentMark': index,
+    }
+
+def test_same_event_is_parsed_once():
+    store = EventStore()
+    first = store.get(make_event(1))
+    # Per-student fields don't make it another event
+    assert store.get(dict(make_event(1), studentMark=2)) is first
+    assert store.stats() == {'lookups': 2, 'unique_events': 1, 'overlap_factor': 2.0}
+
+def test_lookups_are_counted_across_threads():
+    store = EventStore()
+    events = [make_event(index % 50) for index in range(20000)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        records = list(pool.map(store.get, events))
+
+    assert store.lookups == len(events)
+    assert len(store) == 50
+    assert len({id(record) for record in records}) == 50
@@ -0,0 +1,130 @@
+import gzip
+import http.client
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import feed_server
+from feed_server import FeedRequestHandler, FeedStore, get_feed_token
+from fakes import load_fixture
+
+SECRET = b"test secret"
+
+@pytest.fixture
+def server(monkeypatch):
+    feeds = FeedStore()
+    feeds.update("FID", load_fixture("calendar_data_class_a.json"))
+    monkeypatch.setattr(FeedRequestHandler, "feeds", feeds)
+    monkeypatch.setattr(FeedRequestHandler, "secret", SECRET)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def request(server, calendar="Main", method="GET", headers=None):
+    connection = http.client.HTTPConnection(server.removeprefix("http://"))
+    connection.request(method, f"/feeds/FID/{get_feed_token(SECRET, 'FID')}/{calendar}.ics", headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, response.headers, body
+
+def get_status(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def test_feed_needs_the_user_token(server):
+    token = get_feed_token(SECRET, "FID")
+
+    assert get_status(f"{server}/feeds/FID/{token}/Main.ics") == 200
+    assert get_status(f"{server}/feeds/FID/Main.ics") == 404
+    assert get_status(f"{server}/feeds/FID/{'0' * len(token)}/Main.ics") == 404
+    assert get_status(f"{server}/feeds/OTHER/{token}/Main.ics") == 404
+
+def test_tokens_differ_per_user_and_secret():
+    assert get_feed_token(SECRET, "FID") != get_feed_token(SECRET, "OTHER")
+    assert get_feed_token(SECRET, "FID") != get_feed_token(b"other secret", "FID")
+
+def test_secret_is_kept_between_runs(tmp_path, monkeypatch):
+    monkeypatch.delenv("FEED_SECRET", raising=False)
+    path = tmp_path / "secret"
+
+    secret = feed_server.load_feed_secret(str(path))
+
+    assert feed_server.load_feed_secret(str(path)) == secret
+    assert path.stat().st_mode & 0o777 == 0o600
+
+def test_etag_revalidation(server):
+    status, headers, body = request(server)
+    etag = headers["ETag"]
+    assert status == 200 and body.startswith(b"BEGIN:VCALENDAR")
+    assert headers["Content-Type"] == "text/calendar; charset=utf-8"
+
+    status, headers, body = request(server, headers={"If-None-Match": etag})
+    assert (status, body, headers["ETag"]) == (304, b"", etag)
+    assert request(server, headers={"If-None-Match": f'"other", W/{etag}'})[0] == 304
+    assert request(server, headers={"If-None-Match": '"other"'})[0] == 200
+
+def test_if_modified_since(server):
+    last_modified = request(server)[1]["Last-Modified"]
+
+    assert request(server, headers={"If-Modified-Since": last_modified})[0] == 304
+    assert request(server, headers={"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"})[0] == 200
+    assert request(server, headers={"If-Modified-Since": "not a date"})[0] == 200
+    # An ETag that doesn't match wins over the date
+    assert request(server, headers={"If-Modified-Since": last_modified, "If-None-Match": '"other"'})[0] == 200
+
+def test_gzip_negotiation(server):
+    _, plain_headers, plain = request(server)
+    status, headers, body = request(server, headers={"Accept-Encoding": "br, gzip"})
+
+    assert status == 200
+    assert headers["Content-Encoding"] == "gzip" and headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(body) == plain
+    assert headers["ETag"] != plain_headers["ETag"]
+    assert "Content-Encoding" not in request(server, headers={"Accept-Encoding": "gzip;q=0"})[1]
+    # The plain ETag doesn't validate the gzip representation
+    assert request(server, headers={"Accept-Encoding": "gzip", "If-None-Match": plain_headers["ETag"]})[0] == 200
+
+def test_head_has_no_body(server):
+    status, headers, body = request(server, method="HEAD")
+
+    assert (status, body) == (200, b"")
+    assert int(headers["Content-Length"]) == len(request(server)[2])
+
+def test_unknown_calendar(server):
+    assert request(server, calendar="999")[0] == 404
+
+def test_update_skips_unchanged_data():
+    feeds = FeedStore()
+    data = load_fixture("calendar_data_class_a.json")
+    assert feeds.update("FID", data)
+    feed = feeds.get("FID", "Main")
+
+    assert not feeds.update("FID", [dict(event) for event in data])
+    assert feeds.get("FID", "Main") is feed
+
+    assert feeds.update("FID", data[1:])
+    assert feeds.get("FID", "Main").etag != feed.etag
+
+def test_refresh_loop_renews_the_store(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    stop_event = threading.Event()
+    stores = []
+
+    def refresh_feeds(feeds, users, viewer, months, cache, store, secret):
+        stores.append(store)
+        if len(stores) == 3:
+            stop_event.set()
+    monkeypatch.setattr(feed_server, "refresh_feeds", refresh_feeds)
+
+    feed_server.run_refresh_loop(FeedStore(), [], (None, None), 1, 0, stop_event, SECRET)
+
+    assert len(stores) == 3 and len({id(store) for store in stores}) == 3
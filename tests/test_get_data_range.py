@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import pytest
+
+import script
+from fakes import FakeCelcatSession, load_fixture
+
+def make_event(event_id, start, end):
+    return dict(load_fixture("calendar_data_class_a.json")[0], id=event_id, start=start, end=end)
+
+def test_month_ranges_include_their_last_day():
+    assert script.get_month_range(2026, 9) == (datetime(2026, 9, 1), datetime(2026, 9, 30))
+    assert script.get_month_range(2026, 12) == (datetime(2026, 12, 1), datetime(2026, 12, 31))
+
+@pytest.mark.parametrize("chunk", ["month", "week"])
+def test_chunks_meet_without_gap_or_overlap(chunk):
+    chunks = script.split_date_range(datetime(2026, 9, 3), datetime(2026, 11, 17), chunk)
+
+    assert chunks[0][0] == datetime(2026, 9, 3) and chunks[-1][1] == datetime(2026, 11, 17)
+    assert all((second[0] - first[1]).days == 1 for first, second in zip(chunks, chunks[1:]))
+
+def test_events_where_chunks_meet():
+    events = [
+        make_event("last-day", "2026-09-30T16:00:00", "2026-09-30T18:00:00"),
+        make_event("first-day", "2026-10-01T08:00:00", "2026-10-01T10:00:00"),
+        make_event("midnight", "2026-09-30T23:00:00", "2026-10-01T01:00:00"),
+        make_event("outside", "2026-11-01T08:00:00", "2026-11-01T10:00:00"),
+    ]
+    session = FakeCelcatSession(events)
+
+    data = script.get_data_range(session, datetime(2026, 9, 1), datetime(2026, 10, 31), "FID", "month", 2)
+
+    assert sorted(session.requests) == [("2026-09-01", "2026-09-30"), ("2026-10-01", "2026-10-31")]
+    # Returned by both chunks, kept once
+    assert sorted(event['id'] for event in data) == ["first-day", "last-day", "midnight"]
+
+def test_week_chunks_return_every_event():
+    events = load_fixture("calendar_data_class_a.json")
+
+    data = script.get_data_range(FakeCelcatSession(events), datetime(2026, 9, 1), datetime(2026, 9, 30), "FID", "week", 4)
+
+    assert sorted(event['id'] for event in data) == sorted(event['id'] for event in events)
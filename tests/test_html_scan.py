@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import script
+from fakes import FIXTURES
+from html_scan import find_element
+
+bs4 = pytest.importorskip("bs4")
+
+PAGES_DIR = os.path.join(FIXTURES, "pages")
+PAGES = sorted(os.listdir(PAGES_DIR))
+
+# The extractors as they were with BeautifulSoup, the scan must agree with them
+
+def legacy_extract_verification_token(page):
+    soup = bs4.BeautifulSoup(page, 'html.parser')
+    token = soup.find('input', {'name': '__RequestVerificationToken'})
+    return token['value'] if token is not None else None
+
+def legacy_extract_login_error(page):
+    soup = bs4.BeautifulSoup(page, 'html.parser')
+    error_message = soup.find('span', {'data-valmsg-for': 'WrongCredentials'})
+    return error_message.text if error_message else None
+
+def legacy_extract_federation_id(page):
+    soup = bs4.BeautifulSoup(page, 'html.parser')
+    logout_link = soup.find('a', class_='logInOrOut')
+    if logout_link:
+        small_span = logout_link.find('span', class_='small')
+        if small_span:
+            federation_id = small_span.text.strip().split('-')[-1].strip()
+            if federation_id:
+                return federation_id
+    return None
+
+def load_page(name):
+    with open(os.path.join(PAGES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+@pytest.mark.parametrize("name", PAGES)
+def test_scan_matches_beautifulsoup(name):
+    page = load_page(name)
+
+    assert script.extract_verification_token(page) == legacy_extract_verification_token(page)
+    assert script.extract_login_error(page) == legacy_extract_login_error(page)
+    assert script.extract_federation_id_from_page("https://celcat/cal", page, []) == legacy_extract_federation_id(page)
+
+def test_login_page():
+    page = load_page("login.html")
+
+    assert script.extract_verification_token(page) == "CfDJ8Kq1-xYz_09AbC"
+    assert script.extract_login_error(page) == ""
+
+def test_login_page_without_token():
+    assert script.extract_verification_token(load_page("login_no_token.html")) is None
+
+def test_login_error_span():
+    page = load_page("login_error.html")
+
+    assert script.extract_verification_token(page) == "CfDJ8-second&token"
+    assert "Identifiant ou mot de passe incorrect\xa0!" in script.extract_login_error(page)
+
+def test_federation_id():
+    assert script.extract_federation_id_from_page("https://celcat/cal", load_page("calendar.html"), []) == "2212345"
+    assert script.extract_federation_id_from_page("https://celcat/cal", load_page("calendar_unclosed.html"), []) == "2298765"
+    # Falls back on the cookies when the logout link has no federation ID
+    assert script.extract_federation_id_from_page("https://celcat/cal", load_page("calendar_no_federation_id.html"),
+                                                  [("FederationId", "2200000")]) == "2200000"
+
+def test_find_element_stops_at_the_element():
+    attrs, text = find_element(load_page("calendar.html"), ('a', 'class', 'logInOrOut'), ('span', 'class', 'small'))
+
+    assert attrs == {'class': "small"}
+    assert text == "DUPONT Jean - 2212345"
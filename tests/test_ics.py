@@ -0,0 +1,68 @@
+import os
+import random
+from datetime import datetime
+
+import ics
+import metrics
+import script
+from fakes import CALENDAR_DATA, load_fixture
+
+NOW = "20260901T000000Z"
+
+def get_records(name="calendar_data_edge_cases.json"):
+    return {event['id']: script.parse_event(event) for event in load_fixture(name)}
+
+def unfold(text):
+    return text.replace("\r\n ", "")
+
+def test_event_without_start():
+    vevent = ics.format_event(get_records()["edge-12"], NOW)
+
+    assert "DTSTART:\r\n" in vevent
+    assert "DTEND" not in vevent
+    assert vevent.startswith("BEGIN:VEVENT\r\n") and vevent.endswith("END:VEVENT\r\n")
+
+def test_event_without_end():
+    vevent = ics.format_event(get_records()["edge-11"], NOW)
+
+    assert "DTSTART;TZID=Europe/Paris:20260907T080000\r\n" in vevent
+    assert "DTEND" not in vevent
+
+def test_generate_ical_with_missing_times():
+    calendar = script.generate_ical(list(get_records().values()), "Main")
+
+    assert calendar.count("BEGIN:VEVENT") == len(get_records())
+
+def test_fold_line_limits_octets():
+    rng = random.Random(1)
+    for _ in range(5000):
+        line = "".join(rng.choice("abcé€😀 ,;") for _ in range(rng.randint(0, 400)))
+        folded = ics.fold_line(line)
+
+        assert folded.endswith("\r\n")
+        assert all(len(part.encode("utf-8")) <= ics.MAX_LINE_OCTETS for part in folded[:-2].split("\r\n"))
+        assert unfold(folded) == line + "\r\n"
+
+def test_description_is_escaped_from_parts():
+    # The cached line built from escaped parts matches escaping the whole text
+    for name in CALENDAR_DATA:
+        for record in get_records(name).values():
+            expected = ics.fold_line("DESCRIPTION:" + ics.escape_text(ics.format_description(record)))
+            assert ics.format_description_property(record.description, record.locations, record.teachers,
+                                                   record.class_groups) == expected
+
+def test_escape_text():
+    assert ics.escape_text("a;b,c\\d\ne&amp;f\r") == "a\\;b\\,c\\\\d\\ne&f"
+    assert ics.escape_text(None) == ""
+
+def test_write_ical_files_counts_bytes(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS", metrics.Metrics())
+    module_calendars = script.get_module_calendars(load_fixture("calendar_data_edge_cases.json"))
+
+    files = script.write_ical_files(module_calendars, str(tmp_path), datetime(2026, 9, 1), datetime(2026, 9, 30))
+
+    snapshot = metrics.METRICS.snapshot()
+    assert snapshot['counters']['ics.bytes_written'] == sum(os.path.getsize(filename) for _, filename in files)
+    assert "ics.data_to_ical" not in snapshot['spans']
+    script.data_to_ical(load_fixture("calendar_data_edge_cases.json"))
+    assert metrics.METRICS.snapshot()['spans']['ics.data_to_ical']['count'] == 1
@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+
+import import_google
+from change_index import ChangeIndex
+from fakes import FakeGoogleService
+from rate_limit import AdaptiveRateLimiter
+from script import EventRecord
+
+START = datetime(2026, 9, 1)
+END = datetime(2026, 9, 30)
+
+def make_google_events(count):
+    events = []
+    for index in range(count):
+        start = import_google.PARIS_TZ.localize(START + timedelta(hours=index))
+        events.append((f"uid-{index}", import_google.get_google_event(f"Course {index}", "", start,
+                                                                      start + timedelta(hours=1))))
+    return events
+
+def test_insert_is_batched(unthrottled):
+    service = FakeGoogleService()
+    import_google.insert_google_events(service, "cal", make_google_events(120), batch_size=50)
+
+    assert service.batch_sizes == [50, 50, 20]
+    assert sorted(event['summary'] for event in service.calendars["cal"].values()) == \
+        sorted(f"Course {index}" for index in range(120))
+
+def test_clear_is_batched(unthrottled):
+    service = FakeGoogleService()
+    import_google.insert_google_events(service, "cal", make_google_events(120), batch_size=50)
+    service.batch_sizes = []
+
+    import_google.clear_calendar_range(service, "cal", START, END, batch_size=50)
+
+    assert service.calendars["cal"] == {}
+    assert service.batch_sizes == [50, 50, 20]
+
+def test_batch_size_is_capped(unthrottled):
+    service = FakeGoogleService()
+    import_google.insert_google_events(service, "cal", make_google_events(1200), batch_size=5000)
+
+    assert service.batch_sizes == [import_google.MAX_BATCH_SIZE, 200]
+
+def test_clear_removes_every_page(unthrottled):
+    # More events than one events.list page, deleting while still listing
+    # would move the later pages and skip events
+    service = FakeGoogleService()
+    count = import_google.MAX_LIST_RESULTS + 500
+    import_google.insert_google_events(service, "cal", make_google_events(count), batch_size=500)
+
+    import_google.clear_calendar_range(service, "cal", START, END + timedelta(days=365), batch_size=50)
+
+    assert service.calendars["cal"] == {}
+
+def no_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr(import_google, "backoff_delay", lambda attempt: delays.append(attempt) or 0)
+    return delays
+
+def test_failed_batch_calls_are_retried(unthrottled, monkeypatch):
+    delays = no_backoff(monkeypatch)
+    errors = [(429, "rateLimitExceeded"), (403, "userRateLimitExceeded"), (503, "backendError")]
+    service = FakeGoogleService(errors=errors * 2)
+
+    inserted, failed = import_google.execute_batch(
+        service, ((uid, import_google.insert_request(service, "cal", event)) for uid, event in make_google_events(120)),
+        batch_size=50)
+
+    assert failed == {}
+    assert len(inserted) == 120 and len(service.calendars["cal"]) == 120
+    # Only the six failed calls of the first batch were sent again
+    assert service.batch_sizes == [50, 6, 50, 20]
+    assert delays == [0]
+
+def test_rate_limit_errors_slow_down(monkeypatch):
+    no_backoff(monkeypatch)
+    limiter = AdaptiveRateLimiter(rate=1000, burst=1000, max_rate=1000)
+    service = FakeGoogleService(errors=[(403, "rateLimitExceeded")] * 3)
+    chunk = [(uid, import_google.insert_request(service, "cal", event)) for uid, event in make_google_events(10)]
+    results, errors = {}, {}
+
+    import_google.execute_batch_chunk(service, chunk, results, errors, max_retries=5, limiter=limiter)
+
+    assert limiter.throttled == 1
+    assert limiter.rate < 600
+    assert len(results) == 10 and errors == {}
+
+def test_errors_are_reported_after_retries(unthrottled, monkeypatch):
+    delays = no_backoff(monkeypatch)
+    service = FakeGoogleService(errors=[(403, "forbidden"), (429, "rateLimitExceeded")] + [None] * 3 +
+                                [(429, "rateLimitExceeded")] * 3)
+
+    inserted, failed = import_google.execute_batch(
+        service, ((uid, import_google.insert_request(service, "cal", event)) for uid, event in make_google_events(5)),
+        max_retries=3)
+
+    # The forbidden call is not retried, the throttled one gives up after max_retries
+    assert sorted(failed) == ["uid-0", "uid-1"]
+    assert [e.resp.status for _, e in sorted(failed.items())] == [403, 429]
+    assert len(inserted) == 3
+    assert delays == [0, 1, 2]
+
+def make_records(month, count):
+    return [EventRecord(f"{month}-{day}", f"2026-{month:02d}-{day:02d}T08:00:00", f"2026-{month:02d}-{day:02d}T10:00:00",
+                        f"CM - Course {day}", "CM", "CM", "031 Anatomie", ("Amphi A",), (), ())
+            for day in range(1, count + 1)]
+
+def test_new_range_is_fully_synced(unthrottled, tmp_path):
+    service = FakeGoogleService()
+    index = ChangeIndex(str(tmp_path / "index.sqlite3"))
+    september, october = make_records(9, 3), make_records(10, 3)
+    # Left by the clear-then-insert import, without CELCAT ids
+    import_google.insert_google_events(service, "cal", import_google.records_to_google_events(october))
+
+    import_google.push_google_changes(service, "031", "cal", september, START, END, index)
+    import_google.push_google_changes(service, "031", "cal", october, datetime(2026, 10, 1), datetime(2026, 10, 31), index)
+
+    events = list(service.calendars["cal"].values())
+    assert sorted(event['extendedProperties']['private']['celcatUid'] for event in events if 'extendedProperties' in event) == \
+        sorted(record.id for record in september + october)
+    assert len(events) == 6
+
+    # Both months are known now, an unchanged push writes nothing
+    service.batch_sizes = []
+    import_google.push_google_changes(service, "031", "cal", september + october, START, datetime(2026, 10, 31), index)
+    assert service.batch_sizes == []
+
+def test_unchanged_resync_writes_nothing(unthrottled):
+    service = FakeGoogleService()
+    google_events = make_google_events(120)
+    first = import_google.sync_google_events(service, "cal", google_events, START, END, batch_size=50)
+    assert first['inserted'] == 120
+    stored = {event_id: dict(event) for event_id, event in service.calendars["cal"].items()}
+    service.batch_sizes = []
+
+    counts = import_google.sync_google_events(service, "cal", make_google_events(120), START, END, batch_size=50)
+
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 120, 'failed': 0}
+    # Only the list calls ran, no batch was executed
+    assert service.batch_sizes == []
+    assert service.calendars["cal"] == stored
+
+def test_resync_patches_changed_events(unthrottled):
+    service = FakeGoogleService()
+    import_google.sync_google_events(service, "cal", make_google_events(10), START, END)
+    google_events = make_google_events(9)
+    google_events[0][1]['summary'] = "Moved course"
+
+    counts = import_google.sync_google_events(service, "cal", google_events, START, END)
+
+    assert counts == {'inserted': 0, 'updated': 1, 'deleted': 1, 'unchanged': 8, 'failed': 0}
+    assert "Moved course" in {event['summary'] for event in service.calendars["cal"].values()}
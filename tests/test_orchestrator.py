@@ -0,0 +1,40 @@
+import builtins
+
+import import_google
+import orchestrator
+import script
+from fakes import FakeGoogleService, load_fixture
+
+ARGS = ["--from", "2026-09-01", "--to", "2026-09-30"]
+
+def run(monkeypatch, answers):
+    answers = iter(answers)
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(answers))
+    orchestrator.main(ARGS)
+
+def test_reused_export_is_pushed_incrementally(unthrottled, monkeypatch, tmp_path, capsys):
+    monkeypatch.chdir(tmp_path)
+    data = load_fixture("calendar_data_class_a.json")
+    monkeypatch.setattr(script, "load_cached_session", lambda username: (object(), "FID"))
+    monkeypatch.setattr(script, "get_data_range", lambda *args: data)
+    service = FakeGoogleService()
+    monkeypatch.setattr(import_google, "get_google_credentials", lambda: None)
+    monkeypatch.setattr(import_google, "get_google_calendar_service", lambda credentials=None: service)
+    monkeypatch.setattr(import_google, "CALENDAR_IDS", {"031": "c31", "032": "c32", "Other": "cother"})
+
+    read_back = []
+    monkeypatch.setattr(import_google, "ics_to_google_events", read_back.append)
+
+    # username, import all sub-calendars, push to Google, incremental sync
+    run(monkeypatch, ["user", "", "y", "y"])
+    pushed = {calendar_id: dict(events) for calendar_id, events in service.calendars.items()}
+    assert sum(map(len, pushed.values())) > 0
+    capsys.readouterr()
+
+    service.batch_sizes = []
+    run(monkeypatch, ["user", "y", "y"])
+
+    assert "has not changed since the last export" in capsys.readouterr().out
+    assert read_back == []
+    assert service.calendars == pushed
+    assert service.batch_sizes == []
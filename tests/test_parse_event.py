@@ -0,0 +1,68 @@
+import html
+import json
+
+import pytest
+
+import script
+from fakes import CALENDAR_DATA, load_fixture
+
+def legacy_parse_event(event):
+    # parse_event before the precompiled classifier, kept as the reference
+    description_lines = event['description'].split('<br />')
+    
+    title = f"{event['eventCategory']} - {event['modules'][0]}" if event['modules'] else f"{event['eventCategory']} - Other"
+    description = description_lines[0].strip()
+    
+    locations = []
+    teachers = []
+    class_groups = []
+    
+    for line in description_lines[1:]:
+        line = html.unescape(line.strip())
+        
+        if any(keyword in line.lower() for keyword in ["porte", "amphi", "espace modulaire", "salle"]):
+            locations.append(line)
+        elif '[' in line and ']' in line and any(class_keyword in line.lower() for class_keyword in ["vet", "classe", "group"]):
+            class_groups.append(line)
+        elif line and not any(keyword in line.lower() for keyword in ["td", "cm", "e-learning", "journée thématique", "porte", "amphi", "conférences", "congrès", "[", "]", "03", "auto-évaluation en ligne", "travail", "tp", "tp/td","contrôle", "forum"]):
+            teachers.append(line)
+    
+    return {
+        "title": title,
+        "description": description,
+        "locations": locations,
+        "teachers": teachers,
+        "class_groups": class_groups,
+        "category": event['eventCategory'],
+        "module": event['modules'][0] if event['modules'] else "Other"
+    }
+
+def as_legacy_details(record):
+    return {
+        "title": record.title,
+        "description": record.description,
+        "locations": list(record.locations),
+        "teachers": list(record.teachers),
+        "class_groups": list(record.class_groups),
+        "category": record.category,
+        "module": record.module,
+    }
+
+def serialize(details):
+    return json.dumps(details, ensure_ascii=False).encode("utf-8")
+
+@pytest.mark.parametrize("name", CALENDAR_DATA)
+def test_parse_event_matches_legacy(name):
+    for event in load_fixture(name):
+        record = script.parse_event(event)
+        assert serialize(as_legacy_details(record)) == serialize(legacy_parse_event(event)), event['id']
+        assert (record.id, record.start, record.end) == (event['id'], event['start'], event['end'])
+
+def test_classification_of_edge_cases():
+    records = {event['id']: script.parse_event(event) for event in load_fixture("calendar_data_edge_cases.json")}
+
+    assert records["edge-1"].locations == ("Salle 1&2",)
+    assert records["edge-1"].teachers == ("DÉSIRÉ Marie",)
+    assert records["edge-1"].class_groups == ("[VET] Classe A1",)
+    assert records["edge-3"].locations == ("SALLE É",)
+    assert records["edge-7"].module == "Other"